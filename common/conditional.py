@@ -0,0 +1,47 @@
+import hashlib
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+
+class ConditionalGetMixin:
+    """
+    ETag support for read actions.
+
+    The ETag hashes the request path with the version stamps returned by the
+    view's get_validator_parts() (products.cache.CachedReadMixin provides one
+    from its generations, which every write bumps), so a matching If-None-Match is answered with 304 without
+    touching the database. The generations must live in a cache every worker
+    shares (see products.checks). There is no Last-Modified: a delete has no
+    timestamp to move it forward, and a date can't be derived from a stamp.
+    Responses also get Cache-Control (max-age from settings.CATALOG_HTTP_MAX_AGE)
+    so a proxy can keep them and revalidate with the same ETag.
+    """
+    conditional_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request, *args, **kwargs)
+
+    def get_etag(self, request):
+        parts = [request.get_full_path(), request.accepted_media_type or '', *self.get_validator_parts(request)]
+        return '"%s"' % hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        action = getattr(self, 'action', None) or request.method.lower()
+        if action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+
+        etag = self.get_etag(request)
+        response = get_conditional_response(request._request, etag=etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response['ETag'] = etag
+        patch_cache_control(response, max_age=getattr(settings, 'CATALOG_HTTP_MAX_AGE', 0), must_revalidate=True)
+        # Responses differ per user only through authentication, which a proxy must key on
+        patch_vary_headers(response, ['Authorization', 'Accept'])
+        return response
@@ -0,0 +1,26 @@
+import re
+from django.db import connection
+
+# SQLite plans say 'SCAN products_product' (no USING ...) for a full scan, Postgres 'Seq Scan on ...'.
+# Virtual tables (FTS5) always show up as SCAN ... VIRTUAL TABLE INDEX and use their own index.
+SQLITE_SCAN = re.compile(r'\bSCAN (\w+)(.*)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+
+def full_scans(queryset):
+    """
+    Returns the tables a queryset reads with a full table scan, from the
+    backend's EXPLAIN output. On Postgres sequential scans are disabled for
+    the check so tiny test tables don't hide a missing index.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return POSTGRES_SCAN.findall(queryset.explain())
+
+    scans = []
+    for line in queryset.explain().splitlines():
+        match = SQLITE_SCAN.search(line)
+        if match and 'USING' not in match.group(2) and 'VIRTUAL TABLE INDEX' not in match.group(2):
+            scans.append(match.group(1))
+    return scans
@@ -0,0 +1,136 @@
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from orders.models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+LOCK_POLL_INTERVAL = 0.05
+
+
+def request_fingerprint(request):
+    """Hash of what makes two requests "the same": method, path and the parsed body"""
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    raw = f'{request.method} {request.get_full_path()}\n{body}'
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class IdempotencyMixin:
+    """
+    Honours an Idempotency-Key header on write actions, so a client can retry a
+    POST without running it twice. Actions listed in `idempotent_actions` are
+    covered automatically for `create`; other handlers go through
+    idempotent_response().
+
+    The first request with a key claims an IdempotencyKey row (unique per user,
+    endpoint and key, so every worker and pod agrees on who runs it) and stores
+    its response there for IDEMPOTENCY_KEY_TTL seconds. Later requests with the
+    key get that response back without running the handler (marked with an
+    Idempotent-Replayed header), or 422 if the body differs. A duplicate
+    arriving while the first is still running waits for it rather than racing
+    it. Nothing is stored when the handler raises (e.g. validation errors,
+    which roll back) or returns a 5xx, so those can be retried.
+    """
+    idempotent_actions = ('create',)
+
+    def create(self, request, *args, **kwargs):
+        return self.idempotent_response(super().create, request, *args, **kwargs)
+
+    def get_idempotency_scope(self):
+        return f'{self.__class__.__name__}.{getattr(self, "action", None) or self.request.method.lower()}'
+
+    def replay(self, claim, fingerprint):
+        if claim.fingerprint != fingerprint:
+            return Response(
+                {'error': f'{HEADER} was already used for a different request'},
+                status=status.HTTP_422_UNPROCESSABLE_ENTITY
+            )
+        response = Response(claim.response, status=claim.status_code)
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def claim_key(self, request, key, fingerprint, token):
+        """
+        Returns None once this request owns the key, or the response to send
+        instead: a replay, a 422 for a different body, or a 409 if the request
+        holding the key doesn't finish within IDEMPOTENCY_LOCK_TIMEOUT.
+        """
+        lookup = {'user': request.user, 'scope': self.get_idempotency_scope(), 'key': key}
+        lock_timeout = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 30))
+        ttl = timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+        deadline = time.monotonic() + lock_timeout.total_seconds()
+        while True:
+            now = timezone.now()
+            claim = IdempotencyKey.objects.filter(**lookup).first()
+            if claim is None:
+                try:
+                    # Savepoint, so a lost insert race doesn't break a surrounding transaction
+                    with transaction.atomic():
+                        IdempotencyKey.objects.create(**lookup, fingerprint=fingerprint, lock_token=token, created_at=now)
+                    return None
+                except IntegrityError:
+                    continue
+            if claim.created_at <= now - ttl:
+                # Expired: drop it (unless someone else just did) and start over
+                IdempotencyKey.objects.filter(pk=claim.pk, created_at=claim.created_at).delete()
+                continue
+            if claim.status_code is not None or claim.fingerprint != fingerprint:
+                return self.replay(claim, fingerprint)
+            if claim.created_at <= now - lock_timeout:
+                # The holder is presumed dead; take over, unless another duplicate got there first
+                taken = IdempotencyKey.objects.filter(pk=claim.pk, lock_token=claim.lock_token, status_code=None).update(
+                    lock_token=token, created_at=now
+                )
+                if taken:
+                    return None
+                continue
+            if time.monotonic() >= deadline:
+                return Response(
+                    {'error': f'A request with this {HEADER} is still in progress'},
+                    status=status.HTTP_409_CONFLICT
+                )
+            # A duplicate is in flight: wait for its response instead of running the handler again
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def idempotent_response(self, handler, request, *args, **kwargs):
+        action = getattr(self, 'action', None) or request.method.lower()
+        key = request.headers.get(HEADER)
+        if action not in self.idempotent_actions or key is None:
+            return handler(request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be 1 to {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        token = uuid.uuid4().hex
+        response = self.claim_key(request, key, fingerprint, token)
+        if response is not None:
+            return response
+
+        # Every write below is guarded by our token, so a request that outlived its
+        # lock can't overwrite or release the claim of the one that took over
+        owned = IdempotencyKey.objects.filter(
+            user=request.user, scope=self.get_idempotency_scope(), key=key, lock_token=token
+        )
+        try:
+            response = handler(request, *args, **kwargs)
+        except Exception:
+            owned.delete()
+            raise
+        if response.status_code >= 500:
+            owned.delete()
+        elif not owned.update(status_code=response.status_code, response=response.data, lock_token=''):
+            logger.warning(f"{HEADER} {key} was taken over before its response could be stored")
+        return response
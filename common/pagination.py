@@ -1,9 +1,163 @@
-from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination, CursorPagination
+import base64
+import datetime
+import hashlib
+import json
+import math
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination, LimitOffsetPagination, CursorPagination
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from collections import OrderedDict
 
+COUNT_MODES = ('exact', 'cached', 'estimated', 'none')
 
-class StandardResultsSetPagination(PageNumberPagination):
+
+def cached_count(queryset):
+    """COUNT(*) kept for PAGINATION_COUNT_CACHE_TIMEOUT seconds, keyed by the query's SQL"""
+    sql, params = queryset.query.sql_with_params()
+    key = 'pagination:count:%s' % hashlib.md5(f'{queryset.db}:{sql}:{params!r}'.encode()).hexdigest()
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, getattr(settings, 'PAGINATION_COUNT_CACHE_TIMEOUT', 60))
+    return count
+
+
+def estimated_count(queryset):
+    """
+    Planner row estimate on Postgres: pg_class.reltuples for a whole table,
+    the EXPLAIN estimate for a filtered queryset. Small estimates are not worth
+    the error, so below PAGINATION_ESTIMATE_THRESHOLD (and on other backends)
+    this falls back to cached_count().
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        if not queryset.query.where and not queryset.query.distinct:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            estimate = int(row[0]) if row else 0
+        else:
+            plan = json.loads(queryset.order_by().explain(format='json'))
+            estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= getattr(settings, 'PAGINATION_ESTIMATE_THRESHOLD', 10000):
+            return estimate
+    return cached_count(queryset)
+
+
+class LookaheadPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def start_index(self):
+        return (self.number - 1) * self.paginator.per_page + 1 if self.object_list else 0
+
+
+class LookaheadPaginator(Paginator):
+    """
+    Pages without COUNT(*): fetches page_size + 1 rows and knows there is a
+    next page when the extra row comes back. count/num_pages are never used.
+    """
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(self.error_messages['no_results'])
+        return LookaheadPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
+
+
+class CountModeMixin:
+    """
+    Page-number pagination with a selectable cost for `count`:
+
+        exact      COUNT(*) on every page (the default)
+        cached     COUNT(*) reused for PAGINATION_COUNT_CACHE_TIMEOUT seconds
+        estimated  planner estimate on Postgres, cached count elsewhere
+        none       no count at all; count and total_pages are null
+
+    Every mode but 'exact' pages with LookaheadPaginator, so has_next/next come
+    from one extra row rather than from the count. Clients pick a mode with
+    ?count=; views set a default with `pagination_count_mode`, either a mode
+    or a dict of modes by action.
+    """
+    count_query_param = 'count'
+    default_count_mode = 'exact'
+
+    def get_count_mode(self, request, view=None):
+        mode = request.query_params.get(self.count_query_param)
+        if mode is None:
+            mode = getattr(view, 'pagination_count_mode', None) or self.default_count_mode
+            if isinstance(mode, dict):
+                mode = mode.get(getattr(view, 'action', None), self.default_count_mode)
+        if mode not in COUNT_MODES:
+            raise ValidationError({self.count_query_param: [f"Must be one of: {', '.join(COUNT_MODES)}."]})
+        return mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = self.get_count_mode(request, view)
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            self.page = LookaheadPaginator(queryset, page_size).page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        self.queryset = queryset
+        self.request = request
+        return list(self.page)
+
+    def get_count(self):
+        if self.count_mode == 'exact':
+            return self.page.paginator.count
+        if not hasattr(self, '_count'):
+            counters = {'cached': cached_count, 'estimated': estimated_count}
+            self._count = counters[self.count_mode](self.queryset) if self.count_mode in counters else None
+        return self._count
+
+    def get_total_pages(self):
+        if self.count_mode == 'exact':
+            return self.page.paginator.num_pages
+        count = self.get_count()
+        return max(1, math.ceil(count / self.page.paginator.per_page)) if count is not None else None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.get_count()),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class StandardResultsSetPagination(CountModeMixin, PageNumberPagination):
     """
     Standard pagination for most endpoints
     """
@@ -13,8 +167,8 @@ class StandardResultsSetPagination(PageNumberPagination):
     
     def get_paginated_response(self, data):
         return Response(OrderedDict([
-            ('count', self.page.paginator.count),
-            ('total_pages', self.page.paginator.num_pages),
+            ('count', self.get_count()),
+            ('total_pages', self.get_total_pages()),
             ('current_page', self.page.number),
             ('page_size', self.page.paginator.per_page),
             ('next', self.get_next_link()),
@@ -23,7 +177,7 @@ class StandardResultsSetPagination(PageNumberPagination):
         ]))
 
 
-class LargeResultsSetPagination(PageNumberPagination):
+class LargeResultsSetPagination(CountModeMixin, PageNumberPagination):
     """
     Pagination for large datasets (products, orders)
     """
@@ -33,8 +187,8 @@ class LargeResultsSetPagination(PageNumberPagination):
     
     def get_paginated_response(self, data):
         return Response(OrderedDict([
-            ('count', self.page.paginator.count),
-            ('total_pages', self.page.paginator.num_pages),
+            ('count', self.get_count()),
+            ('total_pages', self.get_total_pages()),
             ('current_page', self.page.number),
             ('page_size', self.page.paginator.per_page),
             ('next', self.get_next_link()),
@@ -45,7 +199,7 @@ class LargeResultsSetPagination(PageNumberPagination):
         ]))
 
 
-class SmallResultsSetPagination(PageNumberPagination):
+class SmallResultsSetPagination(CountModeMixin, PageNumberPagination):
     """
     Pagination for small datasets (categories)
     """
@@ -80,7 +234,8 @@ class TimestampCursorPagination(CursorPagination):
     Best for real-time data that changes frequently
     """
     page_size = 20
-    ordering = '-created_at'  # Must have an ordering field
+    # id breaks ties between rows with the same timestamp; matches the (customer, -created_at, -id) index
+    ordering = ('-created_at', '-id')
     cursor_query_param = 'cursor'
     page_size_query_param = 'page_size'
     
@@ -89,4 +244,176 @@ class TimestampCursorPagination(CursorPagination):
             ('next', self.get_next_link()),
             ('previous', self.get_previous_link()),
             ('results', data)
-        ]))
\ No newline at end of file
+        ]))
+
+
+def parse_ordering(request, allowed, default=('id',), param='ordering'):
+    """
+    Reads ?ordering=price,-name (fields from `allowed`) into an order_by tuple
+    that always ends with an id tiebreaker, in the first field's direction, so
+    the order is total and stable.
+    """
+    value = request.query_params.get(param)
+    fields = [field.strip() for field in value.split(',') if field.strip()] if value else list(default)
+    unknown = [field for field in fields if field.lstrip('-') not in allowed]
+    if unknown:
+        raise ValidationError({param: [f"Unknown field(s): {', '.join(unknown)}. Use: {', '.join(allowed)}."]})
+    return with_tiebreaker(fields)
+
+
+def with_tiebreaker(fields):
+    fields = list(fields)
+    if not any(field.lstrip('-') in ('id', 'pk') for field in fields):
+        fields.append('-id' if fields and fields[0].startswith('-') else 'id')
+    return tuple(fields)
+
+
+def keyset_filter(ordering, values):
+    """
+    Q for the rows strictly after `values` (one per ordering field) in `ordering`:
+    (a > x) OR (a = x AND b > y) ... A redundant a >= x in front lets the
+    database seek on an (a, b) index instead of scanning.
+    """
+    names = [field.lstrip('-') for field in ordering]
+    after = ['lt' if field.startswith('-') else 'gt' for field in ordering]
+    condition = Q()
+    for position, name in enumerate(names):
+        branch = Q(**{f'{names[index]}': values[index] for index in range(position)})
+        condition |= branch & Q(**{f'{name}__{after[position]}': values[position]})
+    return Q(**{f'{names[0]}__{after[0]}e': values[0]}) & condition
+
+
+def reverse_ordering(ordering):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in ordering)
+
+
+def cursor_value(value):
+    # Full precision: DjangoJSONEncoder would drop the microseconds of datetimes
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over any stable ordering: each page continues
+    from the ordering values of the last row it returned, so page 10,000 costs
+    the same as page 1 where OFFSET would walk every row before it.
+
+    Ordering comes from ?ordering= limited to the view's `ordering_fields`
+    (default: the view's `ordering`, else id); an id tiebreaker is always added.
+    Ordered fields must be non-null columns of the model itself.
+    """
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    mode_query_param = 'paginate'
+    invalid_cursor_message = 'Invalid cursor'
+
+    @classmethod
+    def requested(cls, request):
+        """Keyset pages are asked for with ?paginate=keyset; the links they hand out carry ?cursor="""
+        return request.query_params.get(cls.mode_query_param) == 'keyset' or cls.cursor_query_param in request.query_params
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_ordering(self, request, view):
+        allowed = getattr(view, 'ordering_fields', None) or ('id',)
+        return parse_ordering(request, allowed, getattr(view, 'ordering', None) or ('id',))
+
+    def decode_cursor(self, request):
+        """Returns (values, backwards) or None for the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values, backwards, ordering = cursor['v'], bool(cursor['b']), tuple(cursor['o'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        # A cursor only makes sense for the ordering it was taken from
+        if ordering != self.ordering or len(values) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, backwards
+
+    def encode_cursor(self, row, backwards):
+        values = [cursor_value(getattr(row, field.lstrip('-'))) for field in self.ordering]
+        cursor = json.dumps({'v': values, 'b': int(backwards), 'o': self.ordering}, separators=(',', ':'))
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, base64.urlsafe_b64encode(cursor.encode()).decode()
+        )
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, view)
+        cursor = self.decode_cursor(request)
+
+        backwards = bool(cursor and cursor[1])
+        ordering = reverse_ordering(self.ordering) if backwards else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if cursor:
+            try:
+                queryset = queryset.filter(keyset_filter(ordering, cursor[0]))
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        # One extra row says whether another page follows
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+            self.has_next, self.has_previous = cursor is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.page = rows
+        return rows
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], backwards=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], backwards=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+
+class KeysetPaginationMixin:
+    """
+    View mixin: actions in `keyset_actions` switch from the view's usual
+    pagination to KeysetPagination when the request asks for it
+    (?paginate=keyset, or a ?cursor= from a previous page).
+    """
+    keyset_actions = ('list',)
+    keyset_pagination_class = KeysetPagination
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and getattr(self, 'action', None) in self.keyset_actions \
+                and self.keyset_pagination_class.requested(self.request):
+            self._paginator = self.keyset_pagination_class()
+        return super().paginator
+
+    def order_queryset(self, queryset):
+        """Applies ?ordering= (with its id tiebreaker) for page-number requests too"""
+        if 'ordering' not in self.request.query_params:
+            return queryset
+        return queryset.order_by(*parse_ordering(self.request, self.ordering_fields, self.ordering))
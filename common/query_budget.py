@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.db import connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a view runs more queries than its declared budget"""
+
+
+class QueryCounter:
+    """
+    Database execute wrapper that counts (and keeps) the queries it sees.
+    Usage: with connection.execute_wrapper(QueryCounter()) as counter: ...
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+
+class QueryBudgetMixin:
+    """
+    Lets a view declare how many queries each action may run, e.g.
+
+        query_budget = {'list': 6, 'retrieve': 5}
+
+    Keys are viewset actions, or lowercase HTTP methods on plain APIViews. The
+    count covers the whole dispatch, including authentication. What happens on
+    overrun depends on settings.QUERY_BUDGET_ACTION: 'log' (default) logs a
+    warning, 'raise' raises QueryBudgetExceeded (used by tests), 'off' skips counting.
+    """
+    query_budget = {}
+
+    def get_budget_key(self):
+        # Viewset action name, or the HTTP method for plain APIViews
+        return getattr(self, 'action', None) or self.request.method.lower()
+
+    def get_query_budget(self):
+        return self.query_budget.get(self.get_budget_key())
+
+    def dispatch(self, request, *args, **kwargs):
+        mode = getattr(settings, 'QUERY_BUDGET_ACTION', 'log')
+        if mode == 'off':
+            return super().dispatch(request, *args, **kwargs)
+
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = super().dispatch(request, *args, **kwargs)
+
+        budget = self.get_query_budget()
+        if budget is not None and counter.count > budget:
+            message = (
+                f"{self.__class__.__name__}.{self.get_budget_key()} ran {counter.count} queries "
+                f"(budget {budget}): {counter.queries}"
+            )
+            if mode == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
@@ -0,0 +1,174 @@
+from operator import attrgetter
+from django.conf import settings
+from django.db import models
+from rest_framework import fields as drf_fields
+from rest_framework.fields import SkipField
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+
+def parse_fields_param(value):
+    """
+    Parses a sparse fieldset string into a nested dict, e.g.
+    'id,name,items.product.sku' -> {'id': {}, 'name': {}, 'items': {'product': {'sku': {}}}}
+    """
+    spec = {}
+    for item in value.split(','):
+        node = spec
+        for part in item.strip().split('.'):
+            if part:
+                node = node.setdefault(part, {})
+    return spec
+
+
+class SparseFieldsetMixin:
+    """
+    Read-side field selection driven by the request's query string.
+
+    ?fields=id,name,items.product.sku keeps only the listed fields (dotted names
+    reach into nested serializers). ?view=compact keeps Meta.compact_fields and
+    swaps in the fields returned by get_compact_field(). Fields in
+    Meta.optional_fields are only rendered when explicitly requested.
+    Fields that are dropped are never computed.
+    """
+    fields_query_param = 'fields'
+    view_query_param = 'view'
+
+    def get_fields(self):
+        fields = super().get_fields()
+        optional = getattr(self.Meta, 'optional_fields', [])
+
+        request = self.context.get('request')
+        if request is None or request.method not in SAFE_METHODS:
+            return {name: field for name, field in fields.items() if name not in optional}
+
+        if request.query_params.get(self.view_query_param) == 'compact':
+            compact = getattr(self.Meta, 'compact_fields', None)
+            if compact is not None:
+                fields = {name: field for name, field in fields.items() if name in compact or name in optional}
+            for name in list(fields):
+                field = self.get_compact_field(name)
+                if field is not None:
+                    fields[name] = field
+
+        requested = self.get_requested_fields(request)
+        if requested:
+            return {
+                name: field for name, field in fields.items()
+                if name in requested or field.write_only
+            }
+        return {name: field for name, field in fields.items() if name not in optional}
+
+    def get_compact_field(self, name):
+        """Returns a replacement field for `name` in the compact view, or None to keep it"""
+        return None
+
+    def get_requested_fields(self, request):
+        """Returns the part of ?fields= addressed to this serializer, or None for all fields"""
+        value = request.query_params.get(self.fields_query_param)
+        if not value:
+            return None
+
+        # Path of field names from the root serializer down to this one
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+
+        spec = parse_fields_param(value)
+        for name in path:
+            if name not in spec:
+                # The parent was requested as a whole (or this path is not mentioned)
+                return None
+            spec = spec[name]
+        return spec or None
+
+
+def _iso_datetime(field):
+    """Returns a converter equivalent to DateTimeField.to_representation for aware datetimes"""
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    fallback = field.to_representation
+
+    def convert(value):
+        if field_timezone is None or value.tzinfo is None:
+            return fallback(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+class FastRepresentationMixin:
+    """
+    Precompiles the readable fields of a serializer into (name, getter, converter)
+    steps the first time it renders, then reuses them for every row.
+
+    Plain model attributes are read with attrgetter and converted with cheap
+    equivalents of the DRF field methods. Everything else (nested serializers,
+    relations, dotted sources) goes through the regular field API, so output
+    is identical. Disable with settings.FAST_SERIALIZATION = False.
+    """
+
+    def to_representation(self, instance):
+        if not getattr(settings, 'FAST_SERIALIZATION', True):
+            return super().to_representation(instance)
+
+        plan = self.__dict__.get('_representation_plan')
+        if plan is None:
+            plan = self._representation_plan = self.compile_representation_plan()
+
+        ret = {}
+        for name, getter, convert in plan:
+            if getter is None:
+                # Generic path, mirrors Serializer.to_representation
+                field = convert
+                try:
+                    attribute = field.get_attribute(instance)
+                except SkipField:
+                    continue
+                check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+                ret[name] = None if check_for_none is None else field.to_representation(attribute)
+            else:
+                value = getter(instance)
+                ret[name] = None if value is None else convert(value)
+        return ret
+
+    def compile_representation_plan(self):
+        plan = []
+        model = getattr(getattr(self, 'Meta', None), 'model', None)
+        concrete = {f.attname for f in model._meta.concrete_fields} if model else set()
+
+        for field in self.fields.values():
+            if field.write_only:
+                continue
+            name = field.field_name
+            if isinstance(field, drf_fields.SerializerMethodField):
+                plan.append((name, lambda instance: instance, getattr(self, field.method_name)))
+                continue
+
+            simple = len(field.source_attrs) == 1 and field.source_attrs[0] in concrete
+            if not simple:
+                plan.append((name, None, field))
+                continue
+
+            getter = attrgetter(field.source_attrs[0])
+            if type(field) in (drf_fields.ReadOnlyField, drf_fields.ModelField):
+                plan.append((name, getter, lambda value: value))
+            elif type(field) is drf_fields.IntegerField:
+                plan.append((name, getter, int))
+            elif type(field) is drf_fields.CharField:
+                plan.append((name, getter, str))
+            elif type(field) is drf_fields.BooleanField and isinstance(model._meta.get_field(field.source), models.BooleanField):
+                plan.append((name, getter, bool))
+            elif (
+                type(field) is drf_fields.DateTimeField
+                and (getattr(field, 'format', api_settings.DATETIME_FORMAT) or '').lower() == drf_fields.ISO_8601
+            ):
+                plan.append((name, getter, _iso_datetime(field)))
+            else:
+                plan.append((name, getter, field.to_representation))
+        return plan
@@ -0,0 +1,42 @@
+import csv
+import json
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows, fieldnames):
+    writer = csv.DictWriter(Echo(), fieldnames=fieldnames, extrasaction='ignore')
+    yield writer.writeheader()
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def streaming_export(rows, fmt, filename, fieldnames=None):
+    """
+    Returns a StreamingHttpResponse that renders `rows` (an iterator of dicts)
+    as NDJSON or CSV one row at a time, so memory stays flat for any export size.
+    """
+    if fmt == 'csv':
+        content = csv_lines(rows, fieldnames)
+    else:
+        content = ndjson_lines(rows)
+    response = StreamingHttpResponse(content, content_type=EXPORT_FORMATS[fmt])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    return response
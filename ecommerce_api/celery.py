@@ -17,13 +17,31 @@ broker_url = "redis://localhost:6379"
 app.conf.broker_url = BROKER_URL
 CELERY_BROKER_URL = BROKER_URL
 app.conf.beat_schedule = {
-
-"""'
-Test celery worker
-send_admin_message': {
-    'task': 'home.tasks.test_task',
-    'schedule': 3,
-},"""
+    # Sends order notifications from the outbox, off the request path
+    'relay-order-events': {
+        'task': 'orders.tasks.relay_order_events',
+        'schedule': 5.0,
+    },
+    # Puts stock held by expired cart reservations back on sale
+    'release-expired-reservations': {
+        'task': 'orders.tasks.release_expired_reservations',
+        'schedule': 60.0,
+    },
+    # Keeps stock-at-time lookups short by snapshotting the inventory ledger
+    'compact-inventory-ledger': {
+        'task': 'products.tasks.compact_inventory_ledger',
+        'schedule': 3600.0,
+    },
+    # Drops stored Idempotency-Key responses once they can no longer be replayed
+    'purge-idempotency-keys': {
+        'task': 'orders.tasks.purge_idempotency_keys',
+        'schedule': 3600.0,
+    },
+    # Test celery worker
+    # 'send_admin_message': {
+    #     'task': 'home.tasks.test_task',
+    #     'schedule': 3,
+    # },
 }
 
 @app.task(bind=True)
@@ -129,6 +129,41 @@ REST_FRAMEWORK = {
     # ],
 }
 
+# Pagination count modes (common.pagination): how long ?count=cached reuses a COUNT(*),
+# and the Postgres row estimate below which ?count=estimated counts anyway
+PAGINATION_COUNT_CACHE_TIMEOUT = config('PAGINATION_COUNT_CACHE_TIMEOUT', default=60, cast=int)
+PAGINATION_ESTIMATE_THRESHOLD = config('PAGINATION_ESTIMATE_THRESHOLD', default=10000, cast=int)
+
+# Idempotency-Key support (common.idempotency, stored in orders.IdempotencyKey): how long responses are
+# kept for replay, and how long a request holds its key before a duplicate may take over (keep above the slowest checkout)
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+IDEMPOTENCY_LOCK_TIMEOUT = config('IDEMPOTENCY_LOCK_TIMEOUT', default=30, cast=int)
+
+# Per-view query budgets (common.query_budget): 'log', 'raise' or 'off'
+QUERY_BUDGET_ACTION = config('QUERY_BUDGET_ACTION', default='log')
+
+# Precompiled to_representation for hot read serializers (common.serializers.FastRepresentationMixin)
+FAST_SERIALIZATION = config('FAST_SERIALIZATION', default=True, cast=bool)
+
+# Cache: Redis at REDIS_URL unless DEBUG, so every gunicorn worker and pod shares the catalog
+# generations (behind cached responses and ETags) and single-flight locks; products.checks
+# refuses a process-local cache. locmem for local development. CACHE_BACKEND and
+# CACHE_LOCATION override either default
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default=(
+            'django.core.cache.backends.locmem.LocMemCache' if DEBUG else 'django.core.cache.backends.redis.RedisCache'
+        )),
+        'LOCATION': config('CACHE_LOCATION', default='ecommerce-api' if DEBUG else config('REDIS_URL', default='redis://localhost:6379/0')),
+    }
+}
+
+# Product/category read cache (products.cache); entries are also orphaned on every write
+CATALOG_CACHE_ENABLED = config('CATALOG_CACHE_ENABLED', default=True, cast=bool)
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=300, cast=int)
+# Cache-Control max-age on catalog reads; clients/proxies revalidate with the ETag after that
+CATALOG_HTTP_MAX_AGE = config('CATALOG_HTTP_MAX_AGE', default=0, cast=int)
+
 # Allow all CORS settings
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -161,6 +196,22 @@ CELERY_TIMEZONE = 'Africa/Nairobi'
 CELERY_TASK_ALWAYS_EAGER = True  # Run tasks immediately, no broker needed
 CELERY_TASK_EAGER_PROPAGATES = True  # Propagate exceptions
 
+# Seconds a stock reservation (cart hold) lasts before the beat sweeper releases it
+STOCK_RESERVATION_TTL = config('STOCK_RESERVATION_TTL', default=900, cast=int)
+# Inventory ledger compaction leaves movements younger than this (seconds) for the next run
+INVENTORY_COMPACTION_LAG = config('INVENTORY_COMPACTION_LAG', default=300, cast=int)
+# Order event outbox: dispatch attempts before the relay marks an event failed
+ORDER_EVENT_MAX_ATTEMPTS = config('ORDER_EVENT_MAX_ATTEMPTS', default=5, cast=int)
+# Seconds after which an event claimed by a relay that never finished is dispatched again
+ORDER_EVENT_CLAIM_TIMEOUT = config('ORDER_EVENT_CLAIM_TIMEOUT', default=300, cast=int)
+# Order numbers (orders.numbering): BlockAllocator claims ORDER_NUMBER_BLOCK_SIZE numbers per round trip,
+# SnowflakeAllocator needs none; leave ORDER_NUMBER_WORKER_ID unset to lease a worker id per process
+# for ORDER_NUMBER_WORKER_LEASE seconds, renewed as it numbers orders
+ORDER_NUMBER_ALLOCATOR = config('ORDER_NUMBER_ALLOCATOR', default='orders.numbering.BlockAllocator')
+ORDER_NUMBER_BLOCK_SIZE = config('ORDER_NUMBER_BLOCK_SIZE', default=100, cast=int)
+ORDER_NUMBER_WORKER_LEASE = config('ORDER_NUMBER_WORKER_LEASE', default=60, cast=int)
+ORDER_NUMBER_WORKER_ID = config('ORDER_NUMBER_WORKER_ID', default=None, cast=lambda value: None if value in (None, '') else int(value))
+
 OAUTH2_PROVIDER = {
     'SCOPES': {
         'read': 'Read scope',
@@ -0,0 +1,93 @@
+from decimal import Decimal
+import time
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.test import override_settings
+from rest_framework.renderers import JSONRenderer
+from products.models import Category, Product
+from products.serializers import CategorySerializer, ProductSerializer
+from orders.models import Order, OrderItem
+from orders.serializers import OrderSerializer
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the regular and fast serializer paths (runs in a rolled back transaction)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[50, 200, 1000], help='Page sizes to measure')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement (best is reported)')
+
+    def handle(self, *args, **options):
+        sizes = sorted(options['rows'])
+        repeat = options['repeat']
+
+        with transaction.atomic():
+            self.seed(sizes[-1])
+            self.stdout.write(f"{'serializer':<20}{'rows':>6}{'regular ms':>12}{'fast ms':>10}{'speedup':>9}")
+            for size in sizes:
+                for name, serializer_class, rows in self.datasets(size):
+                    regular, regular_json = self.measure(serializer_class, rows, repeat, fast=False)
+                    fast, fast_json = self.measure(serializer_class, rows, repeat, fast=True)
+                    if regular_json != fast_json:
+                        raise CommandError(f'{name} output differs between the regular and fast paths')
+                    self.stdout.write(
+                        f'{name:<20}{size:>6}{regular * 1000:>12.1f}{fast * 1000:>10.1f}{regular / fast:>8.2f}x'
+                    )
+            transaction.set_rollback(True)
+
+    def seed(self, count):
+        root = Category.objects.create(name='Benchmark Root')
+        leaves = []
+        for i in range(5):
+            parent = Category.objects.create(name=f'Department {i}', parent=root)
+            leaves.extend(Category.objects.create(name=f'Aisle {i}.{j}', parent=parent) for j in range(5))
+
+        products = Product.objects.bulk_create(
+            Product(name=f'Benchmark {i}', description='Lorem ipsum ' * 10, price=Decimal('9.99') + i,
+                    sku=f'BENCH-{i:07d}', stock_quantity=100)
+            for i in range(count)
+        )
+        Through = Product.categories.through
+        Through.objects.bulk_create(
+            Through(product_id=product.id, category_id=category.id)
+            for i, product in enumerate(products)
+            for category in (leaves[i % len(leaves)].parent, leaves[i % len(leaves)])
+        )
+
+        customer = User.objects.create_user(username='benchmark-customer', password='benchmark')
+        orders = Order.objects.bulk_create(
+            Order(customer=customer, order_number=f'BENCH-{i:07d}', total_amount=Decimal('29.97'))
+            for i in range(count)
+        )
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=products[(i + j) % count], quantity=1, unit_price=Decimal('9.99'))
+            for i, order in enumerate(orders)
+            for j in range(3)
+        )
+
+    def datasets(self, size):
+        products = Product.objects.filter(sku__startswith='BENCH-').order_by('id').prefetch_related('categories')
+        orders = Order.objects.filter(order_number__startswith='BENCH-').order_by('id').select_related(
+            'customer'
+        ).prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product')),
+            'items__product__categories',
+        )
+        categories = Category.objects.order_by('id')
+        yield 'ProductSerializer', ProductSerializer, list(products[:size])
+        yield 'OrderSerializer', OrderSerializer, list(orders[:size])
+        yield 'CategorySerializer', CategorySerializer, list(categories[:size])
+
+    def measure(self, serializer_class, rows, repeat, fast):
+        best = None
+        with override_settings(FAST_SERIALIZATION=fast):
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data = serializer_class(rows, many=True).data
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+        return best, JSONRenderer().render(data)
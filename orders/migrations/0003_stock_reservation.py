@@ -0,0 +1,35 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_indexes'),
+        ('products', '0007_keyset_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('active', 'Active'), ('converted', 'Converted'), ('released', 'Released')], default='active', max_length=20)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_reservations', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.product')),
+            ],
+            options={
+                'ordering': ['expires_at'],
+                'indexes': [models.Index(condition=models.Q(('status', 'active')), fields=['expires_at'], name='reservation_expiry_idx'), models.Index(condition=models.Q(('status', 'active')), fields=['product', 'quantity'], name='reservation_product_idx'), models.Index(condition=models.Q(('status', 'active')), fields=['customer', 'product'], name='reservation_customer_idx')],
+            },
+        ),
+    ]
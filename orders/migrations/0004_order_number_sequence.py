@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderNumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_value', models.BigIntegerField(default=1)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderevent',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
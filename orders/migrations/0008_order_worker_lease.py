@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-18 10:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_event_claimed_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderWorkerLease',
+            fields=[
+                ('worker_id', models.PositiveSmallIntegerField(primary_key=True, serialize=False)),
+                ('token', models.CharField(max_length=32)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
@@ -1,9 +1,44 @@
-from django.db import models
+from django.db import DatabaseError, models, transaction
+from django.db.models import F, Sum
 from django.conf import settings
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
 from products.models import Product
 from decimal import Decimal
 
 
+class OrderQuerySet(models.QuerySet):
+    CANCELLABLE_STATUSES = ('pending', 'confirmed')
+
+    def cancel(self):
+        """
+        Cancels the orders in this queryset that are still cancellable and puts
+        their stock back, in a constant number of queries. Returns the ids cancelled.
+        """
+        with transaction.atomic():
+            ids = list(
+                self.filter(status__in=self.CANCELLABLE_STATUSES)
+                .select_for_update().order_by('pk').values_list('pk', flat=True)
+            )
+            if not ids:
+                return []
+
+            # The status guard makes the transition happen at most once per order
+            cancelled = self.model.objects.filter(pk__in=ids, status__in=self.CANCELLABLE_STATUSES).update(
+                status='cancelled', updated_at=timezone.now()
+            )
+            if cancelled != len(ids):
+                # Rows are locked above, so this only happens on backends without row locks
+                raise DatabaseError('Orders changed while being cancelled, please retry')
+
+            quantities = (
+                OrderItem.objects.filter(order_id__in=ids)
+                .values_list('product_id').annotate(quantity=Sum('quantity')).order_by('product_id')
+            )
+            Product.objects.adjust_stock({product_id: quantity for product_id, quantity in quantities}, kind='cancel')
+        return ids
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -22,15 +57,30 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A customer's orders, newest first (TimestampCursorPagination)
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),
+            # Ops queries by status over a time window (e.g. stale pending orders)
+            models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.order_number}"
 
     def calculate_total(self):
         """Calculate total amount from order items"""
-        total = sum(item.subtotal for item in self.items.all())
+        if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+            total = sum(item.subtotal for item in self.items.all())
+        else:
+            # Summed by the database rather than loading every item
+            total = self.items.aggregate(
+                total=Sum(F('quantity') * F('unit_price'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+            )['total'] or Decimal('0.00')
+            total = total.quantize(Decimal('0.01'))
         self.total_amount = total
         return total
 
@@ -46,4 +96,178 @@ class OrderItem(models.Model):
         return self.quantity * self.unit_price
 
     def __str__(self):
-        return f"{self.quantity}x {self.product.name}"
\ No newline at end of file
+        return f"{self.quantity}x {self.product.name}"
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(status='active')
+
+    def expired(self, now=None):
+        return self.filter(status='active', expires_at__lte=now or timezone.now())
+
+    def reserved_quantities(self, product_ids):
+        """{product_id: quantity held} from one grouped aggregate over the active-reservation index"""
+        rows = (
+            self.filter(status='active', product_id__in=product_ids)
+            .values_list('product_id').annotate(quantity=Sum('quantity')).order_by()
+        )
+        return dict(rows)
+
+    def release(self):
+        """
+        Releases the active reservations in this queryset and puts their stock
+        back, in a constant number of queries. Returns the ids released.
+        """
+        with transaction.atomic():
+            rows = list(
+                self.filter(status='active').select_for_update().order_by('pk')
+                .values_list('pk', 'product_id', 'quantity')
+            )
+            if not rows:
+                return []
+
+            ids = [pk for pk, _, _ in rows]
+            released = self.model.objects.filter(pk__in=ids, status='active').update(
+                status='released', updated_at=timezone.now()
+            )
+            if released != len(ids):
+                # Converted or released by someone else in the meantime; the next sweep picks up the rest
+                raise DatabaseError('Reservations changed while being released, please retry')
+
+            quantities = {}
+            for _, product_id, quantity in rows:
+                quantities[product_id] = quantities.get(product_id, 0) + quantity
+            Product.objects.adjust_stock(quantities, kind='release')
+        return ids
+
+
+class StockReservation(models.Model):
+    """
+    A time-limited hold on stock (e.g. a cart). Reserving takes the quantity out
+    of Product.stock_quantity straight away, so stock_quantity is always what is
+    left to sell; checkout converts the customer's holds into order items and
+    the sweeper puts expired holds back.
+    """
+    STATUS_CHOICES = [
+        ('active', 'Active'),
+        ('converted', 'Converted'),
+        ('released', 'Released'),
+    ]
+
+    customer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='stock_reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True, related_name='reservations')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        ordering = ['expires_at']
+        indexes = [
+            # Sweeper: active holds by expiry
+            models.Index(fields=['expires_at'], condition=models.Q(status='active'), name='reservation_expiry_idx'),
+            # Held quantity per product, answered from the index alone
+            models.Index(fields=['product', 'quantity'], condition=models.Q(status='active'), name='reservation_product_idx'),
+            # A customer's holds at checkout
+            models.Index(fields=['customer', 'product'], condition=models.Q(status='active'), name='reservation_customer_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x {self.product_id} held until {self.expires_at:%Y-%m-%d %H:%M}"
+
+
+class OrderNumberSequence(models.Model):
+    """
+    Named counters handed out in blocks (orders.numbering). A process claims a
+    whole block with one UPDATE and numbers orders from memory until it runs out.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    next_value = models.BigIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.name}: {self.next_value}"
+
+
+class OrderWorkerLease(models.Model):
+    """
+    Snowflake worker ids (orders.numbering) leased to running processes. A
+    process renews its lease while it numbers orders; an id is only handed to
+    another process once its lease has expired.
+    """
+    worker_id = models.PositiveSmallIntegerField(primary_key=True)
+    token = models.CharField(max_length=32)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Worker {self.worker_id} until {self.expires_at:%Y-%m-%d %H:%M:%S}"
+
+
+class OrderEvent(models.Model):
+    """
+    Transactional outbox: written in the same transaction as the change it
+    describes, so an event exists exactly when that change committed. The
+    relay task (orders.tasks.relay_order_events) dispatches pending events.
+    """
+    EVENT_TYPES = [
+        ('order.created', 'Order created'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=50, choices=EVENT_TYPES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set while a relay is dispatching the event; a claim older than ORDER_EVENT_CLAIM_TIMEOUT is up for grabs again
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Relay: pending events in insertion order; sent ones drop out of the index
+            models.Index(fields=['id'], condition=models.Q(status='pending'), name='order_event_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} for order {self.order_id} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """
+    A request made with an Idempotency-Key (common.idempotency): claimed with
+    `lock_token` while it runs, then holding the response to replay. The unique
+    constraint is what makes two workers agree on who runs the request.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='idempotency_keys')
+    # The view and action the key was used on
+    scope = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Set while the request runs, cleared once its response is stored
+    lock_token = models.CharField(max_length=32, blank=True)
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    # Encoded like the API renders it, so a replay is byte-for-byte the original body
+    response = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
+    # When the request was claimed; drives both the lock timeout and the replay TTL
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'scope', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='idempotency_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.status_code or 'in flight'})"
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+from functools import lru_cache
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .models import OrderNumberSequence, OrderWorkerLease
+
+ORDER_SEQUENCE = 'order-number'
+
+# Snowflake layout: milliseconds since SNOWFLAKE_EPOCH, then worker id, then a per-millisecond counter
+SNOWFLAKE_EPOCH = 1704067200000  # 2024-01-01T00:00:00Z
+WORKER_BITS = 10
+COUNTER_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_COUNTER = (1 << COUNTER_BITS) - 1
+BASE36_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+
+
+def claim_block(name, size):
+    """
+    Reserves `size` consecutive values of the named sequence and returns the
+    first. One UPDATE moves the counter, so concurrent claims never overlap.
+
+    The claim commits on its own: call it outside any transaction that could
+    roll back, otherwise the block would be handed out again.
+    """
+    with transaction.atomic():
+        if not OrderNumberSequence.objects.filter(name=name).update(next_value=F('next_value') + size):
+            # First claim ever; whoever loses the insert race just updates the row the winner made
+            OrderNumberSequence.objects.bulk_create([OrderNumberSequence(name=name)], ignore_conflicts=True)
+            OrderNumberSequence.objects.filter(name=name).update(next_value=F('next_value') + size)
+        # The UPDATE holds the row lock until commit, so this reads our own increment
+        return OrderNumberSequence.objects.values_list('next_value', flat=True).get(name=name) - size
+
+
+def to_base36(value, width):
+    digits = []
+    while value:
+        value, remainder = divmod(value, 36)
+        digits.append(BASE36_DIGITS[remainder])
+    return ''.join(reversed(digits)).rjust(width, '0')
+
+
+class BlockAllocator:
+    """
+    Monotonic order numbers from blocks of the shared sequence: one database
+    round trip per `block_size` orders. Numbers from different processes
+    interleave by block, and a block left unused when a process exits is skipped.
+    """
+
+    def __init__(self, block_size=None, prefix='ORD-'):
+        self.block_size = block_size or getattr(settings, 'ORDER_NUMBER_BLOCK_SIZE', 100)
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.pid = None
+        self.next_value = self.end = 0
+
+    def allocate_value(self):
+        with self.lock:
+            # A block claimed before a fork (e.g. gunicorn --preload) would be shared by every child
+            if self.next_value >= self.end or self.pid != os.getpid():
+                self.next_value = claim_block(ORDER_SEQUENCE, self.block_size)
+                self.end = self.next_value + self.block_size
+                self.pid = os.getpid()
+            value = self.next_value
+            self.next_value += 1
+        return value
+
+    def allocate(self):
+        # Zero-padded so the string order matches the numeric order
+        return f'{self.prefix}{self.allocate_value():010d}'
+
+
+class SnowflakeAllocator:
+    """
+    Time-ordered order numbers built in memory: a millisecond timestamp, the
+    worker id and a per-millisecond counter (4,096 per millisecond per worker).
+    The worker id comes from ORDER_NUMBER_WORKER_ID (only safe with one process
+    per id), or is leased from the database for ORDER_NUMBER_WORKER_LEASE
+    seconds and renewed as the process keeps numbering orders.
+    """
+
+    def __init__(self, worker_id=None, prefix='ORD-', lease_seconds=None):
+        if worker_id is None:
+            worker_id = getattr(settings, 'ORDER_NUMBER_WORKER_ID', None)
+        if worker_id is not None and not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f'Worker id must be between 0 and {MAX_WORKER_ID}')
+        self.configured_worker_id = worker_id
+        self.prefix = prefix
+        self.lease = timedelta(seconds=lease_seconds or getattr(settings, 'ORDER_NUMBER_WORKER_LEASE', 60))
+        self.lock = threading.Lock()
+        self.pid = None
+        self.worker_id = None
+        self.token = None
+        self.renew_at = 0
+        self.last_ms = -1
+        self.counter = 0
+
+    def claim_worker_id(self):
+        """
+        Leases a free worker id: an expired lease if there is one, otherwise the
+        lowest id never leased. Raises RuntimeError when all of them are held.
+        """
+        token = uuid.uuid4().hex
+        while True:
+            now = timezone.now()
+            expired = OrderWorkerLease.objects.filter(expires_at__lte=now).order_by('expires_at').first()
+            if expired is not None:
+                # Guarded by the old token, so two processes can't take over the same lease
+                if OrderWorkerLease.objects.filter(pk=expired.pk, token=expired.token).update(
+                    token=token, expires_at=now + self.lease
+                ):
+                    return expired.pk, token
+                continue
+            leased = set(OrderWorkerLease.objects.values_list('worker_id', flat=True))
+            free = [worker_id for worker_id in range(MAX_WORKER_ID + 1) if worker_id not in leased]
+            if not free:
+                raise RuntimeError(f'All {MAX_WORKER_ID + 1} order number worker ids are leased')
+            try:
+                with transaction.atomic():
+                    OrderWorkerLease.objects.create(worker_id=free[0], token=token, expires_at=now + self.lease)
+                return free[0], token
+            except IntegrityError:
+                continue
+
+    def renew_lease(self):
+        """Extends our lease; False if it expired and another process took the id"""
+        return bool(OrderWorkerLease.objects.filter(pk=self.worker_id, token=self.token).update(
+            expires_at=timezone.now() + self.lease
+        ))
+
+    def ensure_worker_id(self):
+        if self.pid != os.getpid():
+            # Forked children must not share their parent's worker id
+            self.worker_id = self.configured_worker_id
+            self.token = None
+            self.pid = os.getpid()
+        if self.configured_worker_id is not None:
+            return
+        now = time.monotonic()
+        if self.token is not None and now < self.renew_at:
+            return
+        # Renew at half-life, so the lease never runs out while we're numbering orders
+        if self.token is None or not self.renew_lease():
+            self.worker_id, self.token = self.claim_worker_id()
+        self.renew_at = now + self.lease.total_seconds() / 2
+
+    def allocate_value(self):
+        with self.lock:
+            self.ensure_worker_id()
+
+            now = time.time_ns() // 1_000_000
+            # Never go back in time, even if the clock does: keep counting from the last millisecond
+            if now <= self.last_ms:
+                now = self.last_ms
+                self.counter += 1
+                if self.counter > MAX_COUNTER:
+                    # This millisecond is used up; borrow the next one
+                    now += 1
+                    self.counter = 0
+            else:
+                self.counter = 0
+            self.last_ms = now
+            return ((now - SNOWFLAKE_EPOCH) << (WORKER_BITS + COUNTER_BITS)) | (self.worker_id << COUNTER_BITS) | self.counter
+
+    def allocate(self):
+        # 63 bits fit in 13 base-36 digits; padding keeps string and numeric order the same
+        return f'{self.prefix}{to_base36(self.allocate_value(), 13)}'
+
+
+@lru_cache(maxsize=None)
+def get_allocator():
+    """The ORDER_NUMBER_ALLOCATOR instance for this process"""
+    path = getattr(settings, 'ORDER_NUMBER_ALLOCATOR', 'orders.numbering.BlockAllocator')
+    return import_string(path)()
+
+
+def next_order_number():
+    return get_allocator().allocate()
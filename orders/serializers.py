@@ -1,16 +1,23 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Order, OrderItem
+from common.serializers import FastRepresentationMixin, SparseFieldsetMixin
+from .models import Order, OrderEvent, OrderItem, StockReservation
+from .numbering import next_order_number
 from products.models import Product
-from products.serializers import ProductSerializer
-import uuid
+from products.serializers import PreloadedPrimaryKeyRelatedField, ProductSerializer, get_category_tree
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsetMixin, FastRepresentationMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
-    product_id = serializers.PrimaryKeyRelatedField(
+    product_id = PreloadedPrimaryKeyRelatedField(
         queryset=Product.objects.filter(is_active=True),
         source='product',
-        write_only=True
+        write_only=True,
+        context_key='preloaded_products'
     )
     subtotal = serializers.ReadOnlyField()
     
@@ -18,9 +25,18 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'product', 'product_id', 'quantity', 'unit_price', 'subtotal']
         read_only_fields = ['unit_price']
+        # ?view=compact also renders the nested product in its compact form
+        compact_fields = ['product', 'quantity', 'unit_price', 'subtotal']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        orders = list(data.all() if hasattr(data, 'all') else data)
+        self.child.build_category_tree(orders)
+        return super().to_representation(orders)
+
+
+class OrderSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     customer = serializers.StringRelatedField(read_only=True)
     
@@ -31,50 +47,187 @@ class OrderSerializer(serializers.ModelSerializer):
             'total_amount', 'notes', 'items', 'created_at', 'updated_at'
         ]
         read_only_fields = ['order_number', 'total_amount']
+        list_serializer_class = OrderListSerializer
+
+    def to_representation(self, instance):
+        if self.parent is None:
+            self.build_category_tree([instance])
+        return super().to_representation(instance)
+
+    def build_category_tree(self, orders):
+        """Loads one category tree for every product on `orders` (expects items__product__categories prefetched)"""
+        items = self.fields.get('items')
+        product = items.child.fields.get('product') if items is not None else None
+        if not isinstance(product, ProductSerializer) or not product.needs_category_tree():
+            return
+        categories = {
+            category.pk: category
+            for order in orders for item in order.items.all() for category in item.product.categories.all()
+        }
+        if categories:
+            get_category_tree(self.context, categories.values())
+
 
+class ItemProductsPreloadMixin:
+    """Looks up the products of every line in `items` with one query instead of one per line"""
 
-class OrderCreateSerializer(serializers.ModelSerializer):
+    def to_internal_value(self, data):
+        items = data.get('items') if isinstance(data, dict) else None
+        if isinstance(items, list):
+            product_ids = set()
+            for item in items:
+                try:
+                    product_ids.add(int(item['product_id']))
+                except (KeyError, TypeError, ValueError):
+                    pass
+            self.context['preloaded_products'] = Product.objects.filter(is_active=True).in_bulk(product_ids)
+        return super().to_internal_value(data)
+
+
+def sum_quantities(items_data):
+    """{product_id: quantity}; the same product on several lines counts once against stock"""
+    quantities = {}
+    for item_data in items_data:
+        product_id = item_data['product'].pk
+        quantities[product_id] = quantities.get(product_id, 0) + item_data['quantity']
+    return quantities
+
+
+class OrderCreateSerializer(ItemProductsPreloadMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     
     class Meta:
         model = Order
         fields = ['notes', 'items']
-    
+
+    def to_representation(self, instance):
+        return OrderSerializer(instance, context=self.context).data
+
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        
-        # Generate unique order number
-        order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
-        
-        order = Order.objects.create(
-            customer=self.context['request'].user,
-            order_number=order_number,
-            **validated_data
-        )
-        
-        # Create order items
-        for item_data in items_data:
-            product = item_data['product']
-            
-            # Check stock availability
-            if product.stock_quantity < item_data['quantity']:
-                raise serializers.ValidationError(
-                    f"Insufficient stock for {product.name}. Available: {product.stock_quantity}"
+        quantities = sum_quantities(items_data)
+        customer = self.context['request'].user
+
+        # Allocated before the transaction: a block claim must not roll back with a failed checkout
+        order_number = next_order_number()
+
+        with transaction.atomic():
+            # Lock rows in id order so concurrent checkouts can't deadlock each other
+            products = {
+                product.pk: product
+                for product in Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk')
+            }
+            # The customer's own holds on these products are used first; they are
+            # already out of stock_quantity, even if expired but not yet swept
+            holds = list(
+                StockReservation.objects.active().filter(customer=customer, product_id__in=quantities)
+                .select_for_update().order_by('pk').values_list('pk', 'product_id', 'quantity')
+            )
+            held = {}
+            for _, product_id, quantity in holds:
+                held[product_id] = held.get(product_id, 0) + quantity
+
+            for product_id, quantity in quantities.items():
+                product = products[product_id]
+                available = product.stock_quantity + held.get(product_id, 0)
+                if available < quantity:
+                    raise serializers.ValidationError(
+                        f"Insufficient stock for {product.name}. Available: {available}"
+                    )
+
+            # Guarded decrement: only rows that still have enough stock are updated, which keeps
+            # us correct even on backends where select_for_update is a no-op (SQLite).
+            # Held quantity beyond what is ordered goes back to stock.
+            deltas = {
+                product_id: held.get(product_id, 0) - quantity
+                for product_id, quantity in quantities.items()
+                if held.get(product_id, 0) != quantity
+            }
+            if Product.objects.adjust_stock(deltas, kind='sale', reference=order_number) != len(deltas):
+                raise serializers.ValidationError("Insufficient stock, please try again")
+
+            items = [
+                OrderItem(
+                    product=products[item_data['product'].pk],
+                    quantity=item_data['quantity'],
+                    unit_price=products[item_data['product'].pk].price
+                )
+                for item_data in items_data
+            ]
+
+            # The total is known up front, so the order row is written once
+            order = Order.objects.create(
+                customer=customer,
+                order_number=order_number,
+                total_amount=sum(item.subtotal for item in items),
+                **validated_data
+            )
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+            # Notifications go out through the outbox, so they only ever exist for committed orders
+            OrderEvent.objects.create(order=order, event_type='order.created')
+
+            if holds:
+                converted = StockReservation.objects.filter(pk__in=[pk for pk, _, _ in holds], status='active').update(
+                    status='converted', order=order, updated_at=timezone.now()
                 )
-            
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=item_data['quantity'],
-                unit_price=product.price
+                if converted != len(holds):
+                    # The sweeper released a hold between our read and this update (no row locks on SQLite)
+                    raise serializers.ValidationError("Your reservation expired during checkout, please try again")
+
+        # Load what the response renders in a fixed number of queries
+        prefetch_related_objects([order], Prefetch(
+            'items', queryset=OrderItem.objects.select_related('product').prefetch_related('product__categories')
+        ))
+        return order
+
+
+class ReservationItemSerializer(serializers.Serializer):
+    product_id = PreloadedPrimaryKeyRelatedField(
+        queryset=Product.objects.filter(is_active=True),
+        source='product',
+        context_key='preloaded_products'
+    )
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = StockReservation
+        fields = ['id', 'product_id', 'quantity', 'status', 'order_id', 'expires_at', 'created_at']
+
+
+class StockReservationCreateSerializer(ItemProductsPreloadMixin, serializers.Serializer):
+    items = ReservationItemSerializer(many=True, allow_empty=False)
+
+    def create(self, validated_data):
+        quantities = sum_quantities(validated_data['items'])
+        ttl = timedelta(seconds=getattr(settings, 'STOCK_RESERVATION_TTL', 900))
+        with transaction.atomic():
+            stock = dict(
+                Product.objects.select_for_update().filter(pk__in=quantities).order_by('pk').values_list('pk', 'stock_quantity')
             )
-            
-            # Update stock
-            product.stock_quantity -= item_data['quantity']
-            product.save()
-        
-        # Calculate and save total
-        order.calculate_total()
-        order.save()
-        
-        return order
\ No newline at end of file
+            shortages = [
+                f"Insufficient stock for product {product_id}. Available: {stock[product_id]}"
+                for product_id, quantity in quantities.items() if stock[product_id] < quantity
+            ]
+            if shortages:
+                raise serializers.ValidationError({'items': shortages})
+
+            # Same guarded decrement as checkout: all lines are held or none are
+            deltas = {product_id: -quantity for product_id, quantity in quantities.items()}
+            if Product.objects.adjust_stock(deltas, kind='reservation') != len(deltas):
+                raise serializers.ValidationError("Insufficient stock, please try again")
+            return StockReservation.objects.bulk_create([
+                StockReservation(
+                    customer=self.context['request'].user,
+                    product_id=product_id,
+                    quantity=quantity,
+                    expires_at=timezone.now() + ttl,
+                )
+                for product_id, quantity in quantities.items()
+            ])
+
+    def to_representation(self, instance):
+        return {'reservations': StockReservationSerializer(instance, many=True).data}
@@ -2,9 +2,13 @@ from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
 from django.template.loader import render_to_string
+from django.db import DatabaseError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from datetime import timedelta
 import requests
 import logging
-from .models import Order
+from .models import IdempotencyKey, Order, OrderEvent, StockReservation
 
 logger = logging.getLogger(__name__)
 
@@ -109,3 +113,91 @@ def send_admin_email(order_id):
         logger.error(f"Order {order_id} not found")
     except Exception as e:
         logger.error(f"Error sending admin email for order {order_id}: {str(e)}")
+
+
+@shared_task
+def release_expired_reservations(batch_size=1000):
+    """Puts the stock of expired holds back, a batch at a time (five queries per batch); runs on beat"""
+    released = 0
+    while True:
+        # Oldest first, straight off the expiry index
+        batch = list(StockReservation.objects.expired().order_by('expires_at').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        try:
+            ids = StockReservation.objects.filter(pk__in=batch).release()
+        except DatabaseError as e:
+            # Lost a race with a checkout; whatever is left goes on the next run
+            logger.warning(f"Reservation sweep stopped early: {str(e)}")
+            break
+        released += len(ids)
+        if len(ids) < batch_size:
+            break
+    if released:
+        logger.info(f"Released {released} expired stock reservations")
+    return released
+
+
+@shared_task
+def relay_order_events(batch_size=100, max_batches=50):
+    """
+    Drains the OrderEvent outbox, a batch at a time; runs on beat. A batch is
+    claimed (SKIP LOCKED, so relays can run side by side) and committed before
+    anything is dispatched, so slow or eager notification tasks never run while
+    outbox rows are locked. Delivery is at least once: a relay that dies after
+    dispatching leaves its claim to expire, and the event is sent again.
+    """
+    handlers = {'order.created': send_order_notifications}
+    max_attempts = getattr(settings, 'ORDER_EVENT_MAX_ATTEMPTS', 5)
+    claim_timeout = timedelta(seconds=getattr(settings, 'ORDER_EVENT_CLAIM_TIMEOUT', 300))
+    relayed = 0
+    for _ in range(max_batches):
+        now = timezone.now()
+        claimable = OrderEvent.objects.filter(status='pending').filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=now - claim_timeout)
+        )
+        with transaction.atomic():
+            events = list(
+                claimable.select_for_update(skip_locked=True)
+                .order_by('id').values_list('pk', 'event_type', 'order_id', 'attempts')[:batch_size]
+            )
+            if not events:
+                break
+            ids = [pk for pk, _, _, _ in events]
+            claimed = claimable.filter(pk__in=ids).update(claimed_at=now, attempts=F('attempts') + 1)
+        if claimed != len(events):
+            # No row locks (SQLite): another relay claimed some of these between our read and update
+            mine = set(OrderEvent.objects.filter(pk__in=ids, claimed_at=now).values_list('pk', flat=True))
+            events = [event for event in events if event[0] in mine]
+
+        sent = []
+        failed = 0
+        for pk, event_type, order_id, attempts in events:
+            try:
+                handlers[event_type].delay(order_id)
+                sent.append(pk)
+            except Exception as e:
+                logger.warning(f"Failed to relay {event_type} event {pk} for order {order_id}: {str(e)}")
+                failed += 1
+                # Given up on after max_attempts; the rest are retried on the next run
+                OrderEvent.objects.filter(pk=pk, claimed_at=now).update(
+                    status='failed' if attempts + 1 >= max_attempts else 'pending', claimed_at=None, last_error=str(e)
+                )
+        OrderEvent.objects.filter(pk__in=sent, claimed_at=now).update(status='sent', sent_at=timezone.now(), claimed_at=None)
+        relayed += len(sent)
+        if failed or len(ids) < batch_size:
+            # Failing events stay at the head of the queue; wait for the next run rather than spin on them
+            break
+    if relayed:
+        logger.info(f"Relayed {relayed} order events")
+    return relayed
+
+
+@shared_task
+def purge_idempotency_keys():
+    """Deletes Idempotency-Key records past IDEMPOTENCY_KEY_TTL; runs on beat"""
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lte=cutoff).delete()
+    if deleted:
+        logger.info(f"Purged {deleted} expired idempotency keys")
+    return deleted
@@ -1,11 +1,27 @@
+import csv
+import json
 import pytest
+import threading
+import time
+from decimal import Decimal
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
+from rest_framework.test import APIClient
 from unittest.mock import patch
-from .models import Order, OrderItem
+from common.explain import full_scans
+from django.db.models import Sum
+from .models import Order, OrderEvent, OrderItem, StockReservation
 from .tasks import send_customer_sms, send_admin_email
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
 class OrderModelTest(TestCase):
     def setUp(self):
         from django.contrib.auth import get_user_model
@@ -74,6 +90,34 @@ class TestOrderAPI:
         product.refresh_from_db()
         assert product.stock_quantity == 98
     
+    def test_create_order_query_count_is_constant(self, authenticated_client, category):
+        from products.models import Product
+        from .numbering import BlockAllocator
+        products = Product.objects.bulk_create([
+            Product(name=f'Line {i}', price='2.50', sku=f'LINE-{i:03}', stock_quantity=10) for i in range(50)
+        ])
+
+        def place(lines):
+            items = [{'product_id': product.id, 'quantity': 1} for product in lines]
+            with CaptureQueriesContext(connection) as queries:
+                response = authenticated_client.post('/api/orders/', {'items': items}, format='json')
+            assert response.status_code == status.HTTP_201_CREATED
+            return response, len(queries)
+
+        # Order numbers from a block claimed up front, so a block refill can't land in either request
+        allocator = BlockAllocator(block_size=1000)
+        allocator.allocate()
+        with patch('orders.serializers.next_order_number', allocator.allocate):
+            _, single = place(products[:1])
+            response, fifty = place(products)
+
+        assert fifty == single
+        # Includes the order.created outbox insert
+        assert fifty <= 13
+        assert response.data['total_amount'] == '125.00'
+        assert len(response.data['items']) == 50
+        assert Order.objects.get(pk=response.data['id']).total_amount == Decimal('125.00')
+
     def test_insufficient_stock(self, authenticated_client, product):
         product.stock_quantity = 1
         product.save()
@@ -115,4 +159,708 @@ class TestOrderAPI:
         assert product.stock_quantity == 100
         
         order.refresh_from_db()
-        assert order.status == 'cancelled'
\ No newline at end of file
+        assert order.status == 'cancelled'
+
+    def test_cancel_order_only_once(self, authenticated_client, user, product):
+        order = Order.objects.create(customer=user, order_number='CANCEL-TWICE')
+        OrderItem.objects.create(order=order, product=product, quantity=3, unit_price=product.price)
+
+        assert authenticated_client.post(f'/api/orders/{order.id}/cancel/').status_code == status.HTTP_200_OK
+        response = authenticated_client.post(f'/api/orders/{order.id}/cancel/')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        product.refresh_from_db()
+        assert product.stock_quantity == 103
+
+    def test_cancel_conflict_is_a_409(self, authenticated_client, user, product):
+        from django.db import DatabaseError
+        from .models import OrderQuerySet
+        order = Order.objects.create(customer=user, order_number='CANCEL-RACE')
+        user.is_staff = True
+        user.save()
+
+        # e.g. a backend without row locks where another request changed the orders first
+        with patch.object(OrderQuerySet, 'cancel', side_effect=DatabaseError('Orders changed while being cancelled')):
+            single = authenticated_client.post(f'/api/orders/{order.id}/cancel/')
+            bulk = authenticated_client.post('/api/orders/bulk_cancel/', {'order_ids': [order.id]}, format='json')
+        assert single.status_code == bulk.status_code == status.HTTP_409_CONFLICT
+        assert 'retry' in single.data['error'] and 'retry' in bulk.data['error']
+
+    def test_bulk_cancel_requires_staff(self, authenticated_client):
+        response = authenticated_client.post('/api/orders/bulk_cancel/', {'order_ids': [1]}, format='json')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+
+    def test_bulk_cancel(self, authenticated_client, user, product):
+        from products.models import Product
+        user.is_staff = True
+        user.save()
+        other = Product.objects.create(name='Other', price=1, sku='OTHER-001', stock_quantity=0)
+        orders = []
+        for i in range(10):
+            order = Order.objects.create(customer=user, order_number=f'BULK-{i}')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, unit_price=product.price),
+                OrderItem(order=order, product=other, quantity=2, unit_price=other.price),
+            ])
+            orders.append(order)
+        Order.objects.filter(pk=orders[0].pk).update(status='shipped')
+        order_ids = [order.id for order in orders]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = authenticated_client.post('/api/orders/bulk_cancel/', {'order_ids': order_ids}, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'cancelled': order_ids[1:], 'skipped': [orders[0].id]}
+        assert len(queries) <= 10
+
+        product.refresh_from_db()
+        other.refresh_from_db()
+        assert (product.stock_quantity, other.stock_quantity) == (109, 18)
+        assert Order.objects.filter(status='cancelled').count() == 9
+
+    def test_list_orders_compact_items(self, authenticated_client, user, product, category):
+        order = Order.objects.create(customer=user, order_number='COMPACT-001')
+        OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price)
+
+        response = authenticated_client.get('/api/orders/', {'view': 'compact', 'fields': 'items.product.sku,items.quantity'})
+        assert response.status_code == status.HTTP_200_OK
+
+        item = response.data['results'][0]['items'][0]
+        assert item == {'product': {'sku': 'TEST-001'}, 'quantity': 1}
+        assert 'order_number' in response.data['results'][0]
+
+    def test_export_orders(self, authenticated_client, user, product):
+        order = Order.objects.create(customer=user, order_number='EXPORT-001')
+        OrderItem.objects.create(order=order, product=product, quantity=2, unit_price=product.price)
+        OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price)
+
+        response = authenticated_client.get('/api/orders/export/')
+        assert response.status_code == status.HTTP_200_OK
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        assert len(rows) == 1
+        assert rows[0]['order_number'] == 'EXPORT-001'
+        assert [item['quantity'] for item in rows[0]['items']] == [2, 1]
+
+        response = authenticated_client.get('/api/orders/export/', {'export_format': 'csv'})
+        rows = list(csv.DictReader(b''.join(response.streaming_content).decode().splitlines()))
+        assert [(row['order_number'], row['sku'], row['quantity']) for row in rows] == [
+            ('EXPORT-001', 'TEST-001', '2'), ('EXPORT-001', 'TEST-001', '1')
+        ]
+
+    def test_fast_serialization_is_byte_identical(self, authenticated_client, user, product, settings):
+        order = Order.objects.create(customer=user, order_number='FAST-001', notes='Leave at the door')
+        OrderItem.objects.create(order=order, product=product, quantity=3, unit_price=product.price)
+
+        settings.FAST_SERIALIZATION = False
+        regular = authenticated_client.get('/api/orders/').content
+        settings.FAST_SERIALIZATION = True
+        fast = authenticated_client.get('/api/orders/').content
+
+        assert regular == fast
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentCheckout:
+    def test_concurrent_orders_never_oversell(self, user, product):
+        product.stock_quantity = 5
+        product.save()
+        attempts = 12
+        barrier = threading.Barrier(attempts)
+        results = []
+
+        def checkout():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                for attempt in range(3):
+                    try:
+                        response = client.post(
+                            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json'
+                        )
+                        results.append(response.status_code)
+                        return
+                    except Exception:
+                        # e.g. SQLite's "database table is locked"; retry like a client would
+                        time.sleep(0.05 * (attempt + 1))
+                results.append('gave up')
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(attempts)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The database is the source of truth: a request can fail after its order committed
+        product.refresh_from_db()
+        sold = OrderItem.objects.filter(product=product).count()
+        assert len(results) == attempts
+        assert 0 < sold <= 5
+        assert sold == Order.objects.count()
+        assert product.stock_quantity == 5 - sold
+
+    def test_failed_line_rolls_back_the_whole_order(self, authenticated_client, product, category):
+        from products.models import Product
+        scarce = Product.objects.create(name='Scarce', price=5, sku='SCARCE-001', stock_quantity=1)
+
+        response = authenticated_client.post('/api/orders/', {'items': [
+            {'product_id': product.id, 'quantity': 2},
+            {'product_id': scarce.id, 'quantity': 3},
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        product.refresh_from_db()
+        assert product.stock_quantity == 100
+        assert not Order.objects.exists()
+        assert not OrderItem.objects.exists()
+
+
+@pytest.mark.django_db
+class TestOrderQueries:
+    def make_orders(self, user, count, lines=3):
+        from products.models import Category, Product
+        root, _ = Category.objects.get_or_create(name='Root')
+        for i in range(Order.objects.count(), Order.objects.count() + count):
+            order = Order.objects.create(customer=user, order_number=f'Q-{i}', total_amount=0)
+            for j in range(lines):
+                product = Product.objects.create(name=f'P {i}-{j}', price=1, sku=f'Q-{i}-{j}', stock_quantity=1)
+                product.categories.add(Category.objects.create(name=f'C {i}-{j}', parent=root))
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=1)
+
+    def test_order_list_query_count_is_pinned(self, authenticated_client, user, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        self.make_orders(user, 2)
+        with CaptureQueriesContext(connection) as few:
+            authenticated_client.get('/api/orders/')
+
+        self.make_orders(user, 18)
+        with CaptureQueriesContext(connection) as page:
+            response = authenticated_client.get('/api/orders/')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 20
+        assert len(page) == len(few)
+        assert response.data['results'][0]['items'][0]['product']['categories'][0]['full_path'].startswith('Root > ')
+
+    def test_order_detail_query_count_is_pinned(self, authenticated_client, user, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        self.make_orders(user, 1, lines=10)
+        order = Order.objects.get()
+
+        response = authenticated_client.get(f'/api/orders/{order.id}/')
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['items']) == 10
+
+
+@pytest.mark.django_db
+class TestOrderQueryPlans:
+    def test_order_queries_use_indexes(self, user):
+        from django.utils import timezone
+        querysets = {
+            'customer orders page': Order.objects.filter(customer=user).order_by('-created_at', '-id')[:20],
+            'stale pending orders': Order.objects.filter(status='pending', created_at__lt=timezone.now()),
+        }
+        assert {name: full_scans(queryset) for name, queryset in querysets.items()} == {
+            name: [] for name in querysets
+        }
+
+
+@pytest.mark.django_db
+class TestStockReservations:
+    def reserve(self, client, *lines):
+        items = [{'product_id': product.id, 'quantity': quantity} for product, quantity in lines]
+        return client.post('/api/orders/reservations/', {'items': items}, format='json')
+
+    def test_reserve_takes_stock_and_checkout_converts(self, authenticated_client, user, product):
+        response = self.reserve(authenticated_client, (product, 3), (product, 2))
+        assert response.status_code == status.HTTP_201_CREATED
+        assert [(row['product_id'], row['quantity']) for row in response.data['reservations']] == [(product.id, 5)]
+        product.refresh_from_db()
+        assert product.stock_quantity == 95
+
+        availability = authenticated_client.get('/api/orders/reservations/availability/', {'product_ids': product.id})
+        assert availability.data == [{'product_id': product.id, 'available': 95, 'reserved': 5}]
+
+        # Ordering less than was held hands the rest back
+        response = authenticated_client.post(
+            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 4}]}, format='json'
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        product.refresh_from_db()
+        assert product.stock_quantity == 96
+        reservation = StockReservation.objects.get()
+        assert (reservation.status, reservation.order_id) == ('converted', response.data['id'])
+        assert authenticated_client.get('/api/orders/reservations/').data['results'] == []
+
+    def test_held_stock_is_kept_for_the_holder(self, authenticated_client, user, product):
+        from django.contrib.auth import get_user_model
+
+        product.stock_quantity = 2
+        product.save()
+        assert self.reserve(authenticated_client, (product, 2)).status_code == status.HTTP_201_CREATED
+
+        other = APIClient()
+        other.force_authenticate(get_user_model().objects.create_user(username='other', password='x'))
+        assert self.reserve(other, (product, 1)).status_code == status.HTTP_400_BAD_REQUEST
+        response = other.post('/api/orders/', {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = authenticated_client.post(
+            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 2}]}, format='json'
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        product.refresh_from_db()
+        assert product.stock_quantity == 0
+
+    def test_reserve_is_all_or_nothing(self, authenticated_client, product, category):
+        from products.models import Product
+        scarce = Product.objects.create(name='Scarce', price='1.00', sku='SCARCE', stock_quantity=1)
+        response = self.reserve(authenticated_client, (product, 1), (scarce, 2))
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert 'Available: 1' in response.data['items'][0]
+        product.refresh_from_db()
+        assert product.stock_quantity == 100
+        assert not StockReservation.objects.exists()
+
+    def test_release_early(self, authenticated_client, product):
+        reservation_id = self.reserve(authenticated_client, (product, 10)).data['reservations'][0]['id']
+        assert authenticated_client.delete(f'/api/orders/reservations/{reservation_id}/').status_code == 204
+        product.refresh_from_db()
+        assert product.stock_quantity == 100
+        assert StockReservation.objects.get().status == 'released'
+
+    def test_release_conflict_is_a_409(self, authenticated_client, product):
+        from django.db import DatabaseError
+        from .models import StockReservationQuerySet
+        reservation_id = self.reserve(authenticated_client, (product, 10)).data['reservations'][0]['id']
+
+        with patch.object(StockReservationQuerySet, 'release', side_effect=DatabaseError('Reservations changed')):
+            response = authenticated_client.delete(f'/api/orders/reservations/{reservation_id}/')
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert StockReservation.objects.get().status == 'active'
+
+    def test_sweeper_releases_expired_holds_in_batches(self, user, product, category):
+        from datetime import timedelta
+        from django.utils import timezone
+        from products.models import Product
+        from .tasks import release_expired_reservations
+
+        other = Product.objects.create(name='Other', price='1.00', sku='OTHER', stock_quantity=10)
+        past, future = timezone.now() - timedelta(minutes=1), timezone.now() + timedelta(minutes=10)
+        StockReservation.objects.bulk_create(
+            [StockReservation(customer=user, product=product, quantity=2, expires_at=past) for _ in range(4)]
+            + [StockReservation(customer=user, product=other, quantity=1, expires_at=past)]
+            + [StockReservation(customer=user, product=other, quantity=5, expires_at=future)]
+        )
+
+        with CaptureQueriesContext(connection) as captured:
+            assert release_expired_reservations(batch_size=3) == 5
+        # Two batches of five set-based queries, ledger insert included (savepoints only show up inside the test transaction)
+        assert len([query for query in captured if 'SAVEPOINT' not in query['sql']]) == 10
+        product.refresh_from_db()
+        other.refresh_from_db()
+        assert (product.stock_quantity, other.stock_quantity) == (108, 11)
+        assert StockReservation.objects.active().get().expires_at == future
+
+    def test_reservation_queries_use_indexes(self, user, product):
+        querysets = {
+            'expired holds': StockReservation.objects.expired().order_by('expires_at')[:1000],
+            'held per product': StockReservation.objects.filter(status='active', product_id__in=[product.id])
+            .values_list('product_id').annotate(total=Sum('quantity')).order_by(),
+            'customer holds': StockReservation.objects.active().filter(customer=user, product_id__in=[product.id]),
+        }
+        assert {name: full_scans(queryset) for name, queryset in querysets.items()} == {
+            name: [] for name in querysets
+        }
+
+
+def allocate_in_child(db_path, allocator, count, queue):
+    """Runs in a forked process: numbers `count` orders against the shared database file"""
+    from django.db import connections
+    connections.settings['default'] = {**connections.settings['default'], 'NAME': db_path}
+    connections['default'] = connections.create_connection('default')
+    try:
+        queue.put([allocator.allocate() for _ in range(count)])
+    finally:
+        connections['default'].close()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestOrderNumbers:
+    def allocate_in_threads(self, allocator, threads=8, count=50):
+        barrier = threading.Barrier(threads)
+        numbers = []
+
+        def allocate():
+            barrier.wait()
+            try:
+                numbers.extend(allocator.allocate() for _ in range(count))
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=allocate) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return numbers
+
+    def test_block_allocator_is_unique_and_ordered_across_threads(self):
+        from .models import OrderNumberSequence
+        from .numbering import BlockAllocator
+
+        allocator = BlockAllocator(block_size=7)
+        numbers = self.allocate_in_threads(allocator)
+        assert len(set(numbers)) == len(numbers) == 400
+        assert sorted(numbers) == [f'ORD-{value:010d}' for value in range(1, 401)]
+        # One claim per block, not one per order
+        assert OrderNumberSequence.objects.get(name='order-number').next_value == 1 + 7 * 58
+
+        second = BlockAllocator(block_size=7)
+        assert second.allocate() == 'ORD-0000000407'
+        assert allocator.allocate() == 'ORD-0000000401'
+
+    def test_snowflake_allocator_is_unique_and_time_ordered(self):
+        from .numbering import SnowflakeAllocator
+
+        allocator = SnowflakeAllocator()
+        numbers = self.allocate_in_threads(allocator, count=500)
+        assert len(set(numbers)) == len(numbers) == 4000
+        assert all(len(number) <= 20 for number in numbers)
+
+        later = [allocator.allocate() for _ in range(3)]
+        assert sorted(later) == later and later[0] > max(numbers)
+        # Each allocator gets its own worker id, so two processes never collide
+        other = SnowflakeAllocator()
+        assert other.allocate_value() >> 12 & 1023 != allocator.allocate_value() >> 12 & 1023
+        with pytest.raises(ValueError):
+            SnowflakeAllocator(worker_id=1024)
+
+    def test_snowflake_worker_ids_are_leased(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import OrderWorkerLease
+        from .numbering import MAX_WORKER_ID, SnowflakeAllocator
+
+        later = timezone.now() + timedelta(minutes=5)
+        OrderWorkerLease.objects.bulk_create([
+            OrderWorkerLease(worker_id=worker_id, token='other', expires_at=later) for worker_id in range(MAX_WORKER_ID + 1)
+        ])
+        # Every id is held: fail rather than share one
+        with pytest.raises(RuntimeError):
+            SnowflakeAllocator().allocate()
+
+        OrderWorkerLease.objects.filter(worker_id=7).update(expires_at=timezone.now() - timedelta(seconds=1))
+        allocator = SnowflakeAllocator(lease_seconds=30)
+        allocator.allocate()
+        assert allocator.worker_id == 7
+        lease = OrderWorkerLease.objects.get(worker_id=7)
+        assert lease.token == allocator.token and lease.expires_at > timezone.now() + timedelta(seconds=25)
+
+    def test_snowflake_allocator_renews_or_replaces_its_lease(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import OrderWorkerLease
+        from .numbering import SnowflakeAllocator
+
+        allocator = SnowflakeAllocator()
+        allocator.allocate()
+        assert allocator.worker_id == 0
+
+        # At half-life the next number renews the lease
+        OrderWorkerLease.objects.update(expires_at=timezone.now() + timedelta(seconds=5))
+        allocator.renew_at = 0
+        allocator.allocate()
+        assert OrderWorkerLease.objects.get(worker_id=0).expires_at > timezone.now() + timedelta(seconds=50)
+
+        # A lease that expired and went to another process is never used again
+        OrderWorkerLease.objects.filter(worker_id=0).update(token='other')
+        allocator.renew_at = 0
+        assert allocator.allocate_value() >> 12 & 1023 == 1
+        assert OrderWorkerLease.objects.get(worker_id=1).token == allocator.token
+
+    @pytest.mark.parametrize('allocator_path', ['orders.numbering.BlockAllocator', 'orders.numbering.SnowflakeAllocator'])
+    def test_allocators_are_unique_across_processes(self, tmp_path, allocator_path):
+        import multiprocessing
+        import sqlite3
+        from django.utils.module_loading import import_string
+        from .models import OrderNumberSequence, OrderWorkerLease
+
+        # Forked children can't share the in-memory test database, so they meet in a file
+        db_path = str(tmp_path / 'sequence.sqlite3')
+        with connection.schema_editor(collect_sql=True) as editor:
+            editor.create_model(OrderNumberSequence)
+            editor.create_model(OrderWorkerLease)
+        with sqlite3.connect(db_path) as database:
+            for statement in editor.collected_sql:
+                database.execute(statement)
+
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        # Created before forking, like an app preloaded by the gunicorn master
+        allocator = import_string(allocator_path)()
+        children = [
+            context.Process(target=allocate_in_child, args=(db_path, allocator, 200, queue)) for _ in range(4)
+        ]
+        for child in children:
+            child.start()
+        numbers = [number for _ in children for number in queue.get(timeout=60)]
+        for child in children:
+            child.join()
+        assert all(child.exitcode == 0 for child in children)
+        assert len(set(numbers)) == len(numbers) == 800
+
+    def test_checkout_uses_configured_allocator(self, authenticated_client, product, settings):
+        from .numbering import get_allocator
+
+        settings.ORDER_NUMBER_ALLOCATOR = 'orders.numbering.SnowflakeAllocator'
+        get_allocator.cache_clear()
+        try:
+            numbers = [
+                authenticated_client.post(
+                    '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json'
+                ).data['order_number']
+                for _ in range(3)
+            ]
+        finally:
+            get_allocator.cache_clear()
+        assert numbers == sorted(numbers) and len(set(numbers)) == 3
+        assert all(number.startswith('ORD-') and len(number) == 17 for number in numbers)
+
+
+@pytest.mark.django_db
+class TestIdempotentCheckout:
+    def post(self, client, product, key, quantity=2):
+        return client.post(
+            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': quantity}]},
+            format='json', HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retry_replays_the_stored_response(self, authenticated_client, product, django_assert_num_queries):
+        first = self.post(authenticated_client, product, 'retry-1')
+        assert first.status_code == status.HTTP_201_CREATED
+
+        # Token and key lookups only: no stock, items or order queries, and no second notification event
+        with django_assert_num_queries(2):
+            replay = self.post(authenticated_client, product, 'retry-1')
+        assert replay.status_code == status.HTTP_201_CREATED
+        assert replay.json() == first.json()
+        assert replay['Idempotent-Replayed'] == 'true'
+        assert OrderEvent.objects.count() == 1
+        product.refresh_from_db()
+        assert product.stock_quantity == 98
+        assert Order.objects.count() == 1
+
+        # A new key is a new order
+        assert self.post(authenticated_client, product, 'retry-2').data['order_number'] != first.data['order_number']
+
+    def test_key_reused_for_a_different_request(self, authenticated_client, product):
+        self.post(authenticated_client, product, 'reused')
+        response = self.post(authenticated_client, product, 'reused', quantity=3)
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+        assert Order.objects.count() == 1
+
+    def test_keys_are_per_user(self, authenticated_client, product, django_user_model):
+        other = APIClient()
+        other.force_authenticate(django_user_model.objects.create_user(username='other', password='pass12345'))
+        mine = self.post(authenticated_client, product, 'shared')
+        theirs = self.post(other, product, 'shared')
+        assert theirs.status_code == status.HTTP_201_CREATED
+        assert theirs.data['order_number'] != mine.data['order_number']
+
+    def test_failed_requests_can_be_retried(self, authenticated_client, product):
+        assert self.post(authenticated_client, product, 'too-many', quantity=500).status_code == 400
+        product.stock_quantity = 1000
+        product.save()
+        assert self.post(authenticated_client, product, 'too-many', quantity=500).status_code == 201
+
+        with patch('orders.views.OrderViewSet.perform_create', side_effect=Exception('boom')):
+            with pytest.raises(Exception):
+                self.post(authenticated_client, product, 'crashed')
+        assert self.post(authenticated_client, product, 'crashed').status_code == status.HTTP_201_CREATED
+
+    def test_replay_does_not_depend_on_the_local_cache(self, authenticated_client, product):
+        first = self.post(authenticated_client, product, 'other-worker')
+        # Another gunicorn worker has its own LocMemCache; the key lives in the database
+        cache.clear()
+        replay = self.post(authenticated_client, product, 'other-worker')
+        assert replay['Idempotent-Replayed'] == 'true'
+        assert replay.json() == first.json()
+        assert Order.objects.count() == 1
+
+    def test_stale_claim_is_taken_over(self, authenticated_client, product):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import IdempotencyKey
+
+        self.post(authenticated_client, product, 'stuck')
+        # Make it look like a request that died 10 minutes into its checkout
+        IdempotencyKey.objects.update(
+            status_code=None, response=None, lock_token='dead', created_at=timezone.now() - timedelta(minutes=10)
+        )
+        response = self.post(authenticated_client, product, 'stuck')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert not response.has_header('Idempotent-Replayed')
+        claim = IdempotencyKey.objects.get()
+        assert (claim.status_code, claim.lock_token) == (201, '')
+        assert claim.response['order_number'] == response.data['order_number']
+
+        # The dead request can no longer store or release anything under its token
+        assert not IdempotencyKey.objects.filter(lock_token='dead').exists()
+
+    def test_expired_keys_are_purged(self, authenticated_client, product, settings):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import IdempotencyKey
+        from .tasks import purge_idempotency_keys
+
+        self.post(authenticated_client, product, 'old')
+        self.post(authenticated_client, product, 'new')
+        IdempotencyKey.objects.filter(key='old').update(created_at=timezone.now() - timedelta(days=2))
+        assert purge_idempotency_keys() == 1
+        assert list(IdempotencyKey.objects.values_list('key', flat=True)) == ['new']
+
+    def test_invalid_key(self, authenticated_client, product):
+        assert self.post(authenticated_client, product, 'x' * 256).status_code == status.HTTP_400_BAD_REQUEST
+        assert not Order.objects.exists()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestConcurrentIdempotentCheckout:
+    def test_concurrent_duplicates_wait_for_the_first(self, user, product):
+        from products.models import Product
+        attempts = 6
+        barrier = threading.Barrier(attempts)
+        responses = []
+        errors = []
+        real_adjust_stock = Product.objects.adjust_stock
+
+        def slow_adjust_stock(*args, **kwargs):
+            # Keep the first checkout running while the duplicates arrive
+            time.sleep(0.3)
+            return real_adjust_stock(*args, **kwargs)
+
+        def checkout():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                for attempt in range(3):
+                    try:
+                        responses.append(client.post(
+                            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 1}]},
+                            format='json', HTTP_IDEMPOTENCY_KEY='double-tap'
+                        ))
+                        return
+                    except Exception as error:
+                        # SQLite's "database table is locked"; a failed request releases its claim, so retry it
+                        errors.append(error)
+                        time.sleep(0.05 * (attempt + 1))
+            finally:
+                connection.close()
+
+        with patch.object(Product.objects, 'adjust_stock', side_effect=slow_adjust_stock):
+            threads = [threading.Thread(target=checkout) for _ in range(attempts)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert [response.status_code for response in responses] == [201] * attempts, errors
+        assert len({response.data['order_number'] for response in responses}) == 1
+        assert sum(response.has_header('Idempotent-Replayed') for response in responses) == attempts - 1
+        assert Order.objects.count() == 1
+        product.refresh_from_db()
+        assert product.stock_quantity == 99
+
+
+@pytest.mark.django_db
+class TestOrderOutbox:
+    def place(self, client, product, quantity=1):
+        return client.post('/api/orders/', {'items': [{'product_id': product.id, 'quantity': quantity}]}, format='json')
+
+    def test_checkout_writes_an_event_instead_of_notifying(self, authenticated_client, product):
+        with patch('orders.tasks.send_order_notifications') as notify:
+            response = self.place(authenticated_client, product)
+            assert self.place(authenticated_client, product, quantity=500).status_code == status.HTTP_400_BAD_REQUEST
+        assert notify.delay.call_count == 0
+        # Only the committed order has an event; the rolled-back checkout left none
+        event = OrderEvent.objects.get()
+        assert (event.order_id, event.event_type, event.status) == (response.data['id'], 'order.created', 'pending')
+
+    def test_relay_dispatches_pending_events_in_batches(self, authenticated_client, product):
+        from .tasks import relay_order_events
+        orders = [self.place(authenticated_client, product).data['id'] for _ in range(5)]
+
+        with patch('orders.tasks.send_order_notifications') as notify:
+            with CaptureQueriesContext(connection) as captured:
+                assert relay_order_events(batch_size=2) == 5
+            # Three queries per batch (lock and read, claim, mark sent); the short last batch ends the run
+            assert len([query for query in captured if 'SAVEPOINT' not in query['sql']]) == 9
+            assert relay_order_events() == 0
+        assert [call.args[0] for call in notify.delay.call_args_list] == orders
+        assert set(OrderEvent.objects.values_list('status', 'attempts')) == {('sent', 1)}
+        assert not OrderEvent.objects.filter(sent_at=None).exists()
+
+    def test_failed_dispatch_is_retried_then_given_up(self, authenticated_client, product, settings):
+        from .tasks import relay_order_events
+        settings.ORDER_EVENT_MAX_ATTEMPTS = 2
+        self.place(authenticated_client, product)
+
+        with patch('orders.tasks.send_order_notifications') as notify:
+            notify.delay.side_effect = ConnectionError('broker down')
+            assert relay_order_events() == 0
+            event = OrderEvent.objects.get()
+            assert (event.status, event.attempts, event.last_error) == ('pending', 1, 'broker down')
+            assert relay_order_events() == 0
+        event.refresh_from_db()
+        assert (event.status, event.attempts) == ('failed', 2)
+
+    def test_abandoned_claims_are_dispatched_again(self, authenticated_client, product):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .tasks import relay_order_events
+        self.place(authenticated_client, product)
+        self.place(authenticated_client, product)
+        # One event was claimed by a relay that died a while ago, the other by one still running
+        first, second = OrderEvent.objects.order_by('id')
+        OrderEvent.objects.filter(pk=first.pk).update(claimed_at=timezone.now() - timedelta(hours=1), attempts=1)
+        OrderEvent.objects.filter(pk=second.pk).update(claimed_at=timezone.now(), attempts=1)
+
+        with patch('orders.tasks.send_order_notifications') as notify:
+            assert relay_order_events() == 1
+        assert [call.args[0] for call in notify.delay.call_args_list] == [first.order_id]
+        first.refresh_from_db()
+        assert (first.status, first.attempts, first.claimed_at) == ('sent', 2, None)
+        assert OrderEvent.objects.get(pk=second.pk).status == 'pending'
+
+    def test_relay_reads_pending_events_from_the_index(self):
+        from datetime import timedelta
+        from django.db.models import Q
+        from django.utils import timezone
+        pending = OrderEvent.objects.filter(status='pending').filter(
+            Q(claimed_at__isnull=True) | Q(claimed_at__lt=timezone.now() - timedelta(minutes=5))
+        ).order_by('id')[:100]
+        assert full_scans(pending) == []
+
+    def test_relay_is_scheduled(self):
+        from ecommerce_api.celery import app
+        assert app.conf.beat_schedule['relay-order-events']['task'] == 'orders.tasks.relay_order_events'
+
+
+@pytest.mark.django_db(transaction=True)
+class TestOrderOutboxRelay:
+    def test_notifications_are_dispatched_outside_the_transaction(self, user, product):
+        from .tasks import relay_order_events
+        client = APIClient()
+        client.force_authenticate(user)
+        client.post('/api/orders/', {'items': [{'product_id': product.id, 'quantity': 1}]}, format='json')
+
+        in_transaction = []
+        with patch('orders.tasks.send_order_notifications') as notify:
+            notify.delay.side_effect = lambda order_id: in_transaction.append(connection.in_atomic_block)
+            assert relay_order_events() == 1
+        # Eager SMS/SMTP work must not run while the batch's outbox rows are locked
+        assert in_transaction == [False]
+        assert OrderEvent.objects.get().status == 'sent'
@@ -3,6 +3,8 @@ from rest_framework.routers import DefaultRouter
 from . import views
 
 router = DefaultRouter()
+# Registered before the orders so 'reservations/' isn't taken for an order id
+router.register(r'reservations', views.StockReservationViewSet)
 router.register(r'', views.OrderViewSet)
 
 urlpatterns = [
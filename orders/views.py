@@ -47,59 +47,172 @@
         
 #         return Response({'message': 'Order cancelled successfully'})
 
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.db import DatabaseError
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
-from .models import Order
-from .serializers import OrderSerializer, OrderCreateSerializer
-from .tasks import send_order_notifications
+from .models import Order, OrderItem, StockReservation
+from .serializers import OrderSerializer, OrderCreateSerializer, StockReservationCreateSerializer, StockReservationSerializer
+from products.models import Product
+from common.idempotency import IdempotencyMixin
 from common.pagination import TimestampCursorPagination, StandardResultsSetPagination
+from common.query_budget import QueryBudgetMixin
+from common.streaming import EXPORT_FORMATS, streaming_export
 import logging
 
 logger = logging.getLogger(__name__)
 
+EXPORT_CHUNK_SIZE = 500
+ORDER_EXPORT_FIELDS = [
+    'order_number', 'status', 'total_amount', 'notes', 'created_at', 'updated_at',
+    'product_id', 'sku', 'product_name', 'quantity', 'unit_price', 'subtotal'
+]
 
-class OrderViewSet(viewsets.ModelViewSet):
+
+class OrderViewSet(QueryBudgetMixin, IdempotencyMixin, viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = TimestampCursorPagination  
+    # Customer, items, products and categories load in a fixed number of queries per page
+    query_budget = {'list': 6, 'retrieve': 6}
     
     def get_queryset(self):
-        return Order.objects.filter(customer=self.request.user)
+        queryset = Order.objects.filter(customer=self.request.user)
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.select_related('customer').prefetch_related(
+                Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id')),
+                'items__product__categories'
+            )
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'create':
             return OrderCreateSerializer
         return OrderSerializer
-    
-    def perform_create(self, serializer):
-        order = serializer.save()
-        print(f"Order {order.order_number} created successfully!")
-        try:
-            send_order_notifications.delay(order.id)
-            logger.info(f"Notification task queued for order {order.id}")
-        except Exception as e:
-            logger.warning(f"Failed to queue notification task for order {order.id}: {str(e)}")
         
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Streams the user's orders as NDJSON (items nested) or CSV (one row per item)"""
+        fmt = request.query_params.get('export_format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        orders = self.get_queryset().order_by('id').prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('id'))
+        ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        def rows():
+            for order in orders:
+                header = {
+                    'order_number': order.order_number,
+                    'status': order.status,
+                    'total_amount': order.total_amount,
+                    'notes': order.notes,
+                    'created_at': order.created_at,
+                    'updated_at': order.updated_at,
+                }
+                items = [
+                    {
+                        'product_id': item.product_id,
+                        'sku': item.product.sku,
+                        'product_name': item.product.name,
+                        'quantity': item.quantity,
+                        'unit_price': item.unit_price,
+                        'subtotal': item.subtotal,
+                    }
+                    for item in order.items.all()
+                ]
+                if fmt == 'csv':
+                    for item in items:
+                        yield {**header, **item}
+                else:
+                    yield {**header, 'items': items}
+
+        return streaming_export(rows(), fmt, 'orders', fieldnames=ORDER_EXPORT_FIELDS)
+
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
         """Cancel an order"""
         order = self.get_object()
-        if order.status not in ['pending', 'confirmed']:
+        try:
+            cancelled = Order.objects.filter(pk=order.pk).cancel()
+        except DatabaseError:
+            return Response({'error': 'Order changed while being cancelled, please retry'}, status=status.HTTP_409_CONFLICT)
+        if not cancelled:
             return Response(
                 {'error': 'Cannot cancel order in current status'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        
-        order.status = 'cancelled'
-        order.save()
-        
-        # Return stock
-        for item in order.items.all():
-            item.product.stock_quantity += item.quantity
-            item.product.save()
-        
+
         return Response({'message': 'Order cancelled successfully'})
+
+    @action(detail=False, methods=['post'], permission_classes=[IsAdminUser])
+    def bulk_cancel(self, request):
+        """Cancel many orders (any customer) in one call - staff only"""
+        order_ids = request.data.get('order_ids') if isinstance(request.data, dict) else None
+        if not isinstance(order_ids, list) or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in order_ids):
+            return Response(
+                {'error': 'Expected order_ids as a list of integers'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            cancelled = Order.objects.filter(pk__in=order_ids).cancel()
+        except DatabaseError:
+            return Response({'error': 'Orders changed while being cancelled, please retry'}, status=status.HTTP_409_CONFLICT)
+        return Response({
+            'cancelled': cancelled,
+            'skipped': sorted(set(order_ids) - set(cancelled)),
+        })
+
+
+class StockReservationViewSet(QueryBudgetMixin, mixins.ListModelMixin, mixins.CreateModelMixin,
+                              mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """The user's active stock holds: POST items to reserve, DELETE one to release it early"""
+    queryset = StockReservation.objects.all()
+    serializer_class = StockReservationSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = StandardResultsSetPagination
+    query_budget = {'list': 4, 'availability': 3}
+
+    def get_queryset(self):
+        return StockReservation.objects.active().filter(customer=self.request.user).order_by('expires_at', 'id')
+
+    def get_serializer_class(self):
+        if self.action == 'create':
+            return StockReservationCreateSerializer
+        return StockReservationSerializer
+
+    def destroy(self, request, *args, **kwargs):
+        try:
+            return super().destroy(request, *args, **kwargs)
+        except DatabaseError:
+            return Response(
+                {'error': 'Reservation changed while being released, please retry'}, status=status.HTTP_409_CONFLICT
+            )
+
+    def perform_destroy(self, instance):
+        StockReservation.objects.filter(pk=instance.pk).release()
+
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        """?product_ids=1,2: stock still available to sell and stock currently held, per product"""
+        raw = request.query_params.get('product_ids', '')
+        product_ids = [int(pk) for pk in raw.split(',') if pk.strip().isdigit()]
+        if not product_ids:
+            return Response({'error': 'Expected product_ids as comma-separated ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # stock_quantity already excludes holds; the held amount is one grouped aggregate on the partial index
+        stock = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'stock_quantity'))
+        held = StockReservation.objects.reserved_quantities(stock)
+        return Response([
+            {'product_id': pk, 'available': available, 'reserved': held.get(pk, 0)}
+            for pk, available in sorted(stock.items())
+        ])
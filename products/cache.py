@@ -0,0 +1,147 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.response import Response
+
+KEY_PREFIX = 'catalog'
+LOCK_TIMEOUT = 10  # seconds a recompute may hold the single-flight lock
+LOCK_POLL_INTERVAL = 0.05
+
+
+def generation_key(name):
+    return f'{KEY_PREFIX}:generation:{name}'
+
+
+def get_generation(name):
+    key = generation_key(name)
+    # Generations never expire, otherwise old entries could come back to life
+    cache.add(key, 1, timeout=None)
+    return cache.get(key, 1)
+
+
+def bump_generation(*names):
+    for name in names:
+        try:
+            cache.incr(generation_key(name))
+        except ValueError:
+            cache.set(generation_key(name), 2, timeout=None)
+
+
+def invalidate(*names):
+    """
+    Moves the given models ('product', 'category') to a new generation, which
+    orphans every cached response built from them. Bumped right away so the
+    writer sees its own change, and again on commit so a read racing the
+    transaction can't keep pre-commit data around.
+    """
+    bump_generation(*names)
+    transaction.on_commit(lambda: bump_generation(*names))
+
+
+def record(outcome):
+    key = f'{KEY_PREFIX}:stats:{outcome}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass
+
+
+def get_stats():
+    """Hit/miss counters since the cache was last cleared"""
+    stats = cache.get_many([f'{KEY_PREFIX}:stats:hit', f'{KEY_PREFIX}:stats:miss'])
+    return {
+        'hits': stats.get(f'{KEY_PREFIX}:stats:hit', 0),
+        'misses': stats.get(f'{KEY_PREFIX}:stats:miss', 0),
+    }
+
+
+def get_or_compute(key, compute, timeout=None):
+    """
+    Returns (value, hit). On a miss only one caller recomputes (guarded by a
+    cache.add lock); concurrent callers wait for its result instead of all
+    hitting the database at once. Falls back to computing after LOCK_TIMEOUT.
+    """
+    if timeout is None:
+        timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+    value = cache.get(key)
+    if value is not None:
+        record('hit')
+        return value, True
+
+    lock_key = f'{key}:lock'
+    if not cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = cache.get(key)
+            if value is not None:
+                record('hit')
+                return value, True
+            if cache.add(lock_key, 1, timeout=LOCK_TIMEOUT):
+                # The other worker gave up without storing a value
+                break
+
+    try:
+        value = compute()
+        if value is not None:
+            cache.set(key, value, timeout)
+    finally:
+        cache.delete(lock_key)
+    record('miss')
+    return value, False
+
+
+class CachedReadMixin:
+    """
+    Caches the response data of read actions, keyed by the request path and the
+    current generation of every model in `cache_models`. Actions listed in
+    `cached_actions` are cached automatically; other handlers can go through
+    cached_response(). Adds an X-Cache: HIT/MISS header.
+    """
+    cache_models = ('product', 'category')
+    cached_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cache_scope(self, request):
+        """Separates responses that differ for the same URL (e.g. staff-only data); '' when shared"""
+        return ''
+
+    def get_generations(self):
+        return ','.join(f'{name}={get_generation(name)}' for name in self.cache_models)
+
+    def get_validator_parts(self, request):
+        # ETags (common.conditional) follow the same generations as the cached responses, with no queries
+        return [self.get_cache_scope(request), self.get_generations()]
+
+    def get_cache_key(self, request):
+        generations = self.get_generations()
+        # Host is part of the key because paginated responses hold absolute links
+        raw = f'{self.__class__.__name__}:{self.get_cache_scope(request)}:{request.get_host()}{request.get_full_path()}:{generations}'
+        return f'{KEY_PREFIX}:response:{hashlib.md5(raw.encode()).hexdigest()}'
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        action = getattr(self, 'action', None) or request.method.lower()
+        if action not in self.cached_actions or not getattr(settings, 'CATALOG_CACHE_ENABLED', True):
+            return handler(request, *args, **kwargs)
+
+        fresh = []
+
+        def compute():
+            response = handler(request, *args, **kwargs)
+            fresh.append(response)
+            # Only successful responses are shared; errors go back to this caller as-is
+            return response.data if response.status_code == 200 else None
+
+        data, hit = get_or_compute(self.get_cache_key(request), compute)
+        response = fresh[0] if fresh else Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
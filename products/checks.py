@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+# Backends that keep entries inside one process, so each gunicorn worker would have its own
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+@register()
+def check_catalog_cache_is_shared(app_configs, **kwargs):
+    """
+    The catalog cache's generations and locks only work when every worker sees
+    the same cache. ETags (common.conditional) are built from those generations
+    whether or not responses are cached, so this applies even with the catalog
+    cache off: a worker that never sees a write would answer 304 for stale bodies.
+    """
+    if settings.DEBUG or not isinstance(caches['default'], PROCESS_LOCAL_CACHES):
+        return []
+    return [Error(
+        f'Catalog caching and ETags need a cache shared by all workers, not {type(caches["default"]).__name__}',
+        hint=(
+            "A write in one worker wouldn't move the others' generations, so they would keep serving "
+            'stale responses and 304s. Set REDIS_URL (or CACHE_BACKEND/CACHE_LOCATION).'
+        ),
+        id='products.E001',
+    )]
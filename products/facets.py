@@ -0,0 +1,150 @@
+import hashlib
+from decimal import Decimal, InvalidOperation
+from django.db.models import BooleanField, Case, Count, IntegerField, Q, Value, When
+from rest_framework.exceptions import ValidationError
+from .cache import KEY_PREFIX, get_generation, get_or_compute
+from .importer import parse_bool
+from .models import Category, Product
+from .tree import subtree_filter
+
+FILTER_PARAMS = ('price_min', 'price_max', 'category', 'in_stock', 'is_active')
+# Upper bounds of the price bands; the last band is open-ended
+PRICE_BAND_LIMITS = [Decimal(limit) for limit in ('25.00', '50.00', '100.00', '250.00', '500.00')]
+
+
+def parse_filters(params):
+    """Cleans the product filter query params into a dict; raises ValidationError on bad input"""
+    filters = {}
+    errors = {}
+    for name in ('price_min', 'price_max'):
+        if params.get(name) not in (None, ''):
+            try:
+                filters[name] = Decimal(params[name])
+            except InvalidOperation:
+                errors[name] = ['Must be a number.']
+                continue
+            # NaN and Infinity parse, but the price column can't be compared with them
+            if not filters[name].is_finite():
+                del filters[name]
+                errors[name] = ['Must be a number.']
+    for name in ('in_stock', 'is_active'):
+        if params.get(name) not in (None, ''):
+            try:
+                filters[name] = parse_bool(params[name])
+            except ValueError:
+                errors[name] = ['Must be true or false.']
+    if params.get('category') not in (None, ''):
+        # isdigit() also accepts digits like '²' that int() rejects
+        if params['category'].isascii() and params['category'].isdigit():
+            filters['category'] = int(params['category'])
+        else:
+            errors['category'] = ['Must be a category id.']
+    if errors:
+        raise ValidationError(errors)
+
+    if 'category' in filters:
+        category = Category.objects.filter(pk=filters['category']).only('path').first()
+        if category is None:
+            raise ValidationError({'category': ['Category not found.']})
+        filters['category'] = category
+    return filters
+
+
+def in_category(category):
+    """Q over products for `category` and its subcategories, as an indexed subquery"""
+    members = Product.categories.through.objects.filter(subtree_filter(category.path, 'category__path'))
+    return Q(pk__in=members.values('product_id'))
+
+
+def filter_conditions(filters, exclude=None):
+    """Q for every filter except those of the `exclude` facet family"""
+    condition = Q()
+    if exclude != 'price':
+        if 'price_min' in filters:
+            condition &= Q(price__gte=filters['price_min'])
+        if 'price_max' in filters:
+            condition &= Q(price__lte=filters['price_max'])
+    if exclude != 'category' and 'category' in filters:
+        condition &= in_category(filters['category'])
+    if exclude != 'in_stock' and 'in_stock' in filters:
+        condition &= Q(stock_quantity__gt=0) if filters['in_stock'] else Q(stock_quantity=0)
+    if 'is_active' in filters:
+        condition &= Q(is_active=filters['is_active'])
+    return condition
+
+
+def price_bands():
+    """[(low, high), ...] with high None for the last band"""
+    lows = [Decimal('0.00')] + PRICE_BAND_LIMITS
+    return list(zip(lows, PRICE_BAND_LIMITS + [None]))
+
+
+def price_facet(queryset):
+    bands = price_bands()
+    band = Case(
+        *[When(price__lt=high, then=Value(index)) for index, (low, high) in enumerate(bands[:-1])],
+        default=Value(len(bands) - 1),
+        output_field=IntegerField(),
+    )
+    counts = dict(queryset.order_by().annotate(band=band).values_list('band').annotate(count=Count('pk')))
+    return [
+        # Strings, like prices elsewhere in the API
+        {'min': str(low), 'max': str(high) if high is not None else None, 'count': counts.get(index, 0)}
+        for index, (low, high) in enumerate(bands)
+    ]
+
+
+def category_facet(queryset, parent):
+    """Counts per child of `parent` (roots when None), each over the child's whole subtree"""
+    children = list(Category.objects.filter(parent=parent).order_by('name').only('id', 'name', 'path'))
+    if not children:
+        return []
+    bucket = Case(
+        *[When(subtree_filter(child.path, 'category__path'), then=Value(child.pk)) for child in children],
+        output_field=IntegerField(),
+    )
+    Through = Product.categories.through
+    counts = dict(
+        Through.objects.filter(product_id__in=queryset.order_by().values('pk'))
+        .annotate(bucket=bucket).exclude(bucket=None).order_by()
+        .values_list('bucket').annotate(count=Count('product_id', distinct=True))
+    )
+    return [{'id': child.pk, 'name': child.name, 'count': counts.get(child.pk, 0)} for child in children]
+
+
+def stock_facet(queryset):
+    in_stock = Case(When(stock_quantity__gt=0, then=Value(True)), default=Value(False), output_field=BooleanField())
+    counts = dict(queryset.order_by().annotate(in_stock=in_stock).values_list('in_stock').annotate(count=Count('pk')))
+    return {'true': counts.get(True, 0), 'false': counts.get(False, 0)}
+
+
+def compute_facets(queryset, filters):
+    """
+    Facet counts for a base product queryset, one grouped query per family.
+    Each family ignores its own filter, so the counts show what selecting
+    another value of that family would return.
+    """
+    return {
+        'price': price_facet(queryset.filter(filter_conditions(filters, exclude='price'))),
+        'categories': category_facet(
+            queryset.filter(filter_conditions(filters, exclude='category')), filters.get('category')
+        ),
+        'in_stock': stock_facet(queryset.filter(filter_conditions(filters, exclude='in_stock'))),
+    }
+
+
+def get_facets(queryset, filters, scope=''):
+    """
+    compute_facets() cached per filter signature, so paging or reordering a
+    filtered listing reuses the counts. `scope` separates base querysets that
+    differ for the same params (e.g. staff seeing inactive products).
+    """
+    signature = '&'.join(
+        f'{name}={filters[name].pk if name == "category" else filters[name]}'
+        for name in FILTER_PARAMS if name in filters
+    )
+    generations = f"product={get_generation('product')},category={get_generation('category')}"
+    raw = f'{scope}?{signature}:{generations}'
+    key = f'{KEY_PREFIX}:facets:{hashlib.md5(raw.encode()).hexdigest()}'
+    facets, _ = get_or_compute(key, lambda: compute_facets(queryset, filters))
+    return facets
@@ -0,0 +1,285 @@
+import codecs
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from rest_framework.parsers import BaseParser
+from .cache import invalidate
+from .models import Category, InventoryMovement, Product, ProductImport
+from .stats import apply_changes, snapshot
+
+CONTENT_TYPES = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+}
+CATEGORY_PATH_SEPARATOR = ' > '
+CATEGORY_LIST_SEPARATOR = '|'
+MAX_STORED_ERRORS = 100
+# Largest values the columns hold: price is max_digits=10, decimal_places=2; stock a PositiveIntegerField
+MAX_PRICE = Decimal('99999999.99')
+MAX_STOCK_QUANTITY = 2147483647
+
+
+class ImportConflict(Exception):
+    """Another importer committed rows to the same job since this one last looked"""
+
+
+def iter_rows(lines, fmt):
+    """
+    Yields raw row dicts from an iterable of text lines, one at a time.
+    CSV needs a header line; NDJSON is one JSON object per line.
+    """
+    if fmt == 'csv':
+        yield from csv.DictReader(lines)
+        return
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            # Handed on as-is so it is reported as a bad row rather than aborting the import
+            yield line
+
+
+def iter_file_lines(path):
+    with open(path, newline='', encoding='utf-8') as handle:
+        yield from handle
+
+
+class FeedStreamParser(BaseParser):
+    """Hands the body stream to the view unread, so feeds are consumed line by line"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream
+
+
+class CSVFeedParser(FeedStreamParser):
+    media_type = 'text/csv'
+
+
+class NDJSONFeedParser(FeedStreamParser):
+    media_type = 'application/x-ndjson'
+
+
+def iter_request_lines(request):
+    """Streams the request body (parsed by a FeedStreamParser) line by line"""
+    stream = request.data
+    if not hasattr(stream, 'read'):
+        return iter(())
+    return codecs.iterdecode(stream, 'utf-8')
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in ('1', 'true', 'yes', 'y'):
+        return True
+    if value in ('0', 'false', 'no', 'n'):
+        return False
+    raise ValueError(f'Invalid boolean "{value}"')
+
+
+def parse_category_paths(value):
+    """Accepts 'A > B|C' (CSV) or ['A > B', 'C'] (NDJSON); returns a list of name tuples"""
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        value = value.split(CATEGORY_LIST_SEPARATOR)
+    paths = []
+    for path in value:
+        names = tuple(name.strip() for name in str(path).split('>') if name.strip())
+        if names:
+            paths.append(names)
+    return paths
+
+
+def clean_row(raw):
+    """Coerces a raw row into model values; raises ValueError with a readable message"""
+    if not isinstance(raw, dict):
+        raise ValueError('Row must be a JSON object')
+    sku = str(raw.get('sku') or '').strip()
+    if not sku:
+        raise ValueError('sku is required')
+    if len(sku) > 50:
+        raise ValueError('sku is longer than 50 characters')
+
+    row = {'sku': sku}
+    for key in ('name', 'description'):
+        if raw.get(key) not in (None, ''):
+            row[key] = str(raw[key]).strip()
+    if len(row.get('name', '')) > 200:
+        raise ValueError('name is longer than 200 characters')
+    if raw.get('price') not in (None, ''):
+        try:
+            row['price'] = Decimal(str(raw['price'])).quantize(Decimal('0.01'))
+            # NaN survives quantize() but can't be compared below
+            if not row['price'].is_finite():
+                raise InvalidOperation
+        except InvalidOperation:
+            raise ValueError(f'Invalid price "{raw["price"]}"')
+        if row['price'] < Decimal('0.01'):
+            raise ValueError('price must be at least 0.01')
+        if row['price'] > MAX_PRICE:
+            raise ValueError(f'price cannot be more than {MAX_PRICE}')
+    if raw.get('stock_quantity') not in (None, ''):
+        try:
+            row['stock_quantity'] = int(raw['stock_quantity'])
+        except (TypeError, ValueError, OverflowError):
+            raise ValueError(f'Invalid stock_quantity "{raw["stock_quantity"]}"')
+        if row['stock_quantity'] < 0:
+            raise ValueError('stock_quantity cannot be negative')
+        if row['stock_quantity'] > MAX_STOCK_QUANTITY:
+            raise ValueError(f'stock_quantity cannot be more than {MAX_STOCK_QUANTITY}')
+    if raw.get('is_active') not in (None, ''):
+        row['is_active'] = parse_bool(raw['is_active'])
+    if 'categories' in raw:
+        row['categories'] = parse_category_paths(raw['categories'])
+    return row
+
+
+class CategoryPathResolver:
+    """Maps 'A > B > C' name paths to category ids, creating missing categories on the fly"""
+
+    def __init__(self):
+        # The category set is small compared to the catalog, so it is loaded once
+        self.by_parent_and_name = {
+            (parent_id, name): pk for pk, parent_id, name in Category.objects.values_list('id', 'parent_id', 'name')
+        }
+
+    def resolve(self, names):
+        parent_id = None
+        for name in names:
+            key = (parent_id, name)
+            if key not in self.by_parent_and_name:
+                self.by_parent_and_name[key] = Category.objects.create(name=name, parent_id=parent_id).pk
+            parent_id = self.by_parent_and_name[key]
+        return parent_id
+
+
+class ProductImporter:
+    """
+    Upserts products by SKU in batches. Each batch commits in its own
+    transaction together with the job's progress counters, so an interrupted
+    import can resume from job.rows_committed.
+    """
+
+    def __init__(self, job, batch_size=1000, on_batch=None):
+        self.job = job
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.categories = CategoryPathResolver()
+
+    def run(self, rows):
+        """Imports `rows` (raw dicts, starting at job.rows_committed) and returns the job"""
+        iterator = iter(rows)
+        started = time.monotonic()
+        try:
+            while True:
+                batch = list(islice(iterator, self.batch_size))
+                if not batch:
+                    break
+                batch_started = time.monotonic()
+                self.import_batch(batch)
+                if self.on_batch:
+                    self.on_batch(self.job, len(batch), time.monotonic() - batch_started)
+        except ImportConflict:
+            # The job belongs to whoever committed first; leave its status alone
+            self.job.refresh_from_db()
+            raise
+        except Exception:
+            ProductImport.objects.filter(pk=self.job.pk).update(status='failed')
+            self.job.refresh_from_db()
+            raise
+
+        ProductImport.objects.filter(pk=self.job.pk).update(status='completed')
+        self.job.refresh_from_db()
+        self.job.elapsed = time.monotonic() - started
+        return self.job
+
+    def import_batch(self, raw_rows):
+        first_row = self.job.rows_committed + 1
+        rows = {}
+        errors = []
+        for number, raw in enumerate(raw_rows, start=first_row):
+            try:
+                row = clean_row(raw)
+            except ValueError as exc:
+                errors.append({'row': number, 'error': str(exc)})
+                continue
+            # Later rows for the same SKU win
+            rows[row['sku']] = (number, row)
+
+        now = timezone.now()
+        with transaction.atomic():
+            # Claim the job row first: a concurrent upload of the same chunk waits here,
+            # then finds the offset moved instead of importing the rows a second time
+            committed = ProductImport.objects.select_for_update().values_list('rows_committed', flat=True).get(pk=self.job.pk)
+            if committed != self.job.rows_committed:
+                raise ImportConflict(f'Import {self.job.pk} is at row {committed}, not {self.job.rows_committed}')
+            # Locked, so the stock differences below are from the values this batch overwrites
+            existing = Product.objects.select_for_update().in_bulk(list(rows), field_name='sku')
+            before = snapshot(product.pk for product in existing.values())
+            to_create, to_update, update_fields = [], [], set()
+            stock_deltas = {}
+            for sku, (number, row) in rows.items():
+                values = {key: value for key, value in row.items() if key != 'categories'}
+                product = existing.get(sku)
+                if product is None:
+                    if 'name' not in values or 'price' not in values:
+                        errors.append({'row': number, 'error': 'name and price are required for new products'})
+                        continue
+                    to_create.append(Product(**values))
+                else:
+                    if 'stock_quantity' in values:
+                        stock_deltas[product.pk] = stock_deltas.get(product.pk, 0) + values['stock_quantity'] - product.stock_quantity
+                    for key, value in values.items():
+                        setattr(product, key, value)
+                    product.updated_at = now
+                    update_fields.update(key for key in values if key != 'sku')
+                    to_update.append(product)
+
+            Product.objects.bulk_create(to_create)
+            if to_update and update_fields:
+                Product.objects.bulk_update(to_update, sorted(update_fields | {'updated_at'}))
+            self.replace_categories(to_create + to_update, rows)
+            # Feed stock levels go into the inventory ledger as the difference they make
+            reference = f'import:{self.job.pk}'
+            InventoryMovement.record({product.pk: product.stock_quantity for product in to_create}, 'restock', reference)
+            InventoryMovement.record(stock_deltas, 'adjustment', reference)
+            if to_create or to_update:
+                apply_changes(before, snapshot(product.pk for product in to_create + to_update))
+                invalidate('product')
+
+            progress = {
+                'rows_committed': F('rows_committed') + len(raw_rows),
+                'created_count': F('created_count') + len(to_create),
+                'updated_count': F('updated_count') + len(to_update),
+                'failed_count': F('failed_count') + len(errors),
+                'updated_at': now,
+            }
+            if errors and len(self.job.errors) < MAX_STORED_ERRORS:
+                progress['errors'] = (self.job.errors + errors)[:MAX_STORED_ERRORS]
+            ProductImport.objects.filter(pk=self.job.pk).update(**progress)
+        self.job.refresh_from_db()
+
+    def replace_categories(self, products, rows):
+        Through = Product.categories.through
+        links = []
+        product_ids = []
+        for product in products:
+            row = rows[product.sku][1]
+            if 'categories' not in row:
+                continue
+            product_ids.append(product.pk)
+            category_ids = {self.categories.resolve(names) for names in row['categories']}
+            links.extend(Through(product_id=product.pk, category_id=pk) for pk in category_ids)
+        if product_ids:
+            Through.objects.filter(product_id__in=product_ids).delete()
+            Through.objects.bulk_create(links)
@@ -0,0 +1,118 @@
+from datetime import timedelta
+from itertools import islice
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import Max, OuterRef, Subquery, Sum
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from .models import InventoryMovement, InventorySnapshot, Product
+
+# Deltas per UPDATE: four parameters each keeps a statement under SQLite's old 999-variable limit
+ADJUSTMENT_CHUNK_SIZE = 200
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def stock_at(product_id, at):
+    """
+    A product's stock at time `at`: the latest snapshot taken by then plus the
+    movements after it, so the cost doesn't grow with the length of the ledger.
+    Returns None for times before the ledger started tracking the product.
+    """
+    snapshot = (
+        InventorySnapshot.objects.filter(product_id=product_id, taken_at__lte=at)
+        .order_by('-taken_at', '-last_movement_id').first()
+    )
+    if snapshot is None:
+        if InventorySnapshot.objects.filter(product_id=product_id, last_movement_id=0).exists():
+            # The opening snapshot is later: the product predates the ledger
+            return None
+        base, after = 0, 0
+    else:
+        base, after = snapshot.stock_quantity, snapshot.last_movement_id
+
+    moved = InventoryMovement.objects.filter(
+        product_id=product_id, id__gt=after, created_at__lte=at
+    ).aggregate(total=Sum('quantity'))['total']
+    return base + (moved or 0)
+
+
+def compact(lag=None, batch_size=1000):
+    """
+    Folds the movements since the last compaction into one new snapshot per
+    product touched. Movements younger than `lag` wait for the next run, so a
+    transaction that commits late (with a lower id) is never skipped over.
+    Returns the number of snapshots written.
+    """
+    if lag is None:
+        lag = timedelta(seconds=getattr(settings, 'INVENTORY_COMPACTION_LAG', 300))
+    watermark = InventorySnapshot.objects.aggregate(last=Max('last_movement_id'))['last'] or 0
+    cutoff = InventoryMovement.objects.filter(
+        id__gt=watermark, created_at__lt=timezone.now() - lag
+    ).aggregate(last=Max('id'))['last']
+    if cutoff is None:
+        return 0
+
+    totals = (
+        InventoryMovement.objects.filter(id__gt=watermark, id__lte=cutoff)
+        .values_list('product_id').annotate(total=Sum('quantity'), last_at=Max('created_at')).order_by('product_id')
+    )
+    written = 0
+    with transaction.atomic():
+        for chunk in chunked(totals.iterator(chunk_size=batch_size), batch_size):
+            product_ids = [product_id for product_id, _, _ in chunk]
+            # Snapshots only ever move forward, so a product's latest one has the highest movement id
+            newest = InventorySnapshot.objects.filter(product_id=OuterRef('product_id')).order_by('-last_movement_id')
+            latest = dict(
+                InventorySnapshot.objects.filter(product_id__in=product_ids, pk=Subquery(newest.values('pk')[:1]))
+                .values_list('product_id', 'stock_quantity')
+            )
+            InventorySnapshot.objects.bulk_create([
+                InventorySnapshot(
+                    product_id=product_id,
+                    stock_quantity=latest.get(product_id, 0) + total,
+                    last_movement_id=cutoff,
+                    taken_at=last_at,
+                )
+                for product_id, total, last_at in chunk
+            ])
+            written += len(chunk)
+    return written
+
+
+def apply_adjustments(deltas, kind, reference=''):
+    """
+    Applies {product_id: delta} stock adjustments all-or-nothing: a handful of
+    chunked UPDATEs plus the ledger inserts, whatever the number of products.
+    Raises ValidationError for unknown products or stock that would go negative.
+    """
+    with transaction.atomic():
+        stock = {}
+        for chunk in chunked(sorted(deltas), ADJUSTMENT_CHUNK_SIZE * 5):
+            stock.update(
+                Product.objects.select_for_update().filter(pk__in=chunk).order_by('pk').values_list('pk', 'stock_quantity')
+            )
+        errors = [f"Product {pk} does not exist" for pk in sorted(set(deltas) - set(stock))]
+        errors += [
+            f"Product {pk} has {stock[pk]} in stock, cannot apply {delta}"
+            for pk, delta in sorted(deltas.items()) if pk in stock and stock[pk] + delta < 0
+        ]
+        if errors:
+            raise ValidationError({'adjustments': errors})
+
+        updated = 0
+        for chunk in chunked(sorted(deltas), ADJUSTMENT_CHUNK_SIZE):
+            chunk_deltas = {pk: deltas[pk] for pk in chunk}
+            applied = Product.objects.adjust_stock(chunk_deltas, kind=kind, reference=reference)
+            if applied != len({pk for pk, delta in chunk_deltas.items() if delta}):
+                # Rows are locked above, so this only happens on backends without row locks
+                raise DatabaseError('Stock changed while being adjusted, please retry')
+            updated += applied
+    return updated
@@ -0,0 +1,68 @@
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from common.pagination import keyset_filter, with_tiebreaker
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Time catalog pages fetched with OFFSET against the same pages fetched by keyset'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', default='1,100,10000', help='Comma-separated page numbers to time')
+        parser.add_argument('--page-size', type=int, default=50)
+        parser.add_argument('--ordering', default='price', help='e.g. price, -created_at, name')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per page; the best one is reported')
+        parser.add_argument('--seed', type=int, default=0, help='Insert this many throwaway products first (rolled back)')
+
+    def handle(self, *args, **options):
+        try:
+            pages = [int(page) for page in options['pages'].split(',')]
+        except ValueError:
+            raise CommandError('--pages must be a comma-separated list of numbers')
+
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+            self.benchmark(pages, options['page_size'], with_tiebreaker(options['ordering'].split(',')), options['repeat'])
+            # Seeded rows are only there for the measurement
+            transaction.set_rollback(True)
+
+    def seed(self, count, batch_size=5000):
+        start = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            Product.objects.bulk_create([
+                Product(name=f'Benchmark product {i}', price=Decimal(i % 997) + Decimal('0.99'), sku=f'BENCH-{i}')
+                for i in range(offset, min(offset + batch_size, count))
+            ])
+        self.stdout.write(f'Seeded {count} products in {time.perf_counter() - start:.1f}s')
+
+    def timed(self, fetch, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fetch()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000
+
+    def benchmark(self, pages, page_size, ordering, repeat):
+        queryset = Product.objects.filter(is_active=True).order_by(*ordering)
+        total = queryset.count()
+        self.stdout.write(f'{total} active products, {page_size} per page, ordered by {", ".join(ordering)}')
+
+        for page in pages:
+            offset = (page - 1) * page_size
+            if offset >= total:
+                self.stdout.write(f'page {page:>7}: skipped, the catalog has {total // page_size + 1} pages')
+                continue
+            keyset = queryset
+            if offset:
+                # Where the previous page ended; a client gets this from its cursor, so it isn't timed
+                boundary = queryset[offset - 1]
+                keyset = queryset.filter(keyset_filter(ordering, [getattr(boundary, field.lstrip('-')) for field in ordering]))
+
+            offset_ms = self.timed(lambda: list(queryset[offset:offset + page_size]), repeat)
+            keyset_ms = self.timed(lambda: list(keyset[:page_size]), repeat)
+            self.stdout.write(f'page {page:>7}: offset {offset_ms:8.2f} ms   keyset {keyset_ms:8.2f} ms')
@@ -0,0 +1,19 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from products.inventory import compact
+
+
+class Command(BaseCommand):
+    help = 'Fold inventory movements into per-product stock snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lag', type=int, default=None,
+            help='Leave movements younger than this many seconds for the next run (default: INVENTORY_COMPACTION_LAG)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Products per snapshot insert')
+
+    def handle(self, *args, **options):
+        lag = timedelta(seconds=options['lag']) if options['lag'] is not None else None
+        written = compact(lag=lag, batch_size=options['batch_size'])
+        self.stdout.write(f'✅ Wrote {written} inventory snapshots')
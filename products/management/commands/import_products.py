@@ -0,0 +1,62 @@
+import os
+from itertools import islice
+from django.core.management.base import BaseCommand, CommandError
+from products.importer import ImportConflict, ProductImporter, iter_file_lines, iter_rows
+from products.models import ProductImport
+
+
+class Command(BaseCommand):
+    help = 'Stream a CSV or NDJSON catalog file into products, upserting by SKU'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with header) or NDJSON file')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per committed batch')
+        parser.add_argument('--resume', action='store_true', help='Continue the last unfinished import of this file')
+        parser.add_argument('--job', type=int, help='Continue a specific import job')
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f'File not found: {path}')
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+
+        job = self.get_job(path, fmt, options)
+        skip = job.rows_committed
+        if skip:
+            self.stdout.write(f'📋 Resuming import {job.pk} after row {skip}')
+        else:
+            self.stdout.write(f'📋 Started import {job.pk} of {path}')
+
+        rows = islice(iter_rows(iter_file_lines(path), fmt), skip, None)
+        importer = ProductImporter(job, batch_size=options['batch_size'], on_batch=self.report_batch)
+        try:
+            job = importer.run(rows)
+        except ImportConflict as exc:
+            raise CommandError(f'{exc}; another import of this job is running')
+
+        imported = job.rows_committed - skip
+        rate = imported / job.elapsed if job.elapsed else imported
+        self.stdout.write(
+            f'✅ Import {job.pk} completed: {job.rows_committed} rows, {job.created_count} created, '
+            f'{job.updated_count} updated, {job.failed_count} failed ({rate:.0f} rows/sec)'
+        )
+        for error in job.errors[:10]:
+            self.stdout.write(f"   row {error['row']}: {error['error']}")
+
+    def get_job(self, path, fmt, options):
+        if options['job']:
+            try:
+                return ProductImport.objects.get(pk=options['job'])
+            except ProductImport.DoesNotExist:
+                raise CommandError(f"Import job {options['job']} not found")
+        if options['resume']:
+            job = ProductImport.objects.filter(source=path).exclude(status='completed').first()
+            if job:
+                ProductImport.objects.filter(pk=job.pk).update(status='running')
+                return job
+        return ProductImport.objects.create(source=path, format=fmt)
+
+    def report_batch(self, job, rows, elapsed):
+        rate = rows / elapsed if elapsed else rows
+        self.stdout.write(f'   committed {job.rows_committed} rows ({rate:.0f} rows/sec)')
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from products.cache import invalidate
+from products.models import Category, CategoryStats, Product
+from products.stats import rebuild_category_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed price statistics of every category'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk insert')
+
+    def handle(self, *args, **options):
+        written = rebuild_category_stats(Category, Product, CategoryStats, batch_size=options['batch_size'])
+        invalidate('category')
+        self.stdout.write(f'✅ Rebuilt category stats for {written} categories')
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.cache import invalidate
+from products.models import Category
+from products.tree import rebuild_category_paths
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized path index for all categories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Rows per bulk update')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            changed = rebuild_category_paths(Category, batch_size=options['batch_size'])
+            if changed:
+                invalidate('category')
+
+        total = Category.objects.count()
+        self.stdout.write(f'✅ Rebuilt category tree: {changed} of {total} categories updated')
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:13
+
+from django.db import migrations, models
+
+
+def populate_paths(apps, schema_editor):
+    # A frozen copy of products.tree.rebuild_category_paths as of this migration;
+    # importing the live module would change what this migration does whenever it changes
+    Category = apps.get_model('products', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('id', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    changed = []
+    stack = [(pk, '', 0) for pk in children.get(None, [])]
+    while stack:
+        pk, parent_path, depth = stack.pop()
+        path = f'{parent_path}{pk}/'
+        changed.append(Category(id=pk, path=path, depth=depth))
+        stack.extend((child, path, depth + 1) for child in children.get(pk, []))
+    Category.objects.bulk_update(changed, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_category_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=255)),
+                ('format', models.CharField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], max_length=10)),
+                ('status', models.CharField(choices=[('running', 'Running'), ('completed', 'Completed'), ('failed', 'Failed')], default='running', max_length=20)),
+                ('rows_committed', models.PositiveBigIntegerField(default=0)),
+                ('created_count', models.PositiveBigIntegerField(default=0)),
+                ('updated_count', models.PositiveBigIntegerField(default=0)),
+                ('failed_count', models.PositiveBigIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:54
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_stats(apps, schema_editor):
+    # A frozen copy of products.stats.rebuild_category_stats as of this migration,
+    # so later changes to that module can't change what this migration does
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    CategoryStats = apps.get_model('products', 'CategoryStats')
+    paths = dict(Category.objects.values_list('pk', 'path'))
+    members = {}
+    memberships = Product.categories.through.objects.filter(product__is_active=True).values_list(
+        'category_id', 'product_id', 'product__price'
+    )
+    for category_id, product_id, price in memberships.iterator():
+        for pk in (int(part) for part in paths[category_id].split('/') if part):
+            members.setdefault(pk, {})[product_id] = price
+
+    rows = []
+    for pk in paths:
+        prices = list(members.get(pk, {}).values())
+        rows.append(CategoryStats(
+            category_id=pk,
+            product_count=len(prices),
+            price_sum=sum(prices, Decimal('0.00')),
+            min_price=min(prices, default=None),
+            max_price=max(prices, default=None),
+        ))
+    CategoryStats.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_import'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='products.category')),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('price_sum', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('min_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('max_price', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'category stats',
+            },
+        ),
+        migrations.RunPython(populate_stats, migrations.RunPython.noop),
+    ]
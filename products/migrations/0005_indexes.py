@@ -0,0 +1,21 @@
+# Generated by Django 5.2.6 on 2026-10-16 23:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_category_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['parent', 'name'], name='category_parent_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['id'], name='product_active_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.6 on 2026-10-17 09:12
+
+from django.db import migrations
+
+# The SQL is spelled out here rather than imported from products.search, so later changes
+# to that module can't change what this migration does
+
+# SQLite: FTS5 external-content table over products_product, kept in sync by triggers
+SQLITE_SETUP = [
+    """CREATE VIRTUAL TABLE products_product_fts USING fts5(
+        name, description, sku, content='products_product', content_rowid='id', tokenize='unicode61'
+    )""",
+    """CREATE TRIGGER products_product_fts_ai AFTER INSERT ON products_product BEGIN
+        INSERT INTO products_product_fts(rowid, name, description, sku) VALUES (new.id, new.name, new.description, new.sku);
+    END""",
+    """CREATE TRIGGER products_product_fts_ad AFTER DELETE ON products_product BEGIN
+        INSERT INTO products_product_fts(products_product_fts, rowid, name, description, sku)
+        VALUES ('delete', old.id, old.name, old.description, old.sku);
+    END""",
+    """CREATE TRIGGER products_product_fts_au AFTER UPDATE OF name, description, sku ON products_product BEGIN
+        INSERT INTO products_product_fts(products_product_fts, rowid, name, description, sku)
+        VALUES ('delete', old.id, old.name, old.description, old.sku);
+        INSERT INTO products_product_fts(rowid, name, description, sku) VALUES (new.id, new.name, new.description, new.sku);
+    END""",
+    # Index whatever is already in the table
+    "INSERT INTO products_product_fts(products_product_fts) VALUES ('rebuild')",
+]
+SQLITE_TEARDOWN = [
+    'DROP TRIGGER IF EXISTS products_product_fts_ai',
+    'DROP TRIGGER IF EXISTS products_product_fts_ad',
+    'DROP TRIGGER IF EXISTS products_product_fts_au',
+    'DROP TABLE IF EXISTS products_product_fts',
+]
+
+# Postgres: GIN index over the weighted document products.search queries with
+POSTGRES_SETUP = [
+    """CREATE INDEX product_search_idx ON products_product USING GIN ((
+        setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(sku, '')), 'B') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'C')
+    ))""",
+]
+POSTGRES_TEARDOWN = [
+    'DROP INDEX IF EXISTS product_search_idx',
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_SETUP, 'postgresql': POSTGRES_SETUP}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_TEARDOWN, 'postgresql': POSTGRES_TEARDOWN}.get(schema_editor.connection.vendor, [])
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.6 on 2026-10-17 10:48
+
+import django.db.models.deletion
+import django.utils.timezone
+from itertools import islice
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_opening_snapshots(apps, schema_editor):
+    # Every product's current stock is the ledger's starting point (last_movement_id 0).
+    # Kept self-contained: migrations must not import app code that changes later.
+    Product = apps.get_model('products', 'Product')
+    InventorySnapshot = apps.get_model('products', 'InventorySnapshot')
+    now = timezone.now()
+    rows = Product.objects.values_list('pk', 'stock_quantity').order_by('pk').iterator(chunk_size=1000)
+    while True:
+        chunk = list(islice(rows, 1000))
+        if not chunk:
+            return
+        InventorySnapshot.objects.bulk_create([
+            InventorySnapshot(product_id=pk, stock_quantity=stock, last_movement_id=0, taken_at=now) for pk, stock in chunk
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('kind', models.CharField(choices=[('sale', 'Sale'), ('cancel', 'Cancel'), ('restock', 'Restock'), ('adjustment', 'Adjustment'), ('reservation', 'Reservation'), ('release', 'Release')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_movements', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'id'], name='movement_product_idx'), models.Index(fields=['created_at'], name='movement_created_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stock_quantity', models.IntegerField()),
+                ('last_movement_id', models.BigIntegerField()),
+                ('taken_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='inventory_snapshots', to='products.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'taken_at'], name='snapshot_product_taken_idx'), models.Index(fields=['product', 'last_movement_id'], name='snapshot_product_movement_idx')],
+            },
+        ),
+        migrations.RunPython(create_opening_snapshots, migrations.RunPython.noop),
+    ]
@@ -1,37 +1,123 @@
 # products/models.py
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Concat, Substr
 from django.core.validators import MinValueValidator
+from django.utils import timezone
 from decimal import Decimal
+from .cache import invalidate
+from .tree import build_path, path_to_ids, subtree_filter
 
 
 class Category(models.Model):
     name = models.CharField(max_length=100)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+    # Materialized path of ancestor ids including self (e.g. '1/5/9/'), kept in sync on save
+    path = models.CharField(max_length=255, db_index=True, blank=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'categories'
         ordering = ['name']
+        indexes = [
+            # Children of a node in display order
+            models.Index(fields=['parent', 'name'], name='category_parent_name_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        old_path = self.path
+        parent_path = ''
+        if self.parent_id:
+            # Read the parent's path fresh; the cached parent instance may be stale after a move
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError('A category cannot be moved under itself or one of its descendants')
+
+        super().save(*args, **kwargs)
+
+        new_path = build_path(parent_path, self.pk)
+        if new_path == old_path:
+            return
+
+        new_depth = len(path_to_ids(new_path)) - 1
+        Category.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+        if old_path:
+            # Re-root the whole subtree in one statement
+            Category.objects.filter(subtree_filter(old_path)).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                depth=F('depth') + (new_depth - self.depth),
+                updated_at=timezone.now(),
+            )
+            # The subtree's products leave the old ancestors and join the new ones
+            from .stats import recompute_category_stats
+            recompute_category_stats(set(path_to_ids(old_path)[:-1]) | set(path_to_ids(new_path)[:-1]))
+        self.path = new_path
+        self.depth = new_depth
+
+    def get_ancestor_ids(self):
+        """Returns the ids of all ancestors, root first"""
+        return path_to_ids(self.path)[:-1]
+
+    def get_ancestors(self):
+        """Returns all ancestor categories, root first"""
+        ancestors = Category.objects.in_bulk(self.get_ancestor_ids())
+        return [ancestors[pk] for pk in self.get_ancestor_ids() if pk in ancestors]
+
+    def get_descendants(self, include_self=False):
+        """Returns a queryset of all descendant categories"""
+        descendants = Category.objects.filter(subtree_filter(self.path))
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
     def get_full_path(self):
         """Returns the full category path (e.g., 'All Products > Bakery > Bread')"""
-        path = [self.name]
-        parent = self.parent
-        while parent:
-            path.insert(0, parent.name)
-            parent = parent.parent
+        ancestor_ids = self.get_ancestor_ids()
+        names = dict(Category.objects.filter(pk__in=ancestor_ids).values_list('id', 'name')) if ancestor_ids else {}
+        path = [names[pk] for pk in ancestor_ids if pk in names]
+        path.append(self.name)
         return ' > '.join(path)
 
     def get_all_children(self):
         """Returns all descendant categories"""
-        children = list(self.children.all())
-        for child in list(children):
-            children.extend(child.get_all_children())
-        return children
+        return list(self.get_descendants())
+
+
+class ProductQuerySet(models.QuerySet):
+    def adjust_stock(self, deltas, kind='adjustment', reference=''):
+        """
+        Applies {product_id: delta} stock changes in a single UPDATE. Rows that
+        would go negative are left alone; returns the number of rows updated.
+
+        When every row is updated the changes are also written to the inventory
+        ledger (one bulk insert). Callers roll back on a partial update, so a
+        partial update writes no movements.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return 0
+        condition = Q()
+        whens = []
+        for pk, delta in deltas.items():
+            if delta < 0:
+                condition |= Q(pk=pk, stock_quantity__gte=-delta)
+            else:
+                condition |= Q(pk=pk)
+            whens.append(When(pk=pk, then=F('stock_quantity') + delta))
+        updated = self.filter(condition).update(
+            stock_quantity=Case(*whens, default=F('stock_quantity'), output_field=models.IntegerField()),
+            updated_at=timezone.now()
+        )
+        if updated:
+            invalidate('product')
+        if updated == len(deltas):
+            InventoryMovement.record(deltas, kind, reference)
+        return updated
 
 
 class Product(models.Model):
@@ -45,5 +131,166 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Catalog listing: active products in id order; inactive rows stay out of the index
+            models.Index(fields=['id'], condition=Q(is_active=True), name='product_active_idx'),
+            # Keyset pages over the orderings the catalog offers, each with its id tiebreaker
+            models.Index(fields=['price', 'id'], condition=Q(is_active=True), name='product_active_price_idx'),
+            models.Index(fields=['name', 'id'], condition=Q(is_active=True), name='product_active_name_idx'),
+            models.Index(fields=['created_at', 'id'], condition=Q(is_active=True), name='product_active_created_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_stock = instance.__dict__.get('stock_quantity')
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        if fields is None or 'stock_quantity' in fields:
+            self._loaded_stock = self.__dict__.get('stock_quantity')
+
+    def save(self, *args, **kwargs):
+        # Stock edited through save() goes into the ledger like adjust_stock() changes do
+        update_fields = kwargs.get('update_fields')
+        if self._state.adding:
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                InventoryMovement.record({self.pk: self.stock_quantity}, 'restock')
+        elif update_fields is not None and 'stock_quantity' not in update_fields:
+            super().save(*args, **kwargs)
+        elif update_fields is None and self.stock_quantity == getattr(self, '_loaded_stock', None):
+            # Stock wasn't touched: leave the column alone, so a stale instance can't undo a sale
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key and field.attname != 'stock_quantity' and field.attname not in deferred
+            ]
+            super().save(*args, **kwargs)
+        else:
+            # Lock the row so the movement is exactly what this save overwrites
+            with transaction.atomic():
+                before = Product.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'stock_quantity', flat=True
+                ).first()
+                super().save(*args, **kwargs)
+                if before is not None:
+                    InventoryMovement.record({self.pk: self.stock_quantity - before}, 'adjustment')
+        self._loaded_stock = self.stock_quantity
+
+
+class CategoryStats(models.Model):
+    """Price aggregates over the active products in a category and all its descendants (see products.stats)"""
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    product_count = models.PositiveIntegerField(default=0)
+    price_sum = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    max_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'category stats'
+
+    def __str__(self):
+        return f"Stats for category {self.category_id}"
+
+    @property
+    def average_price(self):
+        if not self.product_count:
+            return Decimal('0.00')
+        return (self.price_sum / self.product_count).quantize(Decimal('0.01'))
+
+
+class InventoryMovement(models.Model):
+    """Append-only ledger of stock changes; Product.stock_quantity is the running total"""
+    KIND_CHOICES = [
+        ('sale', 'Sale'),
+        ('cancel', 'Cancel'),
+        ('restock', 'Restock'),
+        ('adjustment', 'Adjustment'),
+        ('reservation', 'Reservation'),
+        ('release', 'Release'),
+    ]
+
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_movements')
+    quantity = models.IntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    reference = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # A product's movements after its latest snapshot
+            models.Index(fields=['product', 'id'], name='movement_product_idx'),
+            models.Index(fields=['created_at'], name='movement_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.quantity:+d} for product {self.product_id}"
+
+    @classmethod
+    def record(cls, deltas, kind, reference='', batch_size=1000):
+        """Writes {product_id: delta} as movements in one bulk insert per batch"""
+        now = timezone.now()
+        cls.objects.bulk_create([
+            cls(product_id=pk, quantity=delta, kind=kind, reference=reference[:100], created_at=now)
+            for pk, delta in deltas.items() if delta
+        ], batch_size=batch_size)
+
+
+class InventorySnapshot(models.Model):
+    """
+    A product's stock after every movement up to last_movement_id, folded in by
+    compaction (products.inventory), so stock at any time is one snapshot plus
+    the few movements after it.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory_snapshots')
+    stock_quantity = models.IntegerField()
+    last_movement_id = models.BigIntegerField()
+    taken_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'taken_at'], name='snapshot_product_taken_idx'),
+            models.Index(fields=['product', 'last_movement_id'], name='snapshot_product_movement_idx'),
+        ]
+
+    def __str__(self):
+        return f"Product {self.product_id}: {self.stock_quantity} at {self.taken_at:%Y-%m-%d %H:%M}"
+
+
+class ProductImport(models.Model):
+    """Progress of a streaming catalog import; rows_committed advances with each committed batch"""
+    STATUS_CHOICES = [
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('ndjson', 'NDJSON'),
+    ]
+
+    source = models.CharField(max_length=255)
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='running')
+    rows_committed = models.PositiveBigIntegerField(default=0)
+    created_count = models.PositiveBigIntegerField(default=0)
+    updated_count = models.PositiveBigIntegerField(default=0)
+    failed_count = models.PositiveBigIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
     def __str__(self):
-        return self.name
\ No newline at end of file
+        return f"Import {self.pk} ({self.source})"
@@ -0,0 +1,50 @@
+import re
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'products_product_fts'
+# Column weights: a hit in the name or SKU outranks one buried in the description
+NAME_WEIGHT, DESCRIPTION_WEIGHT, SKU_WEIGHT = 10.0, 1.0, 5.0
+MAX_SEARCH_TERMS = 10
+
+# SQLite: FTS5 external-content table over products_product, kept in sync by triggers.
+# Postgres: a GIN index over POSTGRES_DOCUMENT. Both are created by migration 0006_product_search,
+# and the query repeats this exact expression so the index applies
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(sku, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+)
+
+
+def parse_terms(query):
+    """Splits free text into lowercase word terms; punctuation never reaches the match syntax"""
+    return re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+
+
+def search_products(queryset, terms):
+    """
+    Restricts a Product queryset to rows matching every term (each as a prefix)
+    and orders it best match first. Other backends fall back to unranked icontains.
+    """
+    vendor = connection.vendor
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # Matching rows come from the FTS index; bm25() (lower is better) ranks each of them
+        matches = RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        rank = RawSQL(
+            f'SELECT bm25({FTS_TABLE}, {NAME_WEIGHT}, {DESCRIPTION_WEIGHT}, {SKU_WEIGHT}) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = products_product.id',
+            [match], output_field=FloatField()
+        )
+        return queryset.filter(pk__in=matches).annotate(rank=rank).order_by('rank', 'id')
+    if vendor == 'postgresql':
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        matches = RawSQL(f"({POSTGRES_DOCUMENT}) @@ to_tsquery('simple', %s)", [tsquery], output_field=BooleanField())
+        rank = RawSQL(f"ts_rank({POSTGRES_DOCUMENT}, to_tsquery('simple', %s))", [tsquery], output_field=FloatField())
+        return queryset.filter(matches).annotate(rank=rank).order_by('-rank', 'id')
+
+    for term in terms:
+        queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term) | Q(sku__icontains=term))
+    return queryset.order_by('id')
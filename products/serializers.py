@@ -1,23 +1,67 @@
-# products/serializers.py
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
-from .models import Category, Product
+from rest_framework.utils.field_mapping import get_unique_error_message
+from rest_framework.validators import UniqueValidator
+from common.serializers import FastRepresentationMixin, SparseFieldsetMixin
+from .cache import invalidate
+from .models import Category, InventoryMovement, Product, ProductImport
+from .stats import apply_changes
+from .tree import CategoryTree
 
 
-class CategorySerializer(serializers.ModelSerializer):
+def get_category_tree(context, categories):
+    """Returns a CategoryTree from the serializer context covering `categories`, building one if needed"""
+    tree = context.get('category_tree')
+    if tree is None or not tree.covers(categories):
+        tree = CategoryTree.for_categories(categories)
+        context['category_tree'] = tree
+    return tree
+
+
+class CategoryListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        categories = list(data.all() if hasattr(data, 'all') else data)
+        # Load every subtree on the page up front so nested children cost no queries
+        get_category_tree(self.context, categories)
+        return super().to_representation(categories)
+
+
+class CategorySerializer(FastRepresentationMixin, serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
-    full_path = serializers.CharField(source='get_full_path', read_only=True)
+    full_path = serializers.SerializerMethodField()
     
     class Meta:
         model = Category
         fields = ['id', 'name', 'parent', 'children', 'full_path', 'created_at', 'updated_at']
+        list_serializer_class = CategoryListSerializer
     
     def get_children(self, obj):
-        if obj.children.exists():
-            return CategorySerializer(obj.children.all(), many=True).data
-        return []
+        tree = get_category_tree(self.context, [obj])
+        return [self.to_representation(child) for child in tree.children_of(obj)]
+
+    def get_full_path(self, obj):
+        return get_category_tree(self.context, [obj]).full_path(obj)
 
+    def validate_parent(self, parent):
+        # Category.save() refuses this too, but as a ValueError; here it's a 400 on the field
+        if self.instance is not None and self.instance.path and parent is not None and parent.path.startswith(self.instance.path):
+            raise serializers.ValidationError('A category cannot be moved under itself or one of its descendants.')
+        return parent
 
-class ProductSerializer(serializers.ModelSerializer):
+
+class ProductListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, 'all') else data)
+        if self.child.needs_category_tree():
+            # Build one tree for every category on the page (expects categories to be prefetched)
+            categories = {category.pk: category for product in products for category in product.categories.all()}
+            if categories:
+                get_category_tree(self.context, categories.values())
+        return super().to_representation(products)
+
+
+class ProductSerializer(SparseFieldsetMixin, FastRepresentationMixin, serializers.ModelSerializer):
     categories = CategorySerializer(many=True, read_only=True)
     category_ids = serializers.PrimaryKeyRelatedField(
         many=True, 
@@ -25,20 +69,139 @@ class ProductSerializer(serializers.ModelSerializer):
         source='categories',
         write_only=True
     )
+    category_paths = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
         fields = [
             'id', 'name', 'description', 'price', 'sku', 
-            'categories', 'category_ids', 'stock_quantity', 
+            'categories', 'category_ids', 'category_paths', 'stock_quantity', 
             'is_active', 'created_at', 'updated_at'
         ]
+        list_serializer_class = ProductListSerializer
+        # ?view=compact renders these, with categories as ids
+        compact_fields = ['id', 'name', 'price', 'sku', 'categories', 'stock_quantity', 'is_active']
+        # Only rendered when asked for, e.g. ?fields=id,name,category_paths
+        optional_fields = ['category_paths']
+
+    def get_compact_field(self, name):
+        if name == 'categories':
+            return serializers.PrimaryKeyRelatedField(many=True, read_only=True)
+        return None
+
+    def needs_category_tree(self):
+        return 'category_paths' in self.fields or isinstance(self.fields.get('categories'), CategoryListSerializer)
+
+    def get_category_paths(self, obj):
+        categories = obj.categories.all()
+        tree = get_category_tree(self.context, categories)
+        return [tree.full_path(category) for category in categories]
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolves pks from a {pk: instance} dict in the serializer context when one
+    is present (see ProductBulkCreateSerializer), instead of a query per value.
+    """
+
+    def __init__(self, **kwargs):
+        self.context_key = kwargs.pop('context_key')
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        preloaded = self.context.get(self.context_key)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            return preloaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class PreloadedUniqueValidator(UniqueValidator):
+    """
+    UniqueValidator that checks against a set of taken values preloaded into the
+    serializer context. The serializer adds a value to the set once its row has
+    validated (see ProductCreateSerializer.validate), so later rows in the same
+    batch cannot reuse it, but can reuse a value from a row that failed.
+    """
+
+    def __init__(self, queryset, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(queryset, **kwargs)
+
+    def __call__(self, value, serializer_field):
+        taken = serializer_field.context.get(self.context_key)
+        if taken is None:
+            return super().__call__(value, serializer_field)
+        if value in taken:
+            raise serializers.ValidationError(self.message, code='unique')
+
+
+class ProductBulkCreateSerializer(serializers.ListSerializer):
+    """
+    Set-based bulk ingest: category ids and SKU uniqueness are resolved with one
+    query each, then products and their category links are inserted with one
+    batched statement each inside a single transaction. Errors are reported per
+    row exactly like a regular many=True serializer.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.preload(data)
+        return super().to_internal_value(data)
+
+    def preload(self, rows):
+        category_ids = set()
+        skus = set()
+        for row in rows:
+            if not isinstance(row, dict):
+                continue
+            categories = row.get('categories')
+            # Anything but a list is left for the field to report on its row
+            for pk in categories if isinstance(categories, (list, tuple)) else []:
+                try:
+                    category_ids.add(int(pk))
+                except (TypeError, ValueError):
+                    pass
+            if isinstance(row.get('sku'), str):
+                skus.add(row['sku'].strip())
+
+        self.context['preloaded_categories'] = Category.objects.in_bulk(category_ids)
+        self.context['taken_skus'] = set(Product.objects.filter(sku__in=skus).values_list('sku', flat=True))
+
+    def create(self, validated_data):
+        Through = Product.categories.through
+        with transaction.atomic():
+            products = Product.objects.bulk_create([
+                Product(**{key: value for key, value in item.items() if key != 'categories'})
+                for item in validated_data
+            ])
+            Through.objects.bulk_create([
+                Through(product_id=product.pk, category_id=category.pk)
+                for product, item in zip(products, validated_data)
+                for category in {category.pk: category for category in item['categories']}.values()
+            ])
+            # bulk_create sends no signals
+            InventoryMovement.record({product.pk: product.stock_quantity for product in products}, 'restock')
+            apply_changes({}, {
+                product.pk: (product.price, product.is_active, frozenset(category.pk for category in item['categories']))
+                for product, item in zip(products, validated_data)
+            })
+            invalidate('product')
+        prefetch_related_objects(products, 'categories')
+        return products
 
 
 class ProductCreateSerializer(serializers.ModelSerializer):
-    categories = serializers.PrimaryKeyRelatedField(
+    categories = PreloadedPrimaryKeyRelatedField(
         many=True, 
-        queryset=Category.objects.all()
+        queryset=Category.objects.all(),
+        context_key='preloaded_categories'
     )
     
     class Meta:
@@ -46,4 +209,33 @@ class ProductCreateSerializer(serializers.ModelSerializer):
         fields = [
             'name', 'description', 'price', 'sku', 
             'categories', 'stock_quantity', 'is_active'
-        ]
\ No newline at end of file
+        ]
+        list_serializer_class = ProductBulkCreateSerializer
+        extra_kwargs = {
+            'sku': {
+                'validators': [
+                    PreloadedUniqueValidator(
+                        queryset=Product.objects.all(),
+                        context_key='taken_skus',
+                        message=get_unique_error_message(Product._meta.get_field('sku')),
+                    )
+                ]
+            }
+        }
+
+    def validate(self, attrs):
+        # Only reached when every field is valid, so a rejected row doesn't claim its SKU
+        taken = self.context.get('taken_skus')
+        if taken is not None:
+            taken.add(attrs['sku'])
+        return attrs
+
+
+class ProductImportSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ProductImport
+        fields = [
+            'id', 'source', 'format', 'status', 'rows_committed', 'created_count',
+            'updated_count', 'failed_count', 'errors', 'created_at', 'updated_at'
+        ]
+        read_only_fields = fields
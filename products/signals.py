@@ -0,0 +1,68 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .cache import invalidate
+from .models import Category, Product
+from .stats import apply_changes, recompute_category_stats, snapshot
+from .tree import path_to_ids
+
+
+# Bulk writes (bulk_create/bulk_update/queryset.update) send no signals;
+# those code paths call cache.invalidate() and stats.apply_changes() themselves.
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, **kwargs):
+    invalidate('product')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, **kwargs):
+    # Product responses embed categories, so they are invalidated through the category generation
+    invalidate('category')
+
+
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ('pre_add', 'pre_remove', 'pre_clear'):
+        if not reverse:
+            product_ids = [instance.pk]
+        elif pk_set is not None:
+            product_ids = pk_set
+        else:
+            # category.products.clear() doesn't say which products it touches
+            product_ids = instance.products.values_list('pk', flat=True)
+        instance._stats_before = snapshot(product_ids)
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    before = getattr(instance, '_stats_before', {})
+    apply_changes(before, snapshot(before))
+    # Membership is part of a product's representation, so it moves updated_at (and the ETag)
+    Product.objects.filter(pk__in=before).update(updated_at=timezone.now())
+    invalidate('product')
+
+
+@receiver([pre_save, pre_delete], sender=Product)
+def product_stats_before(sender, instance, **kwargs):
+    if not instance._state.adding:
+        instance._stats_before = snapshot([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def product_stats_after_save(sender, instance, created, **kwargs):
+    # New products have no categories yet; they are counted when categories are added
+    if not created:
+        before = getattr(instance, '_stats_before', {})
+        apply_changes(before, snapshot(before))
+
+
+@receiver(post_delete, sender=Product)
+def product_stats_after_delete(sender, instance, **kwargs):
+    apply_changes(getattr(instance, '_stats_before', {}), {})
+
+
+@receiver(post_delete, sender=Category)
+def category_stats_after_delete(sender, instance, **kwargs):
+    # Products only reachable through the deleted subtree drop out of the ancestors
+    recompute_category_stats(path_to_ids(instance.path)[:-1])
@@ -0,0 +1,164 @@
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Count, Max, Min, Sum
+from django.utils import timezone
+from .models import Category, CategoryStats, Product
+from .tree import path_to_ids, subtree_filter
+
+
+def snapshot(product_ids):
+    """Returns {product_id: (price, is_active, frozenset(category_ids))} in two queries"""
+    product_ids = list(product_ids)
+    if not product_ids:
+        return {}
+    categories = {}
+    memberships = Product.categories.through.objects.filter(product_id__in=product_ids)
+    for product_id, category_id in memberships.values_list('product_id', 'category_id'):
+        categories.setdefault(product_id, set()).add(category_id)
+    return {
+        pk: (price, is_active, frozenset(categories.get(pk, ())))
+        for pk, price, is_active in Product.objects.filter(pk__in=product_ids).values_list('pk', 'price', 'is_active')
+    }
+
+
+class StatsDelta:
+    def __init__(self):
+        self.count = 0
+        self.total = Decimal('0.00')
+        self.added = []
+        self.removed = set()
+
+    def add(self, price):
+        self.count += 1
+        self.total += price
+        self.added.append(price)
+
+    def remove(self, price):
+        self.count -= 1
+        self.total -= price
+        self.removed.add(price)
+
+
+def apply_changes(before, after):
+    """
+    Updates CategoryStats for products moving from `before` to `after` (both
+    from snapshot(); a missing key means the product doesn't exist on that side).
+
+    A product counts once towards every category whose subtree holds it, so
+    only the categories it enters or leaves are touched: count and sum move by
+    deltas, min/max merge in added prices, and a category whose min or max
+    was removed gets recomputed.
+
+    Every change locks the rows of all the product's ancestors, so the root
+    categories' rows are hot: concurrent catalog writes under one root queue on
+    its lock until they commit. Rows are locked in pk order, so they wait rather
+    than deadlock. Only price, active-flag and membership changes get here
+    (stock changes don't), and bulk writers (imports) pass a whole batch in one
+    call, so a batch takes each lock once.
+    """
+    changes = []
+    category_ids = set()
+    for pk in set(before) | set(after):
+        old, new = before.get(pk), after.get(pk)
+        if old != new:
+            changes.append((old, new))
+            category_ids.update(old[2] if old else (), new[2] if new else ())
+    if not changes:
+        return
+
+    paths = dict(Category.objects.filter(pk__in=category_ids).values_list('pk', 'path'))
+
+    def covered(state):
+        if state is None or not state[1]:
+            return set()
+        return {pk for category_id in state[2] if category_id in paths for pk in path_to_ids(paths[category_id])}
+
+    deltas = {}
+    for old, new in changes:
+        left, entered = covered(old), covered(new)
+        if old and new and old[0] == new[0]:
+            # Same price: categories on both sides are unaffected
+            left, entered = left - entered, entered - left
+        for pk in left:
+            deltas.setdefault(pk, StatsDelta()).remove(old[0])
+        for pk in entered:
+            deltas.setdefault(pk, StatsDelta()).add(new[0])
+    if not deltas:
+        return
+
+    now = timezone.now()
+    # No savepoint: callers are usually already inside their own transaction
+    with transaction.atomic(savepoint=False):
+        CategoryStats.objects.bulk_create([CategoryStats(category_id=pk) for pk in deltas], ignore_conflicts=True)
+        rows = list(CategoryStats.objects.select_for_update().filter(pk__in=deltas).order_by('pk'))
+        stale = []
+        for stats in rows:
+            delta = deltas[stats.pk]
+            stats.product_count += delta.count
+            stats.price_sum += delta.total
+            stats.updated_at = now
+            if delta.removed & {stats.min_price, stats.max_price}:
+                stale.append(stats.pk)
+            elif delta.added:
+                stats.min_price = min([price for price in (stats.min_price, *delta.added) if price is not None])
+                stats.max_price = max([price for price in (stats.max_price, *delta.added) if price is not None])
+        CategoryStats.objects.bulk_update(
+            rows, ['product_count', 'price_sum', 'min_price', 'max_price', 'updated_at']
+        )
+        if stale:
+            recompute_category_stats(stale)
+
+
+def recompute_category_stats(category_ids):
+    """Recomputes the stats of the given categories from scratch, one aggregate query each"""
+    Through = Product.categories.through
+    for category in Category.objects.filter(pk__in=category_ids).only('pk', 'path'):
+        members = Through.objects.filter(subtree_filter(category.path, 'category__path')).values('product_id')
+        aggregate = Product.objects.filter(is_active=True, pk__in=members).aggregate(
+            count=Count('pk'), total=Sum('price'), low=Min('price'), high=Max('price')
+        )
+        CategoryStats.objects.update_or_create(category_id=category.pk, defaults={
+            'product_count': aggregate['count'],
+            'price_sum': aggregate['total'] or Decimal('0.00'),
+            'min_price': aggregate['low'],
+            'max_price': aggregate['high'],
+        })
+
+
+def median_price(category, count):
+    """Median price of the active products under `category`; reads at most two rows"""
+    if not count:
+        return None
+    members = Product.categories.through.objects.filter(subtree_filter(category.path, 'category__path')).values('product_id')
+    prices = Product.objects.filter(is_active=True, pk__in=members).order_by('price').values_list('price', flat=True)
+    middle = list(prices[(count - 1) // 2:count // 2 + 1])
+    return (sum(middle) / len(middle)).quantize(Decimal('0.01'))
+
+
+def rebuild_category_stats(category_model, product_model, stats_model, batch_size=500):
+    """
+    Recomputes every category's stats in memory from one pass over the
+    category memberships of active products; returns the number of rows written.
+    """
+    paths = dict(category_model.objects.values_list('pk', 'path'))
+    Through = product_model.categories.through
+    members = {}
+    memberships = Through.objects.filter(product__is_active=True).values_list('category_id', 'product_id', 'product__price')
+    for category_id, product_id, price in memberships.iterator():
+        for pk in path_to_ids(paths[category_id]):
+            members.setdefault(pk, {})[product_id] = price
+
+    rows = []
+    for pk in paths:
+        prices = list(members.get(pk, {}).values())
+        rows.append(stats_model(
+            category_id=pk,
+            product_count=len(prices),
+            price_sum=sum(prices, Decimal('0.00')),
+            min_price=min(prices, default=None),
+            max_price=max(prices, default=None),
+        ))
+    with transaction.atomic():
+        stats_model.objects.all().delete()
+        stats_model.objects.bulk_create(rows, batch_size=batch_size)
+    return len(rows)
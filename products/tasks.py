@@ -0,0 +1,14 @@
+from celery import shared_task
+import logging
+from .inventory import compact
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def compact_inventory_ledger():
+    """Folds recent inventory movements into per-product snapshots; runs on beat"""
+    written = compact()
+    if written:
+        logger.info(f"Wrote {written} inventory snapshots")
+    return written
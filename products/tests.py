@@ -1,13 +1,29 @@
+import json
 import pytest
+from decimal import Decimal
+import threading
+import time
+from io import StringIO
+from django.core.cache import cache
+from django.db.models import F
+from django.core.management import call_command
 from django.test import TestCase
 from rest_framework import status
+from rest_framework.test import APIClient
 from rest_framework.test import APITestCase
 from django.contrib.auth import get_user_model
-from .models import Category, Product
+from common.explain import full_scans
+from .cache import get_or_compute, get_stats, invalidate
+from .models import Category, CategoryStats, Product, ProductImport
 
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    cache.clear()
+
+
 class CategoryModelTest(TestCase):
     def setUp(self):
         self.root_category = Category.objects.create(name='All Products')
@@ -37,6 +53,61 @@ class CategoryModelTest(TestCase):
         self.assertIn(self.parent_category, children)
         self.assertIn(self.child_category, children)
 
+    def test_materialized_path(self):
+        self.assertEqual(self.root_category.path, f'{self.root_category.id}/')
+        self.assertEqual(
+            self.child_category.path,
+            f'{self.root_category.id}/{self.parent_category.id}/{self.child_category.id}/'
+        )
+        self.assertEqual(self.child_category.depth, 2)
+
+    def test_tree_lookups_use_single_query(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.root_category.get_all_children()), 2)
+        with self.assertNumQueries(1):
+            self.child_category.get_full_path()
+        with self.assertNumQueries(0):
+            self.root_category.get_full_path()
+
+    def test_move_subtree(self):
+        other_root = Category.objects.create(name='Clearance')
+        self.parent_category.parent = other_root
+        self.parent_category.save()
+
+        self.child_category.refresh_from_db()
+        self.assertEqual(self.child_category.get_full_path(), 'Clearance > Electronics > Smartphones')
+        self.assertEqual(self.child_category.depth, 2)
+        self.assertNotIn(self.child_category, self.root_category.get_all_children())
+        self.assertIn(self.child_category, other_root.get_all_children())
+
+    def test_cannot_move_under_descendant(self):
+        self.parent_category.parent = self.child_category
+        with self.assertRaises(ValueError):
+            self.parent_category.save()
+
+    def test_rebuild_category_tree_command(self):
+        Category.objects.update(path='', depth=0)
+        call_command('rebuild_category_tree', stdout=StringIO())
+
+        self.child_category.refresh_from_db()
+        self.assertEqual(self.child_category.get_full_path(), 'All Products > Electronics > Smartphones')
+        self.assertEqual(self.child_category.depth, 2)
+
+    def test_subtree_filter_matches_prefix_on_every_backend(self):
+        from unittest.mock import patch
+        from .tree import subtree_filter
+        sibling = Category.objects.create(name='Sibling')
+        # Ids sharing a leading digit are where a collation-dependent range goes wrong
+        Category.objects.filter(pk=sibling.pk).update(path=f'{self.root_category.pk}0/')
+
+        expected = {self.root_category.pk, self.parent_category.pk, self.child_category.pk}
+        self.assertEqual(set(Category.objects.filter(subtree_filter(self.root_category.path)).values_list('pk', flat=True)), expected)
+        with patch('products.tree.connection') as connection:
+            connection.vendor = 'postgresql'
+            condition = subtree_filter(self.root_category.path)
+        self.assertEqual(condition.children, [('path__startswith', self.root_category.path)])
+        self.assertEqual(set(Category.objects.filter(condition).values_list('pk', flat=True)), expected)
+
 
 class ProductModelTest(TestCase):
     def setUp(self):
@@ -69,12 +140,50 @@ class TestCategoryAPI:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['results']) == 1
     
+    def test_list_categories_tree_in_constant_queries(self, authenticated_client, django_assert_num_queries):
+        root = Category.objects.create(name='All Products')
+        for i in range(3):
+            parent = Category.objects.create(name=f'Department {i}', parent=root)
+            for j in range(3):
+                Category.objects.create(name=f'Aisle {i}.{j}', parent=parent)
+
+        # token lookup, count, page, subtrees
+        with django_assert_num_queries(4):
+            response = authenticated_client.get('/api/products/categories/', {'page_size': 50})
+        assert response.status_code == status.HTTP_200_OK
+
+        results = {item['id']: item for item in response.data['results']}
+        root_data = results[root.id]
+        assert [child['name'] for child in root_data['children']] == ['Department 0', 'Department 1', 'Department 2']
+        assert root_data['children'][0]['children'][0]['full_path'] == 'All Products > Department 0 > Aisle 0.0'
+        assert root_data['children'][0]['children'][0]['children'] == []
+
+    def test_list_root_categories(self, authenticated_client):
+        root = Category.objects.create(name='All Products')
+        Category.objects.create(name='Bakery', parent=root)
+
+        response = authenticated_client.get('/api/products/categories/', {'roots': 'true'})
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['id'] for item in response.data['results']] == [root.id]
+        assert response.data['results'][0]['children'][0]['full_path'] == 'All Products > Bakery'
+
     def test_create_category(self, authenticated_client):
         data = {'name': 'New Category'}
         
         response = authenticated_client.post('/api/products/categories/', data)
         assert response.status_code == status.HTTP_201_CREATED
         assert response.data['name'] == 'New Category'
+
+    def test_cannot_move_category_under_its_subtree(self, authenticated_client, category):
+        child = Category.objects.create(name='Child', parent=category)
+        for parent in (child, category):
+            response = authenticated_client.patch(
+                f'/api/products/categories/{category.id}/', {'parent': parent.id}, format='json'
+            )
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+            assert 'parent' in response.data
+        category.refresh_from_db()
+        assert category.parent_id is None
     
     def test_category_average_price(self, authenticated_client, category, product):
         response = authenticated_client.get(f'/api/products/categories/{category.id}/average-price/')
@@ -91,6 +200,70 @@ class TestProductAPI:
         assert response.status_code == status.HTTP_200_OK
         assert len(response.data['results']) == 1
     
+    def test_list_products_within_query_budget(self, authenticated_client, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        root = Category.objects.create(name='All Products')
+        leaves = []
+        for i in range(4):
+            parent = Category.objects.create(name=f'Department {i}', parent=root)
+            leaves.extend(Category.objects.create(name=f'Aisle {i}.{j}', parent=parent) for j in range(3))
+        for i in range(60):
+            product = Product.objects.create(name=f'Product {i}', price='1.00', sku=f'SKU-{i}')
+            product.categories.add(leaves[i % len(leaves)], root)
+
+        response = authenticated_client.get('/api/products/', {'page_size': 200})
+        assert response.status_code == status.HTTP_200_OK
+        assert len(response.data['results']) == 60
+        first = response.data['results'][0]['categories']
+        assert {category['full_path'] for category in first} == {'All Products', 'All Products > Department 0 > Aisle 0.0'}
+
+        response = authenticated_client.get(f'/api/products/{product.id}/')
+        assert response.status_code == status.HTTP_200_OK
+
+    def test_query_budget_overrun_raises(self, authenticated_client, product, settings, monkeypatch):
+        from common.query_budget import QueryBudgetExceeded
+        from .views import ProductViewSet
+
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        monkeypatch.setattr(ProductViewSet, 'query_budget', {'list': 1})
+        with pytest.raises(QueryBudgetExceeded):
+            authenticated_client.get('/api/products/')
+
+    def test_list_products_compact_view(self, authenticated_client, product, category):
+        response = authenticated_client.get('/api/products/', {'view': 'compact'})
+
+        assert response.status_code == status.HTTP_200_OK
+        item = response.data['results'][0]
+        assert set(item) == {'id', 'name', 'price', 'sku', 'categories', 'stock_quantity', 'is_active'}
+        assert item['categories'] == [category.id]
+
+    def test_list_products_sparse_fields(self, authenticated_client, product, category, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        child = Category.objects.create(name='Child', parent=category)
+        product.categories.add(child)
+
+        response = authenticated_client.get('/api/products/', {'fields': 'id,sku,category_paths'})
+
+        assert response.status_code == status.HTTP_200_OK
+        item = response.data['results'][0]
+        assert set(item) == {'id', 'sku', 'category_paths'}
+        assert sorted(item['category_paths']) == ['Test Category', 'Test Category > Child']
+
+    @pytest.mark.parametrize('params', [{}, {'view': 'compact'}, {'fields': 'id,price,category_paths,updated_at'}])
+    def test_fast_serialization_is_byte_identical(self, authenticated_client, product, category, settings, params):
+        Category.objects.create(name='Child', parent=category)
+        product.categories.add(Category.objects.create(name='Other'))
+
+        settings.FAST_SERIALIZATION = False
+        regular = authenticated_client.get('/api/products/', params).content
+        regular_categories = authenticated_client.get('/api/products/categories/').content
+        settings.FAST_SERIALIZATION = True
+        fast = authenticated_client.get('/api/products/', params).content
+        fast_categories = authenticated_client.get('/api/products/categories/').content
+
+        assert regular == fast
+        assert regular_categories == fast_categories
+
     def test_create_product(self, authenticated_client, category):
         data = {
             'name': 'New Product',
@@ -127,4 +300,838 @@ class TestProductAPI:
         
         response = authenticated_client.post('/api/products/bulk_upload/', data, format='json')
         assert response.status_code == status.HTTP_201_CREATED
-        assert len(response.data) == 2
\ No newline at end of file
+        assert len(response.data) == 2
+
+    def test_bulk_upload_with_idempotency_key_runs_once(self, authenticated_client, category, django_assert_num_queries):
+        data = [{'name': 'Once', 'price': '10.00', 'sku': 'ONCE-001', 'categories': [category.id]}]
+        first = authenticated_client.post('/api/products/bulk_upload/', data, format='json', HTTP_IDEMPOTENCY_KEY='upload-1')
+        assert first.status_code == status.HTTP_201_CREATED
+
+        # Token and key lookups only: the upload isn't validated or run again
+        with django_assert_num_queries(2):
+            replay = authenticated_client.post('/api/products/bulk_upload/', data, format='json', HTTP_IDEMPOTENCY_KEY='upload-1')
+        assert replay.status_code == status.HTTP_201_CREATED
+        assert replay.json() == first.json()
+        assert replay['Idempotent-Replayed'] == 'true'
+        assert Product.objects.filter(sku='ONCE-001').count() == 1
+
+    def test_bulk_upload_runs_constant_queries(self, authenticated_client, category, django_assert_max_num_queries):
+        other = Category.objects.create(name='Other Category')
+
+        def rows(prefix, count):
+            return [
+                {'name': f'{prefix} {i}', 'price': '5.00', 'sku': f'{prefix}-{i}', 'categories': [category.id, other.id]}
+                for i in range(count)
+            ]
+
+        # token lookup, category lookup, SKU lookup, savepoint, product insert, link insert,
+        # category stats (paths, insert missing, lock, update), release, prefetch
+        with django_assert_max_num_queries(12):
+            response = authenticated_client.post('/api/products/bulk_upload/', rows('SMALL', 3), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+
+        with django_assert_max_num_queries(12):
+            response = authenticated_client.post('/api/products/bulk_upload/', rows('LARGE', 60), format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        assert len(response.data) == 60
+        assert sorted(response.data[0]['categories']) == sorted([category.id, other.id])
+        assert Product.objects.get(sku='LARGE-59').categories.count() == 2
+
+    def test_bulk_upload_reports_errors_per_row(self, authenticated_client, category, product):
+        data = [
+            {'name': 'Fine', 'price': '1.00', 'sku': 'ROW-1', 'categories': [category.id]},
+            {'name': 'Bad category', 'price': '1.00', 'sku': 'ROW-2', 'categories': [999999]},
+            {'name': 'Existing SKU', 'price': '1.00', 'sku': product.sku, 'categories': [category.id]},
+            {'name': 'Repeated SKU', 'price': '1.00', 'sku': 'ROW-1', 'categories': [category.id]},
+            # The row that failed above didn't claim its SKU
+            {'name': 'Fixed row', 'price': '1.00', 'sku': 'ROW-2', 'categories': [category.id]},
+            {'name': 'Not a list', 'price': '1.00', 'sku': 'ROW-3', 'categories': category.id},
+        ]
+
+        response = authenticated_client.post('/api/products/bulk_upload/', data, format='json')
+
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert response.data[0] == {}
+        assert response.data[1]['categories'] == ['Invalid pk "999999" - object does not exist.']
+        assert response.data[2]['sku'] == ['product with this sku already exists.']
+        assert response.data[3]['sku'] == ['product with this sku already exists.']
+        assert response.data[4] == {}
+        assert response.data[5]['categories'] == ['Expected a list of items but got type "int".']
+        assert not Product.objects.filter(sku='ROW-1').exists()
+
+
+@pytest.mark.django_db
+class TestProductImport:
+    def test_import_products_command_upserts_and_creates_categories(self, tmp_path, product):
+        feed = tmp_path / 'catalog.csv'
+        feed.write_text(
+            'sku,name,price,stock_quantity,categories\n'
+            'IMP-1,Bread,2.50,10,Food > Bakery\n'
+            'IMP-2,Milk,1.20,5,Food > Dairy|Fresh\n'
+            f'{product.sku},Renamed,,,\n'
+            'IMP-3,,not-a-price,,\n'
+        )
+        out = StringIO()
+
+        call_command('import_products', str(feed), '--batch-size', '2', stdout=out)
+
+        assert 'rows/sec' in out.getvalue()
+        job = ProductImport.objects.get()
+        assert (job.status, job.rows_committed, job.created_count, job.updated_count, job.failed_count) == (
+            'completed', 4, 2, 1, 1
+        )
+        assert Product.objects.get(sku='IMP-1').categories.get().get_full_path() == 'Food > Bakery'
+        assert sorted(c.get_full_path() for c in Product.objects.get(sku='IMP-2').categories.all()) == ['Food > Dairy', 'Fresh']
+        product.refresh_from_db()
+        assert product.name == 'Renamed'
+        assert product.stock_quantity == 100
+        assert Category.objects.filter(name='Food').count() == 1
+
+    def test_import_products_command_resumes(self, tmp_path):
+        feed = tmp_path / 'catalog.ndjson'
+        feed.write_text(''.join(f'{{"sku": "RES-{i}", "name": "Item {i}", "price": "1.00"}}\n' for i in range(5)))
+        job = ProductImport.objects.create(source=str(feed), format='ndjson', status='failed', rows_committed=3)
+
+        call_command('import_products', str(feed), '--resume', stdout=StringIO())
+
+        job.refresh_from_db()
+        assert job.status == 'completed'
+        assert job.rows_committed == 5
+        assert sorted(Product.objects.values_list('sku', flat=True)) == ['RES-3', 'RES-4']
+
+    def test_import_endpoint_requires_staff(self, authenticated_client, product):
+        feed = f'sku,price,stock_quantity\n{product.sku},0.01,0\n'.encode()
+        response = authenticated_client.post('/api/products/import/', feed, content_type='text/csv')
+        assert response.status_code == status.HTTP_403_FORBIDDEN
+        assert not ProductImport.objects.exists()
+        product.refresh_from_db()
+        assert product.stock_quantity == 100
+
+    def test_chunked_import_endpoint(self, authenticated_client, user):
+        user.is_staff = True
+        user.save()
+        first = b'{"sku": "CH-1", "name": "One", "price": "3.00", "categories": ["Toys > Blocks"]}\n'
+        response = authenticated_client.post('/api/products/import/', first, content_type='application/x-ndjson')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['rows_committed'] == 1
+        job_id = response.data['id']
+
+        response = authenticated_client.post(
+            f'/api/products/import/?job={job_id}&offset=0', b'{"sku": "CH-2"}\n', content_type='application/x-ndjson'
+        )
+        assert response.status_code == status.HTTP_409_CONFLICT
+        assert response.data['rows_committed'] == 1
+
+        second = b'sku,name,price\nCH-2,Two,4.00\n'
+        response = authenticated_client.post(
+            f'/api/products/import/?job={job_id}&offset=1', second, content_type='text/csv'
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['rows_committed'] == 2
+        assert Product.objects.filter(sku__in=['CH-1', 'CH-2']).count() == 2
+
+    def test_out_of_range_values_are_row_errors(self, authenticated_client, user):
+        user.is_staff = True
+        user.save()
+        feed = b'sku,name,price,stock_quantity\n' + b''.join([
+            b'BAD-1,Nan,NaN,1\n',
+            b'BAD-2,Snan,sNaN,1\n',
+            b'BAD-3,Infinite,Infinity,1\n',
+            b'BAD-4,Pricey,100000000.00,1\n',
+            b'BAD-5,Plenty,1.00,2147483648\n',
+            b'OK-1,Fine,99999999.99,2147483647\n',
+        ])
+        response = authenticated_client.post('/api/products/import/', feed, content_type='text/csv')
+
+        assert response.status_code == status.HTTP_200_OK
+        assert (response.data['created_count'], response.data['failed_count']) == (1, 5)
+        assert [error['row'] for error in response.data['errors']] == [1, 2, 3, 4, 5]
+        assert list(Product.objects.filter(sku__in=['OK-1', 'BAD-1']).values_list('sku', flat=True)) == ['OK-1']
+
+    def test_concurrent_chunks_for_one_job_import_once(self):
+        from .importer import ImportConflict, ProductImporter
+        job = ProductImport.objects.create(source='upload:test', format='ndjson')
+        # Both uploads passed the offset check before either committed
+        late = ProductImport.objects.get(pk=job.pk)
+
+        ProductImporter(job).run([{'sku': 'RACE-1', 'name': 'First', 'price': '1.00'}])
+        with pytest.raises(ImportConflict):
+            ProductImporter(late).run([{'sku': 'RACE-2', 'name': 'Second', 'price': '1.00'}])
+
+        late.refresh_from_db()
+        assert (late.status, late.rows_committed, late.created_count) == ('completed', 1, 1)
+        assert list(Product.objects.filter(sku__startswith='RACE-').values_list('sku', flat=True)) == ['RACE-1']
+
+
+@pytest.mark.django_db
+class TestProductExport:
+    def test_export_ndjson_streams_products(self, authenticated_client, product, category):
+        child = Category.objects.create(name='Phones', parent=category)
+        product.categories.add(child)
+
+        response = authenticated_client.get('/api/products/export/')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.streaming
+        assert response['Content-Type'] == 'application/x-ndjson'
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        row = json.loads(lines[0])
+        assert len(lines) == 1
+        assert row['sku'] == 'TEST-001'
+        assert sorted(row['categories']) == ['Test Category', 'Test Category > Phones']
+
+    def test_export_csv_round_trips_through_import(self, authenticated_client, product, category, tmp_path):
+        response = authenticated_client.get('/api/products/export/', {'export_format': 'csv'})
+        assert response['Content-Type'] == 'text/csv'
+        feed = tmp_path / 'export.csv'
+        feed.write_bytes(b''.join(response.streaming_content))
+
+        Product.objects.filter(pk=product.pk).update(name='Changed')
+        call_command('import_products', str(feed), stdout=StringIO())
+
+        product.refresh_from_db()
+        assert product.name == 'Test Product'
+        assert list(product.categories.values_list('name', flat=True)) == ['Test Category']
+
+    def test_export_rejects_unknown_format(self, authenticated_client):
+        response = authenticated_client.get('/api/products/export/', {'export_format': 'xml'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestCatalogCache:
+    def test_product_list_is_cached_until_a_write(self, authenticated_client, product, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        first = authenticated_client.get('/api/products/')
+        second = authenticated_client.get('/api/products/')
+        assert (first['X-Cache'], second['X-Cache']) == ('MISS', 'HIT')
+        assert first.content == second.content
+        assert get_stats() == {'hits': 1, 'misses': 1}
+
+        product.name = 'Renamed'
+        product.save()
+        response = authenticated_client.get('/api/products/')
+        assert response['X-Cache'] == 'MISS'
+        assert response.data['results'][0]['name'] == 'Renamed'
+
+    def test_category_and_m2m_changes_invalidate(self, authenticated_client, product, category):
+        authenticated_client.get(f'/api/products/{product.id}/')
+        category.name = 'Renamed Category'
+        category.save()
+        response = authenticated_client.get(f'/api/products/{product.id}/')
+        assert response['X-Cache'] == 'MISS'
+        assert response.data['categories'][0]['name'] == 'Renamed Category'
+
+        product.categories.clear()
+        response = authenticated_client.get(f'/api/products/{product.id}/')
+        assert response.data['categories'] == []
+
+    def test_bulk_stock_changes_invalidate(self, authenticated_client, product):
+        authenticated_client.get(f'/api/products/{product.id}/')
+        Product.objects.adjust_stock({product.id: -5})
+
+        response = authenticated_client.get(f'/api/products/{product.id}/')
+        assert response['X-Cache'] == 'MISS'
+        assert response.data['stock_quantity'] == 95
+
+    def test_errors_are_not_cached(self, authenticated_client):
+        assert authenticated_client.get('/api/products/999/').status_code == status.HTTP_404_NOT_FOUND
+        response = authenticated_client.get('/api/products/999/')
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+        assert 'X-Cache' not in response
+        assert get_stats() == {'hits': 0, 'misses': 0}
+
+    def test_single_flight_recompute(self):
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'value': 42}
+
+        def read():
+            results.append(get_or_compute('catalog:test:single-flight', compute))
+
+        threads = [threading.Thread(target=read) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert [value for value, _ in results] == [{'value': 42}] * 8
+        assert sum(1 for _, hit in results if not hit) == 1
+
+    def test_process_local_cache_is_refused_outside_debug(self, settings):
+        from .checks import check_catalog_cache_is_shared
+
+        settings.DEBUG = False
+        assert [error.id for error in check_catalog_cache_is_shared(None)] == ['products.E001']
+        # ETags still come from the generations when responses aren't cached
+        settings.CATALOG_CACHE_ENABLED = False
+        assert [error.id for error in check_catalog_cache_is_shared(None)] == ['products.E001']
+
+        settings.CACHES = {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://localhost:6379/0'
+        }}
+        assert check_catalog_cache_is_shared(None) == []
+
+
+@pytest.mark.django_db
+class TestConditionalRequests:
+    def test_product_list_etag_returns_304_without_serializing(self, authenticated_client, product, django_assert_num_queries):
+        response = authenticated_client.get('/api/products/')
+        etag = response['ETag']
+        assert 'must-revalidate' in response['Cache-Control']
+
+        # Only the token lookup: the ETag comes from the cache generations
+        with django_assert_num_queries(1):
+            response = authenticated_client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_304_NOT_MODIFIED
+        assert response['ETag'] == etag
+
+        other = authenticated_client.get('/api/products/', {'page_size': 5})
+        assert other['ETag'] != etag
+
+    def test_etag_changes_on_update_delete_and_membership(self, authenticated_client, product, category):
+        def etag():
+            return authenticated_client.get(f'/api/products/{product.id}/')['ETag']
+
+        seen = {etag()}
+        product.price = '12.00'
+        product.save()
+        seen.add(etag())
+        product.categories.remove(category)
+        seen.add(etag())
+        category.delete()
+        seen.add(etag())
+        assert len(seen) == 4
+
+    def test_delete_is_never_answered_with_304(self, authenticated_client, product, category):
+        response = authenticated_client.get('/api/products/')
+        assert 'Last-Modified' not in response
+        etag = response['ETag']
+
+        Product.objects.create(name='Spare', price='1.00', sku='SPARE-1').delete()
+        product.delete()
+        response = authenticated_client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['results'] == []
+
+
+@pytest.mark.django_db
+class TestCategoryStats:
+    def current_stats(self):
+        empty = (0, 0, None, None)
+        stats = {
+            row.pk: (row.product_count, row.price_sum, row.min_price, row.max_price)
+            for row in CategoryStats.objects.all()
+        }
+        return {pk: stats.get(pk, empty) for pk in Category.objects.values_list('pk', flat=True)}
+
+    def assert_consistent(self):
+        maintained = self.current_stats()
+        call_command('rebuild_category_stats', stdout=StringIO())
+        assert maintained == self.current_stats()
+
+    def test_stats_follow_every_write_path(self, authenticated_client, tmp_path):
+        root = Category.objects.create(name='Root')
+        food = Category.objects.create(name='Food', parent=root)
+        bakery = Category.objects.create(name='Bakery', parent=food)
+        toys = Category.objects.create(name='Toys', parent=root)
+
+        bread = Product.objects.create(name='Bread', price='2.00', sku='ST-1')
+        bread.categories.add(bakery, food)
+        cake = Product.objects.create(name='Cake', price='9.00', sku='ST-2')
+        cake.categories.add(bakery)
+        self.assert_consistent()
+        assert CategoryStats.objects.get(pk=root.pk).product_count == 2
+
+        cake.price = '1.50'
+        cake.save()
+        self.assert_consistent()
+        bread.is_active = False
+        bread.save()
+        self.assert_consistent()
+        bread.is_active = True
+        bread.save()
+
+        cake.categories.remove(bakery)
+        toys.products.add(cake, bread)
+        self.assert_consistent()
+        bakery.products.clear()
+        self.assert_consistent()
+
+        toys.parent = food
+        toys.save()
+        self.assert_consistent()
+
+        response = authenticated_client.post('/api/products/bulk_upload/', [
+            {'name': 'Ball', 'price': '4.00', 'sku': 'ST-3', 'categories': [toys.id]},
+        ], format='json')
+        assert response.status_code == status.HTTP_201_CREATED
+        feed = tmp_path / 'feed.csv'
+        feed.write_text('sku,price,categories\nST-1,20.00,Root > Fresh\n')
+        call_command('import_products', str(feed), stdout=StringIO())
+        self.assert_consistent()
+
+        cake.delete()
+        toys.delete()
+        self.assert_consistent()
+        assert CategoryStats.objects.get(pk=root.pk).max_price == Decimal('20.00')
+
+    def test_average_price_endpoint_reads_stats(self, authenticated_client, category, product, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        child = Category.objects.create(name='Child', parent=category)
+        for i, price in enumerate(['1.00', '2.00', '30.00']):
+            Product.objects.create(name=f'Stat {i}', price=price, sku=f'STAT-{i}').categories.add(child)
+
+        response = authenticated_client.get(
+            f'/api/products/categories/{category.id}/average-price/', {'stats': 'min,max,median'}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data['total_products'] == 4
+        assert response.data['average_price'] == Decimal('11.00')
+        assert (response.data['min_price'], response.data['max_price']) == (Decimal('1.00'), Decimal('30.00'))
+        assert response.data['median_price'] == Decimal('6.50')
+
+        response = authenticated_client.get(
+            f'/api/products/categories/{category.id}/average-price/', {'stats': 'mode'}
+        )
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestQueryPlans:
+    def test_catalog_queries_use_indexes(self, category, product):
+        child = Category.objects.create(name='Child', parent=category)
+        descendants = category.get_descendants(include_self=True)
+        querysets = {
+            'product page': Product.objects.filter(is_active=True).order_by('id')[:50],
+            'category subtree': descendants,
+            'category children': Category.objects.filter(parent=category).order_by('name'),
+            'category products': Product.objects.filter(categories__in=descendants, is_active=True).distinct(),
+            'category ancestors': Category.objects.filter(pk__in=child.get_ancestor_ids()),
+        }
+        assert {name: full_scans(queryset) for name, queryset in querysets.items()} == {
+            name: [] for name in querysets
+        }
+
+
+@pytest.mark.django_db
+class TestProductSearch:
+    def search(self, client, **params):
+        response = client.get('/api/products/search/', params)
+        assert response.status_code == status.HTTP_200_OK
+        return [item['sku'] for item in response.data['results']]
+
+    def test_search_ranks_prefix_matches(self, authenticated_client, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        Product.objects.create(name='Garden hose', description='Works with any wireless sprinkler', price='5.00', sku='GH-1')
+        Product.objects.create(name='Wireless headphones', description='Over-ear', price='50.00', sku='WH-1')
+        Product.objects.create(name='Wired headphones', price='20.00', sku='WD-1')
+        Product.objects.create(name='Wireless mouse', price='15.00', sku='WM-1', is_active=False)
+
+        assert self.search(authenticated_client, q='wireless') == ['WH-1', 'GH-1']
+        assert self.search(authenticated_client, q='wirel head') == ['WH-1']
+        assert self.search(authenticated_client, q='wd') == ['WD-1']
+        # Punctuation is stripped rather than passed on as query syntax
+        assert self.search(authenticated_client, q='"headphones" (wired') == ['WD-1']
+
+    def test_index_follows_saves_and_deletes(self, authenticated_client, product):
+        assert self.search(authenticated_client, q='product') == [product.sku]
+
+        product.name = 'Renamed gadget'
+        product.save()
+        assert self.search(authenticated_client, q='product') == []
+        assert self.search(authenticated_client, q='gadg') == [product.sku]
+
+        Product.objects.filter(pk=product.pk).update(description='Shiny')
+        assert self.search(authenticated_client, q='shiny') == [product.sku]
+
+        product.delete()
+        assert self.search(authenticated_client, q='gadget') == []
+
+    def test_search_filters_by_category_subtree(self, authenticated_client, category):
+        child = Category.objects.create(name='Child', parent=category)
+        other = Category.objects.create(name='Other')
+        inside = Product.objects.create(name='Lamp one', price='1.00', sku='L-1')
+        inside.categories.add(child)
+        outside = Product.objects.create(name='Lamp two', price='1.00', sku='L-2')
+        outside.categories.add(other)
+
+        assert self.search(authenticated_client, q='lamp', category=category.id) == ['L-1']
+        assert self.search(authenticated_client, q='lamp', category=other.id) == ['L-2']
+        assert authenticated_client.get('/api/products/search/', {'q': 'lamp', 'category': 999}).status_code == 400
+
+    def test_search_requires_terms(self, authenticated_client):
+        response = authenticated_client.get('/api/products/search/', {'q': ' -- '})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_search_uses_the_index(self, product):
+        from .search import search_products
+
+        assert full_scans(search_products(Product.objects.filter(is_active=True), ['test'])) == []
+
+
+@pytest.mark.django_db
+class TestProductFacets:
+    @pytest.fixture
+    def catalog(self):
+        electronics = Category.objects.create(name='Electronics')
+        phones = Category.objects.create(name='Phones', parent=electronics)
+        audio = Category.objects.create(name='Audio', parent=electronics)
+        books = Category.objects.create(name='Books')
+        rows = [
+            ('P-1', '10.00', 5, phones), ('P-2', '30.00', 0, phones), ('P-3', '120.00', 2, audio),
+            ('P-4', '600.00', 1, audio), ('B-1', '12.00', 3, books),
+        ]
+        for sku, price, stock, category in rows:
+            Product.objects.create(name=sku, price=price, stock_quantity=stock, sku=sku).categories.add(category)
+        Product.objects.create(name='Hidden', price='10.00', sku='H-1', is_active=False).categories.add(phones)
+        return {'electronics': electronics, 'phones': phones, 'audio': audio, 'books': books}
+
+    def test_filters(self, authenticated_client, catalog):
+        def skus(**params):
+            response = authenticated_client.get('/api/products/', params)
+            assert response.status_code == status.HTTP_200_OK
+            return [item['sku'] for item in response.data['results']]
+
+        assert skus(category=catalog['electronics'].id) == ['P-1', 'P-2', 'P-3', 'P-4']
+        assert skus(category=catalog['electronics'].id, price_min='20', price_max='200') == ['P-2', 'P-3']
+        assert skus(in_stock='true', price_max='50') == ['P-1', 'B-1']
+        assert skus(in_stock='false') == ['P-2']
+        # Inactive products stay hidden from regular users
+        assert skus(is_active='false') == []
+        assert authenticated_client.get('/api/products/', {'price_min': 'cheap', 'category': 'x'}).data.keys() == {
+            'price_min', 'category'
+        }
+        for params in ({'price_min': 'NaN'}, {'price_max': 'sNaN'}, {'price_min': 'Infinity'}, {'category': '\u00b2'}):
+            response = authenticated_client.get('/api/products/', params)
+            assert response.status_code == status.HTTP_400_BAD_REQUEST, params
+            assert response.data.keys() == params.keys()
+
+    def test_staff_can_filter_inactive(self, authenticated_client, user, catalog):
+        user.is_staff = True
+        user.save()
+        response = authenticated_client.get('/api/products/', {'is_active': 'false'})
+        assert [item['sku'] for item in response.data['results']] == ['H-1']
+
+    def test_staff_results_are_not_cached_for_customers(self, authenticated_client, user, catalog, django_user_model):
+        user.is_staff = True
+        user.save()
+        staff = authenticated_client.get('/api/products/', {'is_active': 'false', 'facets': 'true'})
+        assert [item['sku'] for item in staff.data['results']] == ['H-1']
+
+        customer = APIClient()
+        customer.force_authenticate(django_user_model.objects.create_user(username='customer', password='pass12345'))
+        response = customer.get('/api/products/', {'is_active': 'false', 'facets': 'true'})
+        assert response['X-Cache'] == 'MISS'
+        assert response.data['results'] == []
+        assert response.data['facets']['in_stock'] == {'true': 0, 'false': 0}
+
+    def test_facet_counts(self, authenticated_client, catalog, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        response = authenticated_client.get('/api/products/', {
+            'facets': 'true', 'category': catalog['electronics'].id, 'in_stock': 'true',
+        })
+        assert response.status_code == status.HTTP_200_OK
+        assert [item['sku'] for item in response.data['results']] == ['P-1', 'P-3', 'P-4']
+        facets = response.data['facets']
+        # Each family ignores its own filter
+        assert facets['in_stock'] == {'true': 3, 'false': 1}
+        assert facets['categories'] == [
+            {'id': catalog['audio'].id, 'name': 'Audio', 'count': 2},
+            {'id': catalog['phones'].id, 'name': 'Phones', 'count': 1},
+        ]
+        assert [band['count'] for band in facets['price']] == [1, 0, 0, 1, 0, 1]
+        assert facets['price'][0] == {'min': '0.00', 'max': '25.00', 'count': 1}
+        assert facets['price'][-1]['max'] is None
+
+        root_facets = authenticated_client.get('/api/products/', {'facets': '1'}).data['facets']
+        assert root_facets['categories'] == [
+            {'id': catalog['books'].id, 'name': 'Books', 'count': 1},
+            {'id': catalog['electronics'].id, 'name': 'Electronics', 'count': 4},
+        ]
+        assert 'facets' not in authenticated_client.get('/api/products/').data
+
+    def test_facets_are_cached_per_filter_signature(self, authenticated_client, catalog, django_assert_num_queries):
+        params = {'facets': 'true', 'in_stock': 'true', 'page_size': 1}
+        first = authenticated_client.get('/api/products/', params).data['facets']
+        # Another page of the same filters only pays for the page itself
+        with django_assert_num_queries(6):
+            second = authenticated_client.get('/api/products/', {**params, 'page': 2}).data['facets']
+        assert first == second
+
+        Product.objects.filter(sku='P-2').update(stock_quantity=4)
+        invalidate('product')
+        third = authenticated_client.get('/api/products/', {**params, 'page': 3}).data['facets']
+        assert third['in_stock'] == {'true': 5, 'false': 0}
+
+
+@pytest.mark.django_db
+class TestPaginationCountModes:
+    @pytest.fixture
+    def products(self, category):
+        for i in range(5):
+            Product.objects.create(name=f'Product {i}', price='1.00', sku=f'SKU-{i}').categories.add(category)
+
+    def count_queries(self, captured):
+        return [query['sql'] for query in captured if 'COUNT(' in query['sql'] and 'MAX(' not in query['sql']]
+
+    def test_no_count_uses_lookahead_row(self, authenticated_client, products):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as captured:
+            response = authenticated_client.get('/api/products/', {'count': 'none', 'page_size': 2, 'page': 2})
+        assert self.count_queries(captured) == []
+        assert response.data['count'] is None
+        assert response.data['total_pages'] is None
+        assert [item['sku'] for item in response.data['results']] == ['SKU-2', 'SKU-3']
+        assert response.data['has_next'] and response.data['has_previous']
+
+        last = authenticated_client.get('/api/products/', {'count': 'none', 'page_size': 2, 'page': 3}).data
+        assert [item['sku'] for item in last['results']] == ['SKU-4']
+        assert not last['has_next'] and last['next'] is None
+        assert authenticated_client.get('/api/products/', {'count': 'none', 'page_size': 2, 'page': 4}).status_code == 404
+
+    def test_cached_count(self, authenticated_client, category, products):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        url = f'/api/products/categories/{category.id}/products/'
+        # Category products count in cached mode unless asked otherwise
+        assert authenticated_client.get(url, {'page_size': 2}).data['count'] == 5
+        Product.objects.create(name='Late', price='1.00', sku='LATE').categories.add(category)
+        with CaptureQueriesContext(connection) as captured:
+            response = authenticated_client.get(url, {'page_size': 2, 'page': 2})
+        assert self.count_queries(captured) == []
+        assert response.data['count'] == 5
+        assert response.data['next'] is not None
+        assert authenticated_client.get(url, {'page_size': 2, 'count': 'exact'}).data['count'] == 6
+
+    def test_estimated_count_falls_back_to_counting(self, authenticated_client, products):
+        response = authenticated_client.get('/api/products/', {'count': 'estimated', 'page_size': 2})
+        assert response.data['count'] == 5
+        assert response.data['total_pages'] == 3
+
+    def test_unknown_count_mode(self, authenticated_client):
+        response = authenticated_client.get('/api/products/', {'count': 'maybe'})
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.django_db
+class TestKeysetPagination:
+    @pytest.fixture
+    def products(self, category):
+        # Repeated prices make the id tiebreaker matter
+        for i, price in enumerate(['5.00', '1.00', '3.00', '1.00', '5.00', '2.00', '1.00']):
+            Product.objects.create(name=f'Product {i}', price=price, sku=f'SKU-{i}').categories.add(category)
+        return list(Product.objects.order_by('price', 'id').values_list('sku', flat=True))
+
+    def walk(self, client, url, params):
+        skus, pages = [], []
+        response = client.get(url, params)
+        while True:
+            assert response.status_code == status.HTTP_200_OK
+            pages.append(response.data)
+            skus.extend(item['sku'] for item in response.data['results'])
+            if not response.data['next']:
+                return skus, pages
+            response = client.get(response.data['next'])
+
+    def test_walks_forwards_and_backwards(self, authenticated_client, products, settings):
+        settings.QUERY_BUDGET_ACTION = 'raise'
+        skus, pages = self.walk(authenticated_client, '/api/products/', {'paginate': 'keyset', 'ordering': 'price', 'page_size': 3})
+        assert skus == products
+        assert len(pages) == 3 and 'count' not in pages[0]
+        assert pages[0]['previous'] is None
+
+        back = authenticated_client.get(pages[2]['previous']).data
+        assert [item['sku'] for item in back['results']] == products[3:6]
+        assert back['next'] and back['previous']
+
+        skus, _ = self.walk(authenticated_client, '/api/products/', {'paginate': 'keyset', 'ordering': '-price', 'page_size': 2})
+        assert skus == list(Product.objects.order_by('-price', '-id').values_list('sku', flat=True))
+
+        skus, _ = self.walk(authenticated_client, '/api/products/', {'paginate': 'keyset', 'ordering': '-created_at', 'page_size': 3})
+        assert skus == list(Product.objects.order_by('-created_at', '-id').values_list('sku', flat=True))
+
+    def test_category_products(self, authenticated_client, category, products):
+        url = f'/api/products/categories/{category.id}/products/'
+        skus, _ = self.walk(authenticated_client, url, {'paginate': 'keyset', 'ordering': 'price', 'page_size': 4})
+        assert skus == products
+        # Page-number requests honour the ordering as well
+        response = authenticated_client.get(url, {'ordering': 'price', 'page_size': 4})
+        assert [item['sku'] for item in response.data['results']] == products[:4]
+
+    def test_rejects_bad_cursor_and_ordering(self, authenticated_client, products):
+        assert authenticated_client.get('/api/products/', {'cursor': 'garbage'}).status_code == 404
+        first = authenticated_client.get('/api/products/', {'paginate': 'keyset', 'ordering': 'price', 'page_size': 2}).data
+        # A cursor taken under one ordering can't be reused under another
+        assert authenticated_client.get(first['next'].replace('ordering=price', 'ordering=name')).status_code == 404
+        assert authenticated_client.get('/api/products/', {'ordering': 'stock_quantity'}).status_code == 400
+
+    def test_keyset_pages_use_an_index(self, products):
+        from common.pagination import keyset_filter
+
+        for ordering in (('price', 'id'), ('-created_at', '-id'), ('name', 'id')):
+            row = Product.objects.order_by(*ordering)[2]
+            values = [getattr(row, field.lstrip('-')) for field in ordering]
+            page = Product.objects.filter(is_active=True).filter(keyset_filter(ordering, values)).order_by(*ordering)[:3]
+            assert full_scans(page) == []
+
+    def test_benchmark_command(self, products):
+        out = StringIO()
+        call_command('benchmark_pagination', pages='1,20,500', page_size=5, seed=100, repeat=1, stdout=out)
+        output = out.getvalue()
+        assert 'Seeded 100 products' in output
+        assert 'page       1: offset' in output and 'page      20: offset' in output
+        assert 'page     500: skipped' in output
+        assert Product.objects.count() == 7
+
+
+@pytest.mark.django_db
+class TestInventoryLedger:
+    def ledger_total(self, product):
+        from django.db.models import Sum
+        return product.inventory_movements.aggregate(total=Sum('quantity'))['total']
+
+    def test_every_stock_change_is_recorded(self, authenticated_client, user, category):
+        from .models import InventoryMovement
+
+        product = Product.objects.create(name='Ledgered', price='2.00', sku='LEDGER', stock_quantity=20)
+        product.categories.add(category)
+        order = authenticated_client.post(
+            '/api/orders/', {'items': [{'product_id': product.id, 'quantity': 3}]}, format='json'
+        ).data
+        authenticated_client.post(f"/api/orders/{order['id']}/cancel/")
+        authenticated_client.post('/api/orders/reservations/', {'items': [{'product_id': product.id, 'quantity': 4}]}, format='json')
+        product.refresh_from_db()
+        product.stock_quantity += 6
+        product.save()
+
+        kinds = list(product.inventory_movements.order_by('id').values_list('kind', 'quantity', 'reference'))
+        assert kinds == [
+            ('restock', 20, ''),
+            ('sale', -3, order['order_number']),
+            ('cancel', 3, ''),
+            ('reservation', -4, ''),
+            ('adjustment', 6, ''),
+        ]
+        product.refresh_from_db()
+        assert self.ledger_total(product) == product.stock_quantity == 22
+        assert InventoryMovement.objects.count() == 5
+
+    def test_save_records_what_it_overwrites(self, product, django_assert_num_queries):
+        stale = Product.objects.get(pk=product.pk)
+        Product.objects.adjust_stock({product.pk: -10}, 'sale')
+
+        # Stock untouched: a stale instance saves its other fields without reading or undoing the sale
+        stale.name = 'Renamed'
+        with django_assert_num_queries(5):  # the UPDATE between two category stats snapshots
+            stale.save()
+        product.refresh_from_db()
+        assert (product.name, product.stock_quantity) == ('Renamed', 90)
+
+        # Stock set: the movement is measured against the locked current value, not the stale one
+        stale.stock_quantity = 120
+        stale.save()
+        assert list(product.inventory_movements.order_by('id').values_list('kind', 'quantity')) == [
+            ('restock', 100), ('sale', -10), ('adjustment', 30)
+        ]
+        assert self.ledger_total(product) == 120
+
+    def test_import_records_stock_differences(self, tmp_path, product):
+        feed = tmp_path / 'feed.csv'
+        feed.write_text(f'sku,name,price,stock_quantity\n{product.sku},,,70\nNEW-1,New,1.00,5\n')
+        call_command('import_products', str(feed), stdout=StringIO())
+        assert list(product.inventory_movements.order_by('id').values_list('kind', 'quantity')) == [
+            ('restock', 100), ('adjustment', -30)
+        ]
+        assert self.ledger_total(Product.objects.get(sku='NEW-1')) == 5
+
+    def test_stock_at_time_with_compaction(self, authenticated_client, product):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .inventory import compact, stock_at
+        from .models import InventoryMovement, InventorySnapshot
+
+        start = timezone.now()
+        moments = []
+        for delta in (-10, 5, -20):
+            Product.objects.adjust_stock({product.id: delta})
+            moments.append(timezone.now())
+        # Age the movements so they can be compacted, then keep moving
+        InventoryMovement.objects.filter(product=product).update(created_at=F('created_at') - timedelta(hours=1))
+        moments = [moment - timedelta(hours=1) for moment in moments]
+
+        assert compact(lag=timedelta(minutes=5)) == 1
+        assert compact(lag=timedelta(minutes=5)) == 0
+        snapshot = InventorySnapshot.objects.get(product=product)
+        assert snapshot.stock_quantity == 75
+
+        Product.objects.adjust_stock({product.id: 7})
+        assert [stock_at(product.id, moment) for moment in moments] == [90, 95, 75]
+        assert stock_at(product.id, timezone.now()) == 82
+        assert stock_at(product.id, start - timedelta(days=1)) == 0
+
+        response = authenticated_client.get(f'/api/products/{product.id}/stock/', {'at': moments[1].isoformat()})
+        assert response.data['stock_quantity'] == 95
+        assert authenticated_client.get(f'/api/products/{product.id}/stock/').data['stock_quantity'] == 82
+        assert authenticated_client.get(f'/api/products/{product.id}/stock/', {'at': 'yesterday'}).status_code == 400
+
+    def test_stock_at_uses_snapshot_and_indexes(self, product):
+        from django.utils import timezone
+        from .models import InventoryMovement, InventorySnapshot
+
+        at = timezone.now()
+        querysets = {
+            'snapshot': InventorySnapshot.objects.filter(product_id=product.id, taken_at__lte=at).order_by('-taken_at')[:1],
+            'movements': InventoryMovement.objects.filter(product_id=product.id, id__gt=0, created_at__lte=at),
+        }
+        assert {name: full_scans(queryset) for name, queryset in querysets.items()} == {name: [] for name in querysets}
+
+    def test_bulk_stock_adjustment(self, authenticated_client, user, category, django_assert_max_num_queries):
+        products = Product.objects.bulk_create([
+            Product(name=f'Bulk {i}', price='1.00', sku=f'BULK-{i}', stock_quantity=10) for i in range(1000)
+        ])
+        payload = {
+            'kind': 'restock',
+            'reference': 'PO-42',
+            'adjustments': [{'product_id': product.id, 'delta': 1 + i % 3} for i, product in enumerate(products)],
+        }
+        assert authenticated_client.post('/api/products/stock/', payload, format='json').status_code == 403
+
+        user.is_staff = True
+        user.save()
+        # 1,000 products: one locking read and five chunked UPDATE + ledger insert pairs, plus auth and savepoints
+        with django_assert_max_num_queries(20):
+            response = authenticated_client.post('/api/products/stock/', payload, format='json')
+        assert response.status_code == status.HTTP_200_OK
+        assert response.data == {'updated': 1000}
+        assert list(Product.objects.filter(sku__in=['BULK-0', 'BULK-1', 'BULK-2']).order_by('id').values_list('stock_quantity', flat=True)) == [11, 12, 13]
+        assert products[0].inventory_movements.get().reference == 'PO-42'
+
+    def test_bulk_stock_adjustment_is_all_or_nothing(self, authenticated_client, user, product):
+        user.is_staff = True
+        user.save()
+        response = authenticated_client.post('/api/products/stock/', {'adjustments': [
+            {'product_id': product.id, 'delta': 5},
+            {'product_id': product.id, 'delta': -200},
+            {'product_id': 999999, 'delta': 1},
+        ]}, format='json')
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert len(response.data['adjustments']) == 2
+        product.refresh_from_db()
+        assert product.stock_quantity == 100
+
+        assert authenticated_client.post('/api/products/stock/', {'adjustments': [{'product_id': product.id}]}, format='json').status_code == 400
+        assert authenticated_client.post('/api/products/stock/', {'kind': 'sale', 'adjustments': []}, format='json').status_code == 400
+
+    def test_compact_command(self, product):
+        out = StringIO()
+        call_command('compact_inventory', lag=0, stdout=out)
+        assert 'Wrote 1 inventory snapshots' in out.getvalue()
@@ -0,0 +1,121 @@
+from django.db import connection
+from django.db.models import Q
+
+PATH_SEPARATOR = '/'
+
+
+def build_path(parent_path, pk):
+    """Returns the materialized path for a node (e.g. '1/5/9/')"""
+    return f"{parent_path or ''}{pk}{PATH_SEPARATOR}"
+
+
+def path_to_ids(path):
+    """Returns the ids encoded in a materialized path, root first"""
+    return [int(part) for part in path.split(PATH_SEPARATOR) if part]
+
+
+def subtree_filter(path, field='path'):
+    """
+    Q matching `path` and everything below it.
+
+    SQLite gets a range ('1/5/' <= path < '1/50'), since its LIKE can't use the
+    path index; its BINARY collation compares bytes, so the range is exact.
+    Elsewhere a locale collation may order '/' differently (or ignore it), so
+    it's a prefix match instead, which Postgres answers from the varchar_pattern_ops
+    index Django adds next to the path index.
+    """
+    if connection.vendor == 'sqlite':
+        upper = path[:-len(PATH_SEPARATOR)] + chr(ord(PATH_SEPARATOR) + 1)
+        return Q(**{f'{field}__gte': path, f'{field}__lt': upper})
+    return Q(**{f'{field}__startswith': path})
+
+
+def compute_paths(rows):
+    """
+    Computes (path, depth) for every node from (id, parent_id) pairs.
+    Works on the whole forest in memory, so it needs a single query to feed it.
+    """
+    children = {}
+    for pk, parent_id in rows:
+        children.setdefault(parent_id, []).append(pk)
+
+    paths = {}
+    stack = [(pk, '', 0) for pk in children.get(None, [])]
+    while stack:
+        pk, parent_path, depth = stack.pop()
+        path = build_path(parent_path, pk)
+        paths[pk] = (path, depth)
+        stack.extend((child, path, depth + 1) for child in children.get(pk, []))
+    return paths
+
+
+def rebuild_category_paths(category_model, batch_size=500):
+    """Recomputes path/depth for every category; returns the number of rows changed"""
+    rows = category_model.objects.values_list('id', 'parent_id', 'path', 'depth')
+    current = {pk: (path, depth) for pk, _, path, depth in rows}
+    paths = compute_paths((pk, parent_id) for pk, parent_id, _, _ in rows)
+
+    changed = []
+    for pk, (path, depth) in paths.items():
+        if current[pk] != (path, depth):
+            changed.append(category_model(id=pk, path=path, depth=depth))
+
+    category_model.objects.bulk_update(changed, ['path', 'depth'], batch_size=batch_size)
+    return len(changed)
+
+
+class CategoryTree:
+    """
+    In-memory index over a set of category subtrees and their ancestors.
+    Lets serializers resolve children and full paths without further queries.
+    """
+
+    def __init__(self, nodes, complete_ids):
+        self.nodes = {node.pk: node for node in nodes}
+        # Ids whose whole subtree has been loaded
+        self.complete_ids = set(complete_ids)
+        self.children = {}
+        for node in sorted(self.nodes.values(), key=lambda node: (node.name, node.pk)):
+            self.children.setdefault(node.parent_id, []).append(node)
+
+    @classmethod
+    def for_categories(cls, categories):
+        """Loads the subtrees of the given categories (plus their ancestors) in at most two queries"""
+        from .models import Category
+
+        roots = {category.pk: category for category in categories}
+        if not roots:
+            return cls([], [])
+
+        # Nested subtrees are covered by their top-most prefix
+        prefixes = sorted({category.path for category in roots.values()})
+        top_prefixes = []
+        for prefix in prefixes:
+            if not top_prefixes or not prefix.startswith(top_prefixes[-1]):
+                top_prefixes.append(prefix)
+
+        condition = Q()
+        for prefix in top_prefixes:
+            condition |= subtree_filter(prefix)
+        nodes = list(Category.objects.filter(condition))
+        loaded = {node.pk for node in nodes}
+
+        missing_ancestors = {
+            pk for category in roots.values() for pk in path_to_ids(category.path)
+        } - loaded
+        if missing_ancestors:
+            nodes.extend(Category.objects.filter(pk__in=missing_ancestors))
+        return cls(nodes, loaded)
+
+    def covers(self, categories):
+        return all(category.pk in self.complete_ids for category in categories)
+
+    def children_of(self, category):
+        return self.children.get(category.pk, [])
+
+    def full_path(self, category):
+        names = [
+            self.nodes[pk].name for pk in path_to_ids(category.path)[:-1] if pk in self.nodes
+        ]
+        names.append(category.name)
+        return ' > '.join(names)
@@ -1,51 +1,221 @@
 # products/views.py
+from functools import partial
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework.permissions import IsAuthenticated
-from django.db.models import Avg
-from .models import Category, Product
-from .serializers import CategorySerializer, ProductSerializer, ProductCreateSerializer
-from common.pagination import StandardResultsSetPagination, LargeResultsSetPagination, SmallResultsSetPagination
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from django.db import DatabaseError
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .cache import CachedReadMixin
+from .importer import CONTENT_TYPES, CSVFeedParser, ImportConflict, NDJSONFeedParser, ProductImporter, iter_request_lines, iter_rows
+from .facets import filter_conditions, get_facets, parse_filters
+from .inventory import apply_adjustments, stock_at
+from .models import Category, CategoryStats, Product, ProductImport
+from .search import parse_terms, search_products
+from .stats import median_price
+from .tree import CategoryTree
+from .serializers import CategorySerializer, ProductSerializer, ProductCreateSerializer, ProductImportSerializer
+from common.pagination import KeysetPaginationMixin, StandardResultsSetPagination, LargeResultsSetPagination, SmallResultsSetPagination
+from common.conditional import ConditionalGetMixin
+from common.idempotency import IdempotencyMixin
+from common.query_budget import QueryBudgetMixin
+from common.streaming import EXPORT_FORMATS, streaming_export
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+EXPORT_CHUNK_SIZE = 2000
+EXTRA_PRICE_STATS = {'min', 'max', 'median'}
+MAX_STOCK_ADJUSTMENTS = 10000
+STOCK_ADJUSTMENT_KINDS = ('restock', 'adjustment')
+PRODUCT_EXPORT_FIELDS = [
+    'id', 'sku', 'name', 'description', 'price', 'stock_quantity',
+    'is_active', 'categories', 'created_at', 'updated_at'
+]
+
+PRODUCT_ORDERING_FIELDS = ('id', 'price', 'name', 'created_at')
+
+
+class CategoryViewSet(QueryBudgetMixin, ConditionalGetMixin, CachedReadMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
     permission_classes = [IsAuthenticated]  # Changed from IsAuthenticatedOrReadOnly
     pagination_class = SmallResultsSetPagination
-    
+    query_budget = {'list': 5, 'retrieve': 4, 'products': 7}
+    # The subtree listing counts over a DISTINCT join; a briefly stale count is fine there
+    pagination_count_mode = {'products': 'cached'}
+    # Keyset pages and ?ordering= apply to the category's products
+    keyset_actions = ('products',)
+    ordering_fields = PRODUCT_ORDERING_FIELDS
+    ordering = ('id',)
+    cached_actions = ('list', 'retrieve', 'products')
+    conditional_actions = ('list', 'retrieve', 'products')
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # ?roots=true pages over top-level categories only, each with its full subtree
+        if self.action == 'list' and self.request.query_params.get('roots') in ('1', 'true'):
+            queryset = queryset.filter(parent__isnull=True)
+        return queryset
+
     @action(detail=True, methods=['get'])
     def products(self, request, pk=None):
         """Get all products in this category and its subcategories"""
+        return self.conditional_response(partial(self.cached_response, self.category_products), request, pk=pk)
+
+    def category_products(self, request, pk=None):
         category = self.get_object()
-        all_categories = [category] + category.get_all_children()
-        products = Product.objects.filter(categories__in=all_categories, is_active=True).distinct()
+        all_categories = category.get_descendants(include_self=True)
+        products = self.order_queryset(Product.objects.filter(
+            categories__in=all_categories, is_active=True
+        ).distinct().order_by('id').prefetch_related('categories'))
         
         # Apply pagination to the action
         page = self.paginate_queryset(products)
         if page is not None:
-            serializer = ProductSerializer(page, many=True)
+            serializer = ProductSerializer(page, many=True, context=self.get_serializer_context())
             return self.get_paginated_response(serializer.data)
         
-        serializer = ProductSerializer(products, many=True)
+        serializer = ProductSerializer(products, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+class ProductViewSet(QueryBudgetMixin, ConditionalGetMixin, CachedReadMixin, IdempotencyMixin, KeysetPaginationMixin, viewsets.ModelViewSet):
+    # Categories (and, via the category tree, their paths) load in a fixed number of queries per page
+    queryset = Product.objects.filter(is_active=True).order_by('id').prefetch_related('categories')
     permission_classes = [IsAuthenticated]  # Changed from IsAuthenticatedOrReadOnly
     pagination_class = LargeResultsSetPagination
+    # Filters add a category lookup; facets one query per family plus the category children
+    query_budget = {'list': 7, 'list_facets': 11, 'retrieve': 5, 'search': 8, 'stock': 5}
+    cached_actions = ('list', 'retrieve', 'search')
+    conditional_actions = ('list', 'retrieve', 'search')
+    filtered_actions = ('list', 'search')
+    idempotent_actions = ('create', 'bulk_upload')
+    ordering_fields = PRODUCT_ORDERING_FIELDS
+    ordering = ('id',)
+
+    def wants_facets(self):
+        return self.action == 'list' and self.request.query_params.get('facets') in ('1', 'true')
+
+    def get_budget_key(self):
+        return 'list_facets' if self.wants_facets() else super().get_budget_key()
+
+    def get_filters(self):
+        """?price_min, price_max, category (subtree), in_stock and is_active, parsed once per request"""
+        if not hasattr(self, '_filters'):
+            self._filters = parse_filters(self.request.query_params) if self.action in self.filtered_actions else {}
+        return self._filters
+
+    def sees_inactive(self):
+        # Only staff can look past the active catalog, and only by asking for ?is_active=
+        return 'is_active' in self.get_filters() and self.request.user.is_staff
+
+    def get_base_queryset(self):
+        if self.sees_inactive():
+            return Product.objects.order_by('id').prefetch_related('categories')
+        return super().get_queryset()
+
+    def get_cache_scope(self, request):
+        # Staff and customers get different results for the same ?is_active= URL
+        return 'staff' if self.sees_inactive() else ''
+
+    def get_queryset(self):
+        filters = self.get_filters()
+        queryset = self.get_base_queryset()
+        if self.action == 'list':
+            queryset = self.order_queryset(queryset)
+        return queryset.filter(filter_conditions(filters)) if filters else queryset
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.wants_facets():
+            response.data['facets'] = get_facets(
+                self.get_base_queryset(), self.get_filters(), self.get_cache_scope(self.request)
+            )
+        return response
     
     def get_serializer_class(self):
         if self.action == 'create':
             return ProductCreateSerializer
         return ProductSerializer
-    
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over name, description and SKU: ?q=<terms>, plus the list filters"""
+        return self.conditional_response(partial(self.cached_response, self.search_results), request)
+
+    def search_results(self, request):
+        terms = parse_terms(request.query_params.get('q', ''))
+        if not terms:
+            return Response({'error': 'q must contain at least one word'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # The product filters (?category= etc.) are already applied by get_queryset()
+        products = search_products(self.get_queryset(), terms)
+        page = self.paginate_queryset(products)
+        serializer = self.get_serializer(page if page is not None else products, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def stock(self, request, pk=None):
+        """Current stock, or the stock at ?at=<ISO datetime> from the inventory ledger"""
+        product = self.get_object()
+        at = request.query_params.get('at')
+        if not at:
+            return Response({'product_id': product.pk, 'stock_quantity': product.stock_quantity, 'at': timezone.now()})
+
+        moment = parse_datetime(at)
+        if moment is None:
+            return Response({'error': 'at must be an ISO 8601 datetime'}, status=status.HTTP_400_BAD_REQUEST)
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return Response({'product_id': product.pk, 'stock_quantity': stock_at(product.pk, moment), 'at': moment})
+
+    @action(detail=False, methods=['post'], url_path='stock', permission_classes=[IsAdminUser])
+    def adjust_stock(self, request):
+        """
+        Applies many stock deltas in one call - staff only:
+        {"kind": "restock", "reference": "PO-1", "adjustments": [{"product_id": 1, "delta": 5}, ...]}
+        """
+        data = request.data if isinstance(request.data, dict) else {}
+        adjustments = data.get('adjustments')
+        kind = data.get('kind', 'adjustment')
+        reference = str(data.get('reference') or '')
+        if kind not in STOCK_ADJUSTMENT_KINDS:
+            return Response(
+                {'error': f"kind must be one of: {', '.join(STOCK_ADJUSTMENT_KINDS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not isinstance(adjustments, list) or not 0 < len(adjustments) <= MAX_STOCK_ADJUSTMENTS:
+            return Response(
+                {'error': f'Expected adjustments as a list of 1 to {MAX_STOCK_ADJUSTMENTS} entries'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        deltas = {}
+        for adjustment in adjustments:
+            values = [adjustment.get(key) for key in ('product_id', 'delta')] if isinstance(adjustment, dict) else []
+            if len(values) != 2 or not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+                return Response(
+                    {'error': 'Each adjustment needs an integer product_id and delta'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            deltas[values[0]] = deltas.get(values[0], 0) + values[1]
+
+        try:
+            updated = apply_adjustments(deltas, kind, reference)
+        except DatabaseError:
+            return Response({'error': 'Stock changed while being adjusted, please retry'}, status=status.HTTP_409_CONFLICT)
+        return Response({'updated': updated})
+
     @action(detail=False, methods=['post'])
     def bulk_upload(self, request):
         """Bulk upload products - no pagination needed for creation"""
+        return self.idempotent_response(self.bulk_create_products, request)
+
+    def bulk_create_products(self, request):
         if not isinstance(request.data, list):
             return Response(
                 {'error': 'Expected a list of products'}, 
@@ -58,35 +228,129 @@ class ProductViewSet(viewsets.ModelViewSet):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Streams the catalog as NDJSON (default) or CSV via ?export_format="""
+        fmt = request.query_params.get('export_format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"export_format must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Category paths come from one in-memory tree; products stream in chunks (server-side cursor on Postgres)
+        tree = CategoryTree(Category.objects.all(), [])
+        products = self.get_queryset().iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+        def rows():
+            for product in products:
+                paths = [tree.full_path(category) for category in product.categories.all()]
+                yield {
+                    'id': product.id,
+                    'sku': product.sku,
+                    'name': product.name,
+                    'description': product.description,
+                    'price': product.price,
+                    'stock_quantity': product.stock_quantity,
+                    'is_active': product.is_active,
+                    # Same 'A > B|C' form import_products reads
+                    'categories': '|'.join(paths) if fmt == 'csv' else paths,
+                    'created_at': product.created_at,
+                    'updated_at': product.updated_at,
+                }
+
+        return streaming_export(rows(), fmt, 'products', fieldnames=PRODUCT_EXPORT_FIELDS)
+
+    @action(
+        detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser],
+        parser_classes=[CSVFeedParser, NDJSONFeedParser]
+    )
+    def import_chunk(self, request):
+        """
+        Streams a CSV or NDJSON chunk into the catalog, upserting by SKU.
+        Send ?job=<id>&offset=<rows_committed> to continue an existing import.
+        """
+        fmt = CONTENT_TYPES.get(request.content_type.split(';')[0].strip())
+        if fmt is None:
+            return Response(
+                {'error': f"Expected one of: {', '.join(CONTENT_TYPES)}"},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+
+        job_id = request.query_params.get('job')
+        if job_id:
+            if not job_id.isdigit():
+                return Response({'error': 'job must be an import id'}, status=status.HTTP_400_BAD_REQUEST)
+            job = get_object_or_404(ProductImport, pk=job_id)
+        else:
+            job = ProductImport.objects.create(source=f'upload:{request.user.username}', format=fmt)
+
+        offset = request.query_params.get('offset')
+        if offset is not None and offset != str(job.rows_committed):
+            return Response(
+                {'error': 'Chunk offset does not match the committed row count', 'rows_committed': job.rows_committed},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            batch_size = min(int(request.query_params.get('batch_size', 1000)), 10000)
+        except ValueError:
+            batch_size = 1000
+        start = job.rows_committed
+        try:
+            job = ProductImporter(job, batch_size=max(batch_size, 1)).run(iter_rows(iter_request_lines(request), fmt))
+        except ImportConflict:
+            return Response(
+                {'error': 'Another upload to this import committed first', 'rows_committed': job.rows_committed},
+                status=status.HTTP_409_CONFLICT
+            )
 
-class CategoryAveragePriceView(APIView):
+        data = ProductImportSerializer(job).data
+        data['rows_per_sec'] = round((job.rows_committed - start) / job.elapsed) if job.elapsed else None
+        return Response(data)
+
+
+class CategoryAveragePriceView(QueryBudgetMixin, ConditionalGetMixin, CachedReadMixin, APIView):
     permission_classes = [IsAuthenticated]  # Already authenticated
+    query_budget = {'get': 5}
+    cached_actions = ('get',)
+    conditional_actions = ('get',)
     
     def get(self, request, category_id):
         """Get average product price for a given category"""
+        return self.conditional_response(partial(self.cached_response, self.average_price), request, category_id)
+
+    def average_price(self, request, category_id):
+        requested = {name for name in request.query_params.get('stats', '').split(',') if name}
+        if requested - EXTRA_PRICE_STATS:
+            return Response(
+                {'error': f"stats must be a comma-separated subset of: {', '.join(sorted(EXTRA_PRICE_STATS))}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Precomputed aggregates (products.stats) come along in the same primary key lookup
         try:
-            category = Category.objects.get(id=category_id)
+            category = Category.objects.select_related('stats').get(id=category_id)
         except Category.DoesNotExist:
             return Response(
                 {'error': 'Category not found'}, 
                 status=status.HTTP_404_NOT_FOUND
             )
-        
-        # Get all subcategories
-        all_categories = [category] + category.get_all_children()
-        
-        # Calculate average price
-        avg_price = Product.objects.filter(
-            categories__in=all_categories,
-            is_active=True
-        ).aggregate(avg_price=Avg('price'))['avg_price']
-        
-        return Response({
+        try:
+            stats = category.stats
+        except CategoryStats.DoesNotExist:
+            stats = CategoryStats(category=category)
+
+        data = {
             'category': category.name,
             'category_path': category.get_full_path(),
-            'average_price': round(avg_price, 2) if avg_price else 0,
-            'total_products': Product.objects.filter(
-                categories__in=all_categories,
-                is_active=True
-            ).count()
-        })
\ No newline at end of file
+            'average_price': stats.average_price if stats.product_count else 0,
+            'total_products': stats.product_count,
+        }
+        if 'min' in requested:
+            data['min_price'] = stats.min_price
+        if 'max' in requested:
+            data['max_price'] = stats.max_price
+        if 'median' in requested:
+            data['median_price'] = median_price(category, stats.product_count)
+        return Response(data)